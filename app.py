@@ -6,37 +6,84 @@ You may not use, copy, distribute, modify, or sell this code without the express
 # Import the required modules
 
 # Python Standard Library
-import datetime
 import logging
 import os
 
 # Third Party Modules
+import click
 from dotenv import load_dotenv
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Flask Modules
-from flask import Flask, request, session, redirect, flash
+from flask import Flask, request, session, redirect, flash, g
 
 # Flask Extensions
-from flask_session import Session
 from flask_minify import Minify
 
+# Load the environment variables (before importing the helpers, which read them)
+load_dotenv()
+
+# Page Cache
+from helpers.page_cache import page_cache
+
+# Static Assets
+from helpers import assets
+
+# Sitemap
+from helpers.sitemap import sitemap
+
 # Database
-from helpers.db import client as db_client, users_collection
+from helpers.db import (
+    ensure_indexes,
+    ensure_indexes_in_background,
+    report_indexes,
+)
+from helpers.session_interface import MongoSessionInterface
+
+# Sessions
+from helpers.session_cache import session_cache, session_expires_in
+from helpers.sessions import (
+    find_session,
+    log_out_user_sessions,
+    migrate_embedded_sessions,
+)
 
 # Endpoints
 from endpoints import main_endpoints
 from endpoints.app import main_endpoints as app_main_endpoints
 from endpoints.api import (
     forms_endpoints as api_forms_endpoints,
+    qr_endpoints as api_qr_endpoints,
     users_endpoints as api_users_endpoints,
 )
+from endpoints.internal import metrics_endpoints as internal_metrics_endpoints
+from endpoints.internal import profiling_endpoints as internal_profiling_endpoints
+from endpoints import health_endpoints
+from endpoints import redirect_endpoints
 
-# Import the custom logger and setup function
-from logger import QRLOG_REQUESTS, setup_betterqr_logging
+# Scan counters
+from helpers.scan_counter import scan_counter
 
-# Load the environment variables
-load_dotenv()
+# Outgoing mail
+from helpers.mail import mail_sender
+
+# Session Revocation
+from helpers.revocation import revocation_listener
+
+# QR Codes
+from helpers.qr_codes import recount_codes
+
+# Request instrumentation
+from helpers import metrics
+
+# Admission control
+from helpers.admission import admission
+
+# Request profiling
+from helpers.profiler import request_profiler
+
+# Import the custom logger and setup function
+from helpers.logger import QRLOG_REQUESTS, setup_betterqr_logging
 
 # Create the Flask app and load extensions
 
@@ -44,13 +91,14 @@ load_dotenv()
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1, x_port=1)
 
+# Shed requests that cannot be handled promptly, before they reach anything else
+admission.init_app(app)
+
 # Flask Configuration
 
 app.config["SECRET_KEY"] = os.getenv("secret_key")
 app.config["SESSION_COOKIE_SECURE"] = True
 
-app.config["SESSION_TYPE"] = "mongodb"
-app.config["SESSION_MONGODB"] = db_client
 app.config["SESSION_MONGODB_DB"] = os.getenv("mongodb_db")
 app.config["SESSION_MONGODB_COLLECTION"] = os.getenv("mongodb_session_collection")
 
@@ -61,24 +109,54 @@ app.config["RECAPTCHA_OPTIONS"] = {"theme": "white"}
 
 
 # Extensions
-Minify(app)
-Session(app)
+# Static files are minified by build_assets.py, so only HTML is minified at runtime
+minify = Minify(app, static=False)
+
+# Server-side sessions (the client connects to MongoDB on first use)
+app.session_interface = MongoSessionInterface(
+    app,
+    db=app.config["SESSION_MONGODB_DB"],
+    collection=app.config["SESSION_MONGODB_COLLECTION"],
+)
 
 # Setup custom logging
 setup_betterqr_logging()
 
 
+def start_background_services() -> None:
+    """
+    Starts the background work of a process serving the app. It is called by the entry points that serve
+    requests (this file run as a script, serve_script.py and the benchmark server) rather than on import, so
+    that CLI commands, and the process pool workers that re-import this file, stay free of it.
+
+    Returns:
+        None
+    """
+    # Ensure the database indexes exist, without holding up startup if the database is unreachable
+    ensure_indexes_in_background()
+
+    # Write the scan counters of dynamic QR codes in the background
+    scan_counter.start()
+
+    # Deliver queued emails in the background
+    mail_sender.start()
+
+    # Drop sessions revoked by other workers from the session cache
+    revocation_listener.start()
+
+
 # Custom Error Handlers
 @app.errorhandler(404)
 def page_not_found(_):
     return "The page you are looking for does not exist.", 404
 
 
-# Sitemap
-@app.route("/sitemap.xml")
-def sitemap():
-    with open("sitemap.xml") as sitemap_file:
-        return sitemap_file.read(), 200, {"Content-Type": "application/xml"}
+# Fingerprinted static assets
+assets.init_app(app)
+
+
+# Sitemap (generated from the public routes and served from memory)
+sitemap.init_app(app)
 
 
 # Register all the blueprints
@@ -86,12 +164,36 @@ def sitemap():
 # Normal Endpoints
 app.register_blueprint(main_endpoints.blueprint)
 
+# Health Endpoints
+app.register_blueprint(health_endpoints.blueprint)
+
+# Redirect Endpoints
+app.register_blueprint(redirect_endpoints.blueprint)
+
 # App Endpoints
 app.register_blueprint(app_main_endpoints.blueprint)
 
 # API Endpoints
 app.register_blueprint(api_users_endpoints.blueprint)
 app.register_blueprint(api_forms_endpoints.blueprint)
+app.register_blueprint(api_qr_endpoints.blueprint)
+
+# Internal Endpoints
+app.register_blueprint(internal_metrics_endpoints.blueprint)
+app.register_blueprint(internal_profiling_endpoints.blueprint)
+
+# Cached pages are minified once by the page cache instead of on every response
+page_cache.init_app(app, minify)
+
+
+# Time requests (registered first so that it runs before every other before_request hook)
+@app.before_request
+def start_request_timer():
+    metrics.start_request()
+
+
+# Profile requests on demand (registered before ensure_session, so that it is profiled too)
+request_profiler.init_app(app)
 
 
 # Log requests
@@ -100,6 +202,8 @@ def log_response_info(response):
     # Assuming the real address the "CF-Connecting-IP" header that cloudfare sends
     real_addr = request.headers.get("CF-Connecting-IP", "Unknown")
 
+    stats = metrics.finish_request(request.endpoint or "unmatched")
+
     extra_info = {
         "method": request.method,
         "path": request.path,
@@ -107,6 +211,13 @@ def log_response_info(response):
         "real_addr": real_addr,
         "status": response.status,
     }
+
+    if stats is not None:
+        extra_info["duration"] = round(stats.duration * 1000, 3)
+        extra_info["db_ops"] = stats.db_ops
+        extra_info["db_time"] = round(stats.db_time * 1000, 3)
+        extra_info["external_time"] = round(stats.external_time * 1000, 3)
+
     QRLOG_REQUESTS.info("Response logged", extra=extra_info)
     return response
 
@@ -114,10 +225,32 @@ def log_response_info(response):
 # Ensure session
 @app.before_request
 def ensure_session():
+    # Static files are the same for everyone, and must not Vary on the session cookie,
+    # health checks must not depend on the database, and QR code scans are anonymous
+    if request.endpoint in (
+        "static",
+        "assets",
+        "health._healthz",
+        "health._readyz",
+        "redirect._redirect",
+    ):
+        return
+
     if "sid" not in session:
         return
 
-    query = users_collection.find_one({"sessions.sid": session["sid"]})
+    sid = session["sid"]
+
+    # Sessions validated recently are served from the in-process cache
+    user_uuid = session_cache.get(sid)
+
+    if user_uuid is not None:
+        g.user_uuid = user_uuid
+        return
+
+    # A revocation arriving during the lookup bumps the generation, so the session is not cached after it
+    generation = session_cache.generation
+    query = find_session(sid)
 
     if query is None:
         session.pop("sid")
@@ -134,15 +267,59 @@ def ensure_session():
         )
 
     # Check if the session is more than 30 days old
-    for session_data in query["sessions"]:
-        if session_data["sid"] == session["sid"]:
-            session_start = session_data["created_at"]
-            if (datetime.datetime.now() - session_start).days >= 30:
-                session.pop("sid")
-                flash("Your session has expired. Please log in again.", "warning")
-                return redirect(
-                    "/?utm_source=internal&utm_medium=redirect&utm_campaign=home_redirect&utm_content=logged_out_session_expired"
-                )
+    # (the TTL index removes old sessions, but only runs once a minute)
+    expires_in = session_expires_in(query["created_at"])
+
+    if expires_in <= 0:
+        session.pop("sid")
+        flash("Your session has expired. Please log in again.", "warning")
+        return redirect(
+            "/?utm_source=internal&utm_medium=redirect&utm_campaign=home_redirect&utm_content=logged_out_session_expired"
+        )
+
+    session_cache.set(sid, query["user_uuid"], expires_in, generation)
+    g.user_uuid = query["user_uuid"]
+
+
+# CLI Commands
+@app.cli.command("migrate-sessions")
+def migrate_sessions_command():
+    """Move sessions embedded in user documents into the sessions collection."""
+    migrated = migrate_embedded_sessions()
+    print(f"Migrated {migrated} sessions.")
+
+
+@app.cli.command("sign-out-user")
+@click.argument("user_uuid")
+def sign_out_user_command(user_uuid):
+    """Log out every session of a user, on every worker."""
+    logged_out = log_out_user_sessions(user_uuid)
+    print(f"Logged out {logged_out} sessions.")
+
+
+@app.cli.command("recount-qr-codes")
+def recount_qr_codes_command():
+    """Set every user's QR code counter to the number of codes they own."""
+    changed = recount_codes()
+    print(f"Recounted the QR codes of {changed} users.")
+
+
+@app.cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """Create all registered database indexes and drop retired ones."""
+    ensure_indexes()
+
+
+@app.cli.command("index-report")
+def index_report_command():
+    """Report missing, unexpected and unused database indexes."""
+    for collection_name, report in report_indexes().items():
+        print(f"{collection_name}:")
+        for kind, names in report.items():
+            if names is None:
+                print(f"  {kind}: unavailable")
+            else:
+                print(f"  {kind}: {', '.join(names) or 'none'}")
 
 
 # Disable the werkzeug logger
@@ -151,6 +328,10 @@ log.disabled = True
 
 # Run the built-in development server when run as a script.
 if __name__ == "__main__":
+    # The reloader runs the server in a child process, which is the one to start them in
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
+
     app.run(
         debug=True,
         port=55444,
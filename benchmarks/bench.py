@@ -0,0 +1,672 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This is the offline benchmark and load test. It starts the app on the real waitress server in a separate
+process, backed by mongomock (or a throwaway local mongod) with reCAPTCHA faked, then runs every scenario in
+scenarios.py at the given concurrency. For each scenario it reports the requests per second, the latency
+percentiles of every step and the MongoDB commands per request (from the app's own request metrics). The
+results can be stored as the baseline, and later runs compared against it.
+
+Run it from the repository root:
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench.py                  # run every scenario and print the results
+    python benchmarks/bench.py --save-baseline  # ... and store them in benchmarks/baseline.json
+    python benchmarks/bench.py --compare        # ... and exit with 1 if they regressed from the baseline
+
+mongomock runs every command under one lock (it is not thread-safe), so it measures the app rather than the
+database. Pass --mongodb-uri to use a local mongod instead; the benchmark seeds its users into that server's
+betterqr database and leaves them there, so never point it at a real deployment.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import argparse
+import functools
+import http.client
+import http.cookies
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+# The app lives in the repository root, one directory up
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# Benchmark Modules
+from scenarios import SCENARIOS, BENCHMARK_PASSWORD, user_email
+
+# Constants
+BENCHMARKS_DIR = os.path.join(ROOT_DIR, "benchmarks")
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+SERVER_LOG = os.path.join(BENCHMARKS_DIR, "server.log")
+
+HOST = "127.0.0.1"
+INTERNAL_KEY = "benchmark"
+USER_AGENT = "betterqr-benchmark/1.0"
+
+# Seconds to wait for the server to start, and for any single request
+STARTUP_TIMEOUT = 60
+REQUEST_TIMEOUT = 30
+
+# Latency percentiles reported for every step
+PERCENTILES = (50, 90, 99)
+
+# How much the database commands per request may grow before --compare fails
+DB_OPS_TOLERANCE = 0.05
+
+# The environment of the server process. All the load comes from one address, so the per-client rate limits
+# are lifted; the per-class concurrency caps stay, and requests they shed are reported as errors.
+SERVER_ENV = {
+    "secret_key": "benchmark",
+    "internal_api_key": INTERNAL_KEY,
+    "mongodb_db": "betterqr",
+    "mongodb_session_collection": "flask_sessions",
+    "recaptcha_backend": "fake",
+    "recaptcha_site_key": "benchmark",
+    **{
+        f"admission_{name}_{limit}": "1000000"
+        for name in ("auth", "api", "pages", "redirect")
+        for limit in ("rate", "burst")
+    },
+}
+
+# The mongomock collection methods counted as one MongoDB command each
+MONGOMOCK_COMMANDS = (
+    "aggregate",
+    "bulk_write",
+    "count_documents",
+    "create_index",
+    "create_indexes",
+    "delete_many",
+    "delete_one",
+    "distinct",
+    "drop_index",
+    "find",
+    "find_one",
+    "find_one_and_delete",
+    "find_one_and_replace",
+    "find_one_and_update",
+    "index_information",
+    "insert_many",
+    "insert_one",
+    "list_indexes",
+    "replace_one",
+    "update_many",
+    "update_one",
+)
+
+
+# Server
+
+
+def _use_mongomock() -> None:
+    """
+    Points the app at an in-memory mongomock client, counting its commands like the real command listener.
+    """
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit(
+            "mongomock is not installed: pip install -r benchmarks/requirements.txt, or pass --mongodb-uri."
+        )
+
+    from helpers import db, metrics
+
+    lock = threading.RLock()
+    depth = threading.local()
+
+    def counted(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            # mongomock calls its own methods (find_one calls find), only the outermost call is a command
+            outermost = not getattr(depth, "value", 0)
+            depth.value = getattr(depth, "value", 0) + 1
+            started_at = time.perf_counter()
+
+            try:
+                with lock:
+                    return method(*args, **kwargs)
+            finally:
+                depth.value -= 1
+                if outermost:
+                    metrics.record_db_command(time.perf_counter() - started_at)
+
+        return wrapper
+
+    for name in MONGOMOCK_COMMANDS:
+        method = getattr(mongomock.Collection, name, None)
+        if method is not None:
+            setattr(mongomock.Collection, name, counted(method))
+
+    client = mongomock.MongoClient()
+    db.MongoClient = lambda *args, **kwargs: client
+
+
+def _seed_users(count: int) -> None:
+    """
+    Creates the users the simulated visitors log in as, if they do not exist yet.
+    """
+    import datetime
+
+    from werkzeug.security import generate_password_hash
+
+    from helpers.db import users_collection
+    from helpers.passwords import PASSWORD_HASH_METHOD
+
+    # Hashed with the current parameters, so that logging in never upgrades the hash
+    pwhash = generate_password_hash(BENCHMARK_PASSWORD, method=PASSWORD_HASH_METHOD)
+
+    for index in range(count):
+        email = user_email(index)
+        users_collection.update_one(
+            {"email": email},
+            {
+                "$setOnInsert": {
+                    "uuid": str(uuid.uuid5(uuid.NAMESPACE_URL, email)),
+                    "email": email,
+                    "security": {"password": pwhash},
+                    "created_at": datetime.datetime.now(datetime.UTC),
+                }
+            },
+            upsert=True,
+        )
+
+
+def serve(port: int, threads: int, users: int) -> None:
+    """
+    Runs the app on waitress. Called in the server process, started by start_server.
+    """
+    if os.getenv("benchmark_backend") == "mongomock":
+        _use_mongomock()
+
+    from waitress import create_server
+
+    from app import app, start_background_services
+
+    _seed_users(users)
+    start_background_services()
+
+    server = create_server(app, host=HOST, port=port, threads=threads)
+    server.run()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(options) -> tuple[subprocess.Popen, int]:
+    """
+    Starts the server process and waits for it to answer health checks.
+
+    Args:
+        options (argparse.Namespace): The benchmark options.
+
+    Returns:
+        tuple[subprocess.Popen, int]: The server process and the port it listens on.
+    """
+    port = _free_port()
+
+    env = {
+        **os.environ,
+        **SERVER_ENV,
+        "waitress_threads": str(options.threads),
+        "benchmark_backend": "mongod" if options.mongodb_uri else "mongomock",
+    }
+    if options.mongodb_uri:
+        env["mongodb_uri"] = options.mongodb_uri
+    else:
+        env.pop("mongodb_uri", None)
+        # mongomock has neither change streams nor capped collections to broadcast revocations with
+        env["session_revocation_channel"] = "off"
+    if options.session_cache_ttl is not None:
+        env["session_cache_ttl"] = str(options.session_cache_ttl)
+
+    log = open(SERVER_LOG, "a")
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--serve",
+            str(port),
+            "--threads",
+            str(options.threads),
+            "--concurrency",
+            str(options.concurrency),
+        ],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    log.close()
+
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"The server exited with {process.returncode}, see {SERVER_LOG}.")
+
+        try:
+            connection = http.client.HTTPConnection(HOST, port, timeout=1)
+            connection.request("GET", "/healthz")
+            if connection.getresponse().status == 200:
+                return process, port
+        except OSError:
+            pass
+
+        time.sleep(0.2)
+
+    process.kill()
+    sys.exit(f"The server did not start within {STARTUP_TIMEOUT}s, see {SERVER_LOG}.")
+
+
+def server_totals(port: int) -> dict:
+    """
+    Returns the request and database command counters of the server (see helpers/metrics.py).
+    """
+    connection = http.client.HTTPConnection(HOST, port, timeout=REQUEST_TIMEOUT)
+    connection.request(
+        "GET", "/internal/metrics/", headers={"X-Internal-Key": INTERNAL_KEY}
+    )
+    return json.loads(connection.getresponse().read())["totals"]
+
+
+# Load
+
+
+class VirtualUser:
+    """
+    One simulated visitor: a keep-alive connection, its cookies, and the requests it timed.
+
+    Cookies are kept by hand, as the session cookie is marked Secure and cookie jars would not send it back
+    over plain HTTP. A visitor told to retry later (429 or 503 with Retry-After) waits that long before its
+    next request.
+    """
+
+    def __init__(self, port: int, index: int) -> None:
+        self.connection = http.client.HTTPConnection(
+            HOST, port, timeout=REQUEST_TIMEOUT
+        )
+        self.email = user_email(index)
+        self.cookies = {}
+
+        # Requests are only timed between these two points
+        self.record_from = float("inf")
+        self.record_until = float("inf")
+
+        # (step, seconds, status, expected status) of every timed request
+        self.samples = []
+
+    def request(
+        self,
+        step: str,
+        method: str,
+        path: str,
+        form: dict | None = None,
+        expect: int = 200,
+    ) -> tuple[int, bytes]:
+        """
+        Makes a request, timing it if it falls in the measured window.
+
+        Args:
+            step (str): The step name the request is reported under.
+            method (str): The HTTP method.
+            path (str): The path to request.
+            form (dict | None): A form to post, if any.
+            expect (int): The status a successful request returns; any other counts as an error.
+
+        Returns:
+            tuple[int, bytes]: The status and body of the response (0 if the request failed).
+        """
+        headers = {"User-Agent": USER_AGENT}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        started_at = time.perf_counter()
+
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnects on the next request
+            self.connection.close()
+            response, data = None, b""
+
+        finished_at = time.perf_counter()
+        status = response.status if response is not None else 0
+
+        if self.record_from <= started_at and finished_at <= self.record_until:
+            self.samples.append((step, finished_at - started_at, status, expect))
+
+        if response is not None:
+            for header in response.headers.get_all("Set-Cookie") or ():
+                for name, morsel in http.cookies.SimpleCookie(header).items():
+                    if morsel["max-age"] == "0":
+                        self.cookies.pop(name, None)
+                    else:
+                        self.cookies[name] = morsel.value
+
+            if response.will_close:
+                self.connection.close()
+
+            # Shed requests are retried no sooner than the server asks, like a well-behaved client would
+            retry_after = response.getheader("Retry-After")
+            if status in (429, 503) and retry_after:
+                time.sleep(float(retry_after))
+
+        return status, data
+
+
+def _percentiles(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    samples = len(latencies)
+
+    if not samples:
+        return {f"p{percentile}_ms": None for percentile in PERCENTILES}
+
+    summary = {
+        f"p{percentile}_ms": round(
+            latencies[min(samples - 1, samples * percentile // 100)] * 1000, 3
+        )
+        for percentile in PERCENTILES
+    }
+    summary["max_ms"] = round(latencies[-1] * 1000, 3)
+    return summary
+
+
+def run_scenario(scenario, port: int, options) -> dict:
+    """
+    Runs one scenario with options.concurrency visitors, and summarises what they measured.
+
+    Args:
+        scenario (Scenario): The scenario to run.
+        port (int): The port of the server.
+        options (argparse.Namespace): The benchmark options.
+
+    Returns:
+        dict: The throughput, latency percentiles (overall and per step) and database commands per request.
+    """
+    users = [VirtualUser(port, index) for index in range(options.concurrency)]
+
+    if scenario.setup is not None:
+        for user in users:
+            scenario.setup(user)
+
+    start_at = time.perf_counter()
+    record_from = start_at + options.warmup
+    record_until = record_from + options.duration
+
+    for user in users:
+        user.record_from, user.record_until = record_from, record_until
+
+    def visit(user):
+        while time.perf_counter() < record_until:
+            scenario.iteration(user)
+
+    threads = [threading.Thread(target=visit, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+
+    # The server's counters are read at the edges of the measured window
+    time.sleep(max(0.0, record_from - time.perf_counter()))
+    before = server_totals(port)
+    time.sleep(max(0.0, record_until - time.perf_counter()))
+    after = server_totals(port)
+
+    for thread in threads:
+        thread.join()
+
+    samples = [sample for user in users for sample in user.samples]
+    steps = {}
+    for step, latency, status, _ in samples:
+        latencies, statuses = steps.setdefault(step, ([], {}))
+        latencies.append(latency)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    # The first metrics request finished inside the window, and made no database commands
+    handled = after["requests"] - before["requests"] - 1
+
+    return {
+        "requests": len(samples),
+        "errors": sum(status != expect for _, _, status, expect in samples),
+        "rps": round(len(samples) / options.duration, 1),
+        "db_ops_per_request": round(
+            (after["db_ops"] - before["db_ops"]) / max(1, handled), 3
+        ),
+        **_percentiles([sample[1] for sample in samples]),
+        "steps": {
+            step: {
+                "requests": len(latencies),
+                "errors": sum(
+                    status != expect
+                    for name, _, status, expect in samples
+                    if name == step
+                ),
+                "statuses": statuses,
+                **_percentiles(latencies),
+            }
+            for step, (latencies, statuses) in steps.items()
+        },
+    }
+
+
+# Reporting
+
+
+def _print_results(results: dict) -> None:
+    print(
+        f"{'scenario / step':<28}{'requests':>10}{'errors':>8}{'req/s':>10}"
+        f"{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'db ops':>8}"
+    )
+
+    for name, result in results["scenarios"].items():
+        print(
+            f"{name:<28}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10}"
+            f"{_ms(result['p50_ms'])}{_ms(result['p90_ms'])}{_ms(result['p99_ms'])}"
+            f"{_ms(result.get('max_ms'))}{result['db_ops_per_request']:>8}"
+        )
+
+        for step, summary in result["steps"].items():
+            print(
+                f"  {step:<26}{summary['requests']:>10}{summary['errors']:>8}{'':>10}"
+                f"{_ms(summary['p50_ms'])}{_ms(summary['p90_ms'])}{_ms(summary['p99_ms'])}"
+                f"{_ms(summary.get('max_ms'))}"
+                f"  {', '.join(f'{n}x {s}' for s, n in sorted(summary['statuses'].items()))}"
+            )
+
+
+def _ms(value) -> str:
+    return f"{'-' if value is None else value:>10}"
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compares results with the baseline, printing the change of every metric.
+
+    Throughput and latency regress when they are worse by more than the tolerance (a fraction). Database
+    commands per request do not depend on the machine, so they regress when they grow by more than
+    DB_OPS_TOLERANCE, which only allows for the requests in flight at the edges of the measured window.
+
+    Args:
+        results (dict): The results of this run.
+        baseline (dict): The stored baseline.
+        tolerance (float): The fraction throughput and latency may worsen by.
+
+    Returns:
+        list[str]: A description of every regression.
+    """
+    if results["config"] != baseline.get("config"):
+        print(
+            f"Warning: the baseline was run with {baseline.get('config')}, not {results['config']}.\n"
+        )
+
+    regressions = []
+
+    print(
+        f"{'scenario':<20}{'metric':<22}{'baseline':>12}{'current':>12}{'change':>10}"
+    )
+
+    for name, result in results["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"{name:<20}(not in the baseline)")
+            continue
+
+        for metric in ("rps", "p50_ms", "p99_ms", "db_ops_per_request"):
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+
+            change = (new - old) / old
+
+            if metric == "rps":
+                regressed = -change > tolerance
+            elif metric == "db_ops_per_request":
+                regressed = new - old > DB_OPS_TOLERANCE
+            else:
+                regressed = change > tolerance
+
+            print(
+                f"{name:<20}{metric:<22}{old:>12}{new:>12}{change:>+10.1%}"
+                f"{'  REGRESSED' if regressed else ''}"
+            )
+
+            if regressed:
+                regressions.append(f"{name} {metric}: {old} -> {new}")
+
+    return regressions
+
+
+# Main
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="simulated visitors (default 8)"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=16, help="waitress threads (default 16)"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="measured seconds per scenario"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=2, help="unmeasured seconds before each"
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"comma separated scenarios to run (default all: {', '.join(SCENARIOS)})",
+    )
+    parser.add_argument(
+        "--mongodb-uri", help="a throwaway local mongod to use instead of mongomock"
+    )
+    parser.add_argument(
+        "--session-cache-ttl",
+        type=float,
+        help="override the session cache TTL (0 looks every session up in the database)",
+    )
+    parser.add_argument(
+        "--baseline", default=DEFAULT_BASELINE, help="the baseline file"
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="store the results as the baseline"
+    )
+    parser.add_argument(
+        "--compare", action="store_true", help="compare the results with the baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.15,
+        help="how much worse throughput and latency may get before --compare fails (default 0.15)",
+    )
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.serve is not None:
+        serve(options.serve, options.threads, options.concurrency)
+        return
+
+    names = [name.strip() for name in options.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    results = {
+        "config": {
+            "backend": "mongod" if options.mongodb_uri else "mongomock",
+            "concurrency": options.concurrency,
+            "threads": options.threads,
+            "duration": options.duration,
+            "session_cache_ttl": options.session_cache_ttl,
+        },
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "scenarios": {},
+    }
+
+    # Every scenario gets a fresh server, so that what one leaves in the database does not slow the next
+    open(SERVER_LOG, "w").close()
+
+    for name in names:
+        print(f"Running {name}: {SCENARIOS[name].description}", file=sys.stderr)
+        process, port = start_server(options)
+
+        try:
+            results["scenarios"][name] = run_scenario(SCENARIOS[name], port, options)
+        finally:
+            process.terminate()
+            process.wait()
+
+    print()
+    _print_results(results)
+
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if options.save_baseline:
+        with open(options.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+        print(f"\nSaved the baseline to {options.baseline}.")
+
+    if options.compare:
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+
+        print()
+        regressions = compare(results, baseline, options.tolerance)
+
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond the tolerance.")
+            sys.exit(1)
+
+        print("\nNo regressions.")
+
+
+# Only run when started as a script, as the password pool's worker processes re-import this module
+if __name__ == "__main__":
+    main()
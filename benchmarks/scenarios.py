@@ -0,0 +1,136 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the benchmark scenarios. A scenario is what one simulated visitor does over and over: each
+iteration makes one or more requests through the VirtualUser in bench.py, naming every request's step so that
+its latency is reported separately. An optional setup runs once per visitor before the clock starts.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import json
+import uuid
+
+# Constants
+# Every seeded benchmark user has this password
+BENCHMARK_PASSWORD = "benchmark-password"
+
+
+def user_email(index: int) -> str:
+    """
+    Returns the email of a seeded benchmark user.
+
+    Args:
+        index (int): The number of the simulated visitor logging in as the user.
+
+    Returns:
+        str: The email address.
+    """
+    return f"benchmark-{index}@example.com"
+
+
+def log_in(user) -> bool:
+    """
+    Logs a visitor in the way the login page does: fetch a CSRF token, then post the form.
+
+    The reCAPTCHA token is random, as the fake backend accepts any token that has not been used before.
+
+    Args:
+        user (VirtualUser): The visitor.
+
+    Returns:
+        bool: True if the visitor is now logged in.
+    """
+    status, body = user.request("csrf", "GET", "/api/forms/csrf")
+    if status != 200:
+        return False
+
+    status, _ = user.request(
+        "login",
+        "POST",
+        "/api/forms/login",
+        form={
+            "csrf_token": json.loads(body)["csrf_token"],
+            "email": user.email,
+            "password": BENCHMARK_PASSWORD,
+            "g-recaptcha-response": f"benchmark-{uuid.uuid4().hex}",
+        },
+    )
+    return status == 200
+
+
+class Scenario:
+    """
+    A named sequence of requests, repeated by every simulated visitor.
+    """
+
+    def __init__(self, name: str, description: str, iteration, setup=None) -> None:
+        self.name = name
+        self.description = description
+        self.iteration = iteration
+        self.setup = setup
+
+
+def _public_pages(user) -> None:
+    # Every iteration is a new anonymous visitor, as a cookie picked up from a page cache miss (rendering a
+    # form puts a CSRF token in the session) would make the rest of the run load and save that session
+    user.cookies.clear()
+
+    user.request("index", "GET", "/")
+    user.request("login_page", "GET", "/login")
+    user.request("signup_page", "GET", "/signup")
+
+
+def _api_users(user) -> None:
+    user.request("api_users", "GET", "/api/users/")
+
+
+def _login_logout(user) -> None:
+    # Every iteration is a new visitor, with no session yet
+    user.cookies.clear()
+
+    if not log_in(user):
+        return
+
+    # The first request after logging in looks the session up in the database
+    user.request("app", "GET", "/app/")
+    user.request("logout", "GET", "/logout", expect=302)
+
+
+def _ensure_session_setup(user) -> None:
+    if not log_in(user):
+        raise RuntimeError(f"Could not log in as {user.email}.")
+
+
+def _ensure_session(user) -> None:
+    user.request("app", "GET", "/app/")
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (
+        Scenario(
+            "public_pages",
+            "Anonymous visits to the cached public pages (main).",
+            _public_pages,
+        ),
+        Scenario(
+            "api_users",
+            "Anonymous requests to the users API (api_users).",
+            _api_users,
+        ),
+        Scenario(
+            "login_logout",
+            "A full visit: CSRF token, login, one app page, logout (api_forms, app_main, main).",
+            _login_logout,
+        ),
+        Scenario(
+            "ensure_session",
+            "Logged-in requests to the app, validating the session on every request (app_main).",
+            _ensure_session,
+            setup=_ensure_session_setup,
+        ),
+    )
+}
@@ -0,0 +1,118 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This is the static asset build step. It minifies the CSS and JavaScript in static/, fingerprints every asset
+with a hash of its content, writes gzip and brotli compressed variants next to it in static/dist/, and
+records everything in static/dist/manifest.json for helpers/assets.py.
+
+Run it before deploying (after building tailwind.css):
+    python build_assets.py
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import gzip
+import json
+import os
+import shutil
+
+# Third Party Modules
+import brotli
+import xxhash
+from jsmin import jsmin
+from rcssmin import cssmin
+
+# Constants
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+
+# The assets to build, relative to static/
+ASSETS = [
+    "css/tailwind.css",
+    "css/base.css",
+    "css/pages/index.css",
+    "js/theme.js",
+    "images/betterqr-banner-logo.png",
+    "images/betterqr-banner-logo.svg",
+    "images/betterqr-email-banner.svg",
+]
+
+# Minifiers per file extension
+MINIFIERS = {
+    ".css": cssmin,
+    ".js": jsmin,
+}
+
+# Formats that are worth compressing (images like PNG are compressed already)
+COMPRESSIBLE = {".css", ".js", ".svg"}
+
+# Files smaller than this are not worth a compressed variant
+MIN_COMPRESS_SIZE = 256
+
+
+def build_asset(source: str) -> dict:
+    """
+    Builds a single asset.
+
+    Args:
+        source (str): The path of the asset inside static/.
+
+    Returns:
+        dict: The manifest entry for the asset.
+    """
+    root, extension = os.path.splitext(source)
+
+    with open(os.path.join(STATIC_DIR, source), "rb") as source_file:
+        content = source_file.read()
+
+    minifier = MINIFIERS.get(extension)
+    if minifier is not None:
+        content = minifier(content.decode()).encode()
+
+    digest = xxhash.xxh3_64_hexdigest(content)[:12]
+    path = f"{root}.{digest}{extension}"
+    destination = os.path.join(DIST_DIR, path)
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+    with open(destination, "wb") as destination_file:
+        destination_file.write(content)
+
+    encodings = []
+
+    if extension in COMPRESSIBLE and len(content) >= MIN_COMPRESS_SIZE:
+        with open(destination + ".br", "wb") as brotli_file:
+            brotli_file.write(brotli.compress(content, quality=11))
+        encodings.append("br")
+
+        # mtime=0 keeps the output reproducible
+        with open(destination + ".gz", "wb") as gzip_file:
+            gzip_file.write(gzip.compress(content, compresslevel=9, mtime=0))
+        encodings.append("gzip")
+
+    return {"path": path, "encodings": encodings}
+
+
+def build() -> dict:
+    """
+    Builds every asset and writes the manifest, replacing any previous build.
+
+    Returns:
+        dict: The manifest.
+    """
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    os.makedirs(DIST_DIR)
+
+    manifest = {"assets": {source: build_asset(source) for source in ASSETS}}
+
+    with open(os.path.join(DIST_DIR, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    return manifest
+
+
+if __name__ == "__main__":
+    for source, asset in build()["assets"].items():
+        print(f"{source} -> {asset['path']} {' '.join(asset['encodings'])}")
@@ -7,19 +7,40 @@ You may not use, copy, distribute, modify, or sell this code without the express
 
 # Python Standard Library
 import datetime
+import urllib.parse
 import uuid
-import os
 
 # Third Party Modules
-from werkzeug.security import check_password_hash
-import requests
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
 # Flask Modules
 from flask import Blueprint, jsonify, session, request
 
+# Flask Extensions
+from flask_wtf.csrf import generate_csrf
+
 # Database Modules
 from helpers.db import users_collection
 
+# Passwords
+from helpers.passwords import PasswordPoolSaturated, hash_password, verify_password
+
+# Mail
+from helpers.mail import queue_mail
+
+# Site settings
+from helpers.config import BASE_URL
+
+# Import the custom logger
+from helpers.logger import QRLOG_MAIN
+
+# reCAPTCHA
+from helpers.recaptcha import get_recaptcha_verifier
+
+# Sessions
+from helpers.session_cache import session_cache
+from helpers.sessions import create_session
+
 # Forms
 from forms.login import LoginForm
 from forms.signup import SignupForm
@@ -27,28 +48,35 @@ from forms.signup import SignupForm
 # Create a Blueprint for main routes
 blueprint = Blueprint("api_forms", __name__, url_prefix="/api/forms")
 
-# Route Endpoints
 
+def _check_recaptcha():
+    """
+    Verifies the reCAPTCHA token submitted with a form.
 
-@blueprint.route("/login", methods=["POST"])
-def _login():
-    form = LoginForm(request.form)
-
-    if not form.validate_on_submit():
-        return jsonify({"ok": False, "errors": form.errors}), 400
-
-    recaptcha_response = request.form.get("g-recaptcha-response")
-    data = {
-        "secret": os.getenv("recaptcha_secret_key"),
-        "response": recaptcha_response,
-        "remoteip": request.headers.get("CF-Connecting-IP", request.remote_addr),
-    }
-    response = requests.post(
-        "https://www.google.com/recaptcha/api/siteverify", data=data
+    Returns:
+        tuple | None: An error response if the token was not accepted, otherwise None.
+    """
+    recaptcha_result = get_recaptcha_verifier().verify(
+        request.form.get("g-recaptcha-response"),
+        request.headers.get("CF-Connecting-IP", request.remote_addr),
     )
-    result = response.json()
 
-    if not result["success"]:
+    if recaptcha_result.error == "unavailable":
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {
+                        "recaptcha": [
+                            "Recaptcha verification is unavailable. Please try again later."
+                        ]
+                    },
+                }
+            ),
+            503,
+        )
+
+    if not recaptcha_result.ok:
         return (
             jsonify(
                 {
@@ -62,7 +90,44 @@ def _login():
             400,
         )
 
-    query = users_collection.find_one({"email": form.email.data})
+    return None
+
+
+def _password_pool_busy(message: str):
+    return (
+        jsonify({"ok": False, "errors": {"internal": [message]}}),
+        503,
+        {"Retry-After": "1"},
+    )
+
+
+# Route Endpoints
+
+
+@blueprint.route("/csrf")
+def _csrf():
+    # The form pages are cached and shared, so each visitor fetches their own CSRF token
+    return (
+        jsonify({"ok": True, "csrf_token": generate_csrf()}),
+        200,
+        {"Cache-Control": "no-store"},
+    )
+
+
+@blueprint.route("/login", methods=["POST"])
+def _login():
+    form = LoginForm(request.form)
+
+    if not form.validate_on_submit():
+        return jsonify({"ok": False, "errors": form.errors}), 400
+
+    recaptcha_error = _check_recaptcha()
+    if recaptcha_error is not None:
+        return recaptcha_error
+
+    query = users_collection.find_one(
+        {"email": form.email.data}, {"uuid": 1, "security.password": 1}
+    )
 
     if query is None:
         return jsonify({"ok": False, "errors": {"email": ["User not found."]}}), 404
@@ -70,30 +135,106 @@ def _login():
     if not isinstance(query, dict):
         return jsonify({"ok": False, "errors": {"internal": ["Database error."]}}), 500
 
-    # Check if the password is correct
+    # Check if the password is correct (off the request thread)
+
+    try:
+        password_ok, new_hash = verify_password(
+            query["security"]["password"], form.password.data
+        )
+    except PasswordPoolSaturated:
+        return _password_pool_busy("Too many login attempts. Please try again shortly.")
 
-    if not check_password_hash(query["security"]["password"], form.password.data):
+    if not password_ok:
         return (
             jsonify({"ok": False, "errors": {"password": ["Incorrect password."]}}),
             401,
         )
 
-    # Create a new session
+    # Upgrade the stored hash if it was made with outdated parameters
 
-    new_session = {
-        "sid": str(uuid.uuid4()),
-        "created_at": datetime.datetime.now(datetime.UTC),
-        "ip": request.headers.get("CF-Connecting-IP", request.remote_addr),
-        "user_agent": request.headers.get("User-Agent"),
-    }
+    if new_hash is not None:
+        users_collection.update_one(
+            {"uuid": query["uuid"], "security.password": query["security"]["password"]},
+            {"$set": {"security.password": new_hash}},
+        )
 
-    # Update the user's sessions
+    # Create a new session
 
-    users_collection.update_one(
-        {"uuid": query["uuid"]},
-        {"$push": {"sessions": new_session}},
+    new_session = create_session(
+        query["uuid"],
+        request.headers.get("CF-Connecting-IP", request.remote_addr),
+        request.headers.get("User-Agent"),
     )
 
-    session["sid"] = new_session["sid"]
+    # The previous session id in this cookie (if any) is being replaced
+    if "sid" in session:
+        session_cache.invalidate(session["sid"])
+
+    session["sid"] = new_session["_id"]
 
     return jsonify({"ok": True, "message": "Logged in successfully."}), 200
+
+
+@blueprint.route("/signup", methods=["POST"])
+def _signup():
+    form = SignupForm(request.form)
+
+    if not form.validate_on_submit():
+        return jsonify({"ok": False, "errors": form.errors}), 400
+
+    recaptcha_error = _check_recaptcha()
+    if recaptcha_error is not None:
+        return recaptcha_error
+
+    # Hash the password (off the request thread)
+
+    try:
+        password_hash = hash_password(form.password.data)
+    except PasswordPoolSaturated:
+        return _password_pool_busy("Too many signups. Please try again shortly.")
+
+    # A single insert, relying on the unique email index (see INDEXES in helpers/db.py) to reject
+    # existing emails, instead of looking the email up first
+
+    name = form.name.data.strip()
+    email = form.email.data
+
+    try:
+        users_collection.insert_one(
+            {
+                "uuid": str(uuid.uuid4()),
+                "name": name,
+                "email": email,
+                "security": {"password": password_hash},
+                "created_at": datetime.datetime.now(datetime.UTC),
+            }
+        )
+    except DuplicateKeyError:
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {"email": ["An account with this email already exists."]},
+                }
+            ),
+            409,
+        )
+    except PyMongoError:
+        return jsonify({"ok": False, "errors": {"internal": ["Database error."]}}), 500
+
+    # The welcome email is delivered in the background; the account exists either way
+
+    try:
+        queue_mail(
+            email,
+            "Welcome to BetterQR",
+            "welcome",
+            inline=("betterqr-email-banner.svg",),
+            name=name,
+            email=email,
+            login_url=f"{BASE_URL}/login?{urllib.parse.urlencode({'email': email})}",
+        )
+    except PyMongoError as e:
+        QRLOG_MAIN.error(f"Could not queue the welcome email for a new user: {e}")
+
+    return jsonify({"ok": True, "message": "Signed up successfully."}), 201
@@ -0,0 +1,457 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import datetime
+import os
+
+# Flask Modules
+from flask import Blueprint, Response, g, jsonify, request
+
+# Batch Jobs
+from helpers.batch_jobs import find_job, start_job
+
+# Analytics
+from helpers.analytics import GRANULARITIES, MAX_RANGE, bucket_start, read_rollups
+
+# QR Codes
+from helpers.qr_codes import (
+    DEFAULT_PAGE_SIZE,
+    InvalidCursor,
+    InvalidTarget,
+    count_codes,
+    create_code,
+    find_code,
+    list_codes,
+    update_target,
+)
+
+# QR Code Modules
+from qr.batch import (
+    BatchInputError,
+    entry_names,
+    parse_csv,
+    parse_ndjson,
+    render_batch,
+    stream_ndjson,
+    stream_zip,
+)
+from qr.encoder import EC_LEVELS
+from qr.render import FORMATS, MAX_PNG_SIZE, check_logo, normalise_style
+
+# Constants
+# Batch limits, configurable through the environment
+MAX_BATCH_ITEMS = int(os.getenv("qr_batch_max_items", 10000))
+MAX_BATCH_BYTES = int(os.getenv("qr_batch_max_bytes", 4 * 1024 * 1024))
+MAX_JOBS_PER_USER = int(os.getenv("qr_batch_max_jobs_per_user", 2))
+
+DEFAULT_PNG_SIZE = 512
+
+# The range of analytics returned when none is given, per granularity
+DEFAULT_ANALYTICS_RANGE = {
+    "hour": datetime.timedelta(hours=48),
+    "day": datetime.timedelta(days=30),
+}
+
+# The latest an analytics range can end, per granularity, as its series steps one bucket past the end
+LATEST_ANALYTICS_END = {
+    granularity: datetime.datetime.max.replace(tzinfo=datetime.UTC) - step
+    for granularity, step in GRANULARITIES.items()
+}
+
+NDJSON_MIMETYPES = {"application/x-ndjson", "application/jsonl"}
+
+# Create a Blueprint for the QR code API routes
+blueprint = Blueprint("api_qr", __name__, url_prefix="/api/qr")
+
+# Route Endpoints
+
+
+def _batch_options() -> tuple[dict, dict]:
+    """
+    Reads and validates the render options of a batch from the query string.
+    """
+    errors = {}
+
+    fmt = request.args.get("format", "png")
+    if fmt not in FORMATS:
+        errors["format"] = ["The format must be png or svg."]
+
+    output = request.args.get("output", "zip")
+    if output not in ("zip", "ndjson"):
+        errors["output"] = ["The output must be zip or ndjson."]
+
+    ec_level = request.args.get("ec_level", "M")
+    if ec_level not in EC_LEVELS:
+        errors["ec_level"] = ["The error correction level must be L, M, Q or H."]
+
+    size = None
+    if fmt == "png":
+        size = request.args.get("size", DEFAULT_PNG_SIZE, type=int)
+        if size is None or not 1 <= size <= MAX_PNG_SIZE:
+            errors["size"] = [f"The size must be between 1 and {MAX_PNG_SIZE} pixels."]
+
+    style = {
+        key: request.args[key]
+        for key in ("dark", "light", "shape", "gradient", "gradient_to", "logo")
+        if key in request.args
+    }
+    if "border" in request.args:
+        style["border"] = request.args.get("border", type=int)
+    if "logo_size" in request.args:
+        style["logo_size"] = request.args.get("logo_size", type=float)
+
+    try:
+        style = normalise_style(style)
+        check_logo(style, ec_level)
+    except ValueError as e:
+        errors["style"] = [str(e)]
+
+    options = {
+        "fmt": fmt,
+        "output": output,
+        "ec_level": ec_level,
+        "size": size,
+        "style": style,
+    }
+    return options, errors
+
+
+@blueprint.route("/batch", methods=["POST"])
+def _batch():
+    if "user_uuid" not in g:
+        return jsonify({"ok": False, "errors": {"auth": ["Not logged in."]}}), 401
+
+    # The size is checked before reading, so batches must say how long they are (not be chunked)
+    if request.content_length is None:
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {"input": ["The batch must have a Content-Length."]},
+                }
+            ),
+            411,
+        )
+
+    if request.content_length > MAX_BATCH_BYTES:
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {
+                        "input": [f"The batch must be at most {MAX_BATCH_BYTES} bytes."]
+                    },
+                }
+            ),
+            413,
+        )
+
+    options, errors = _batch_options()
+
+    if errors:
+        return jsonify({"ok": False, "errors": errors}), 400
+
+    try:
+        if request.mimetype == "text/csv":
+            items = parse_csv(request.get_data())
+        elif request.mimetype in NDJSON_MIMETYPES:
+            items = parse_ndjson(request.get_data())
+        else:
+            return (
+                jsonify(
+                    {
+                        "ok": False,
+                        "errors": {
+                            "input": ["The batch must be CSV or JSON lines (ndjson)."]
+                        },
+                    }
+                ),
+                415,
+            )
+    except BatchInputError as e:
+        return jsonify({"ok": False, "errors": {"input": [str(e)]}}), 400
+
+    if not items:
+        return jsonify({"ok": False, "errors": {"input": ["The batch is empty."]}}), 400
+
+    if len(items) > MAX_BATCH_ITEMS:
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {
+                        "input": [
+                            f"A batch can contain at most {MAX_BATCH_ITEMS} QR codes."
+                        ]
+                    },
+                }
+            ),
+            413,
+        )
+
+    job = start_job(g.user_uuid, len(items), MAX_JOBS_PER_USER)
+
+    if job is None:
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {
+                        "batch": [
+                            "You have too many batches running. Please wait for one to finish."
+                        ]
+                    },
+                }
+            ),
+            429,
+            {"Retry-After": "10"},
+        )
+
+    fmt = options["fmt"]
+    names = entry_names(items, fmt)
+    rendered = render_batch(
+        [item.data.encode() for item in items],
+        options["ec_level"],
+        fmt,
+        options["size"],
+        options["style"],
+    )
+
+    def tracked():
+        for index, output, error in rendered:
+            job.advance(error is None)
+            yield index, output, error
+
+    if options["output"] == "zip":
+        response = Response(
+            stream_zip(tracked(), names, fmt), mimetype="application/zip"
+        )
+        response.headers["Content-Disposition"] = (
+            f'attachment; filename="betterqr-{job.id}.zip"'
+        )
+    else:
+        response = Response(
+            stream_ndjson(tracked(), names, fmt), mimetype="application/x-ndjson"
+        )
+
+    # Runs once the response has been sent, or the client has gone away
+    @response.call_on_close
+    def finish():
+        rendered.close()
+        job.finish("done" if job.completed + job.failed == job.total else "cancelled")
+
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["X-Batch-Job-Id"] = job.id
+    return response
+
+
+@blueprint.route("/batch/<job_id>")
+def _batch_progress(job_id):
+    if "user_uuid" not in g:
+        return jsonify({"ok": False, "errors": {"auth": ["Not logged in."]}}), 401
+
+    job = find_job(job_id, g.user_uuid)
+
+    if job is None:
+        return jsonify({"ok": False, "errors": {"job": ["Batch not found."]}}), 404
+
+    job["id"] = job.pop("_id")
+
+    return jsonify({"ok": True, "job": job}), 200, {"Cache-Control": "no-store"}
+
+
+@blueprint.route("/codes", methods=["GET"])
+def _list_codes():
+    if "user_uuid" not in g:
+        return jsonify({"ok": False, "errors": {"auth": ["Not logged in."]}}), 401
+
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+
+    try:
+        codes, next_cursor = list_codes(g.user_uuid, limit, request.args.get("cursor"))
+    except InvalidCursor as e:
+        return jsonify({"ok": False, "errors": {"cursor": [str(e)]}}), 400
+    except ValueError as e:
+        return jsonify({"ok": False, "errors": {"limit": [str(e)]}}), 400
+
+    for code in codes:
+        code["id"] = code.pop("_id")
+
+    return (
+        jsonify(
+            {
+                "ok": True,
+                "codes": codes,
+                "next_cursor": next_cursor,
+                "total": count_codes(g.user_uuid),
+            }
+        ),
+        200,
+        {"Cache-Control": "no-store"},
+    )
+
+
+@blueprint.route("/codes", methods=["POST"])
+def _create_code():
+    if "user_uuid" not in g:
+        return jsonify({"ok": False, "errors": {"auth": ["Not logged in."]}}), 401
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return (
+            jsonify(
+                {"ok": False, "errors": {"input": ["The body must be a JSON object."]}}
+            ),
+            400,
+        )
+
+    try:
+        code = create_code(g.user_uuid, data.get("target"))
+    except InvalidTarget as e:
+        return jsonify({"ok": False, "errors": {"target": [str(e)]}}), 400
+
+    return (
+        jsonify(
+            {
+                "ok": True,
+                "code": {
+                    "id": code["_id"],
+                    "target": code["target"],
+                    "scans": code["scans"],
+                    "created_at": code["created_at"],
+                    "updated_at": code["updated_at"],
+                },
+            }
+        ),
+        201,
+    )
+
+
+@blueprint.route("/codes/<code>", methods=["GET", "PATCH"])
+def _code(code):
+    if "user_uuid" not in g:
+        return jsonify({"ok": False, "errors": {"auth": ["Not logged in."]}}), 401
+
+    if request.method == "PATCH":
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return (
+                jsonify(
+                    {
+                        "ok": False,
+                        "errors": {"input": ["The body must be a JSON object."]},
+                    }
+                ),
+                400,
+            )
+
+        try:
+            document = update_target(code, g.user_uuid, data.get("target"))
+        except InvalidTarget as e:
+            return jsonify({"ok": False, "errors": {"target": [str(e)]}}), 400
+    else:
+        document = find_code(code, g.user_uuid)
+
+    if document is None:
+        return jsonify({"ok": False, "errors": {"code": ["QR code not found."]}}), 404
+
+    document["id"] = document.pop("_id")
+
+    return jsonify({"ok": True, "code": document}), 200, {"Cache-Control": "no-store"}
+
+
+def _parse_time(value: str | None) -> datetime.datetime | None:
+    """
+    Parses an ISO 8601 time from the query string, assuming UTC if it has no timezone.
+    """
+    if value is None:
+        return None
+
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.UTC)
+    return parsed.astimezone(datetime.UTC)
+
+
+@blueprint.route("/codes/<code>/analytics")
+def _code_analytics(code):
+    if "user_uuid" not in g:
+        return jsonify({"ok": False, "errors": {"auth": ["Not logged in."]}}), 401
+
+    granularity = request.args.get("granularity", "hour")
+    if granularity not in GRANULARITIES:
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {"granularity": ["The granularity must be hour or day."]},
+                }
+            ),
+            400,
+        )
+
+    # Times near the limits of datetime overflow when converted to UTC or moved by the range arithmetic
+    try:
+        end = _parse_time(request.args.get("to"))
+        start = _parse_time(request.args.get("from"))
+
+        if end is None:
+            # Up to and including the current bucket
+            now = datetime.datetime.now(datetime.UTC)
+            end = bucket_start(now, granularity) + GRANULARITIES[granularity]
+        if start is None:
+            start = end - DEFAULT_ANALYTICS_RANGE[granularity]
+    except (ValueError, OverflowError):
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {"range": ["The range must be ISO 8601 times."]},
+                }
+            ),
+            400,
+        )
+
+    if end > LATEST_ANALYTICS_END[granularity]:
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {
+                        "range": [
+                            f"The range must end by {LATEST_ANALYTICS_END[granularity].isoformat()}."
+                        ]
+                    },
+                }
+            ),
+            400,
+        )
+
+    if not start < end or end - start > MAX_RANGE[granularity]:
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {
+                        "range": [
+                            f"The range must be positive and at most {MAX_RANGE[granularity].days} days long."
+                        ]
+                    },
+                }
+            ),
+            400,
+        )
+
+    if find_code(code, g.user_uuid) is None:
+        return jsonify({"ok": False, "errors": {"code": ["QR code not found."]}}), 404
+
+    return (
+        jsonify({"ok": True, "analytics": read_rollups(code, granularity, start, end)}),
+        200,
+        {"Cache-Control": "no-store"},
+    )
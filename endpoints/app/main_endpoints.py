@@ -11,10 +11,16 @@ associated logic.
 # Flask Modules
 from flask import (
     Blueprint,
+    g,
+    render_template,
+    request,
     session,
     redirect,
 )
 
+# QR Codes
+from helpers.qr_codes import InvalidCursor, count_codes, list_codes
+
 # Create a Blueprint for main routes
 blueprint = Blueprint("app_main", __name__, url_prefix="/app")
 
@@ -28,4 +34,20 @@ def _index():
             "/login?utm_source=internal&utm_medium=redirect&utm_campaign=login_redirect&utm_content=not_logged_in"
         )
 
-    return "Welcome to the app!"
+    # One page of codes and the maintained counter, so the page costs the same for any number of codes
+    try:
+        codes, next_cursor = list_codes(g.user_uuid, cursor=request.args.get("cursor"))
+    except InvalidCursor:
+        return redirect("/app/")
+
+    return (
+        render_template(
+            "app/index.html",
+            codes=codes,
+            next_cursor=next_cursor,
+            total=count_codes(g.user_uuid),
+            first_page="cursor" not in request.args,
+        ),
+        200,
+        {"Cache-Control": "no-store"},
+    )
@@ -0,0 +1,35 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This is the health endpoints file. It contains the liveness and readiness checks used by orchestrators
+and load balancers.
+"""
+
+# Import the required modules
+
+# Flask Modules
+from flask import Blueprint, jsonify
+
+# Database
+from helpers.db import ping
+
+# Create a Blueprint for the health routes
+blueprint = Blueprint("health", __name__, url_prefix="/")
+
+# Route Endpoints
+
+
+@blueprint.route("/healthz")
+def _healthz():
+    # The process is up and serving requests
+    return jsonify({"ok": True}), 200
+
+
+@blueprint.route("/readyz")
+def _readyz():
+    # The process can serve real traffic, i.e. the database is reachable
+    if not ping():
+        return jsonify({"ok": False, "errors": {"database": ["Unreachable."]}}), 503
+
+    return jsonify({"ok": True}), 200
@@ -0,0 +1,58 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This is the internal metrics endpoints file. It exposes runtime counters to operators and is protected by
+the internal API key.
+"""
+
+# Import the required modules
+
+# Flask Modules
+from flask import Blueprint, jsonify
+
+# Helpers
+from helpers import metrics
+from helpers.admission import admission
+from helpers.internal_auth import require_internal_key
+from helpers.logger import logging_stats
+from helpers.mail import mail_sender
+from helpers.page_cache import page_cache
+from helpers.redirect_cache import redirect_cache
+from helpers.revocation import revocation_listener
+from helpers.scan_counter import scan_counter
+from helpers.session_cache import session_cache
+from helpers.user_agent_parser import user_agent_cache_stats
+
+# QR Code Modules
+from qr.cache import render_cache
+
+# Create a Blueprint for the internal metrics routes
+blueprint = Blueprint("internal_metrics", __name__, url_prefix="/internal/metrics")
+blueprint.before_request(require_internal_key)
+
+# Route Endpoints
+
+
+@blueprint.route("/")
+def _index():
+    return (
+        jsonify(
+            {
+                "ok": True,
+                "session_cache": session_cache.stats(),
+                "session_revocation": revocation_listener.stats(),
+                "page_cache": page_cache.stats(),
+                "qr_render_cache": render_cache.stats(),
+                "redirect_cache": redirect_cache.stats(),
+                "scan_counter": scan_counter.stats(),
+                "mail_sender": mail_sender.stats(),
+                "user_agent_cache": user_agent_cache_stats(),
+                "admission": admission.stats(),
+                "logging": logging_stats(),
+                "totals": metrics.totals(),
+                "endpoints": metrics.endpoint_stats(),
+            }
+        ),
+        200,
+    )
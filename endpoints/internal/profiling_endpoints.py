@@ -0,0 +1,151 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This is the internal profiling endpoints file. It lets operators see where a live worker spends its time,
+by sampling the stacks of all its threads or by profiling a fraction of its requests, and is protected by
+the internal API key. Each request is handled by one worker, so it only profiles that worker.
+"""
+
+# Import the required modules
+
+# Flask Modules
+from flask import Blueprint, jsonify, request
+
+# Helpers
+from helpers.internal_auth import require_internal_key
+from helpers.profiler import (
+    DEFAULT_PROFILE_SECONDS,
+    DEFAULT_SAMPLE_RATE,
+    DEFAULT_SAMPLE_SECONDS,
+    REPORT_SORT_KEYS,
+    ProfilerBusy,
+    collapsed,
+    request_profiler,
+    sample_stacks,
+)
+
+# Create a Blueprint for the internal profiling routes
+blueprint = Blueprint("internal_profiling", __name__, url_prefix="/internal/profile")
+blueprint.before_request(require_internal_key)
+
+# Route Endpoints
+
+
+@blueprint.route("/stacks")
+def _stacks():
+    # Blocks for the whole duration, and returns the samples as collapsed stacks for flame graphs
+    seconds = request.args.get("seconds", DEFAULT_SAMPLE_SECONDS, type=float)
+    rate = request.args.get("rate", DEFAULT_SAMPLE_RATE, type=float)
+
+    try:
+        counts = sample_stacks(seconds, rate)
+    except ValueError as e:
+        return jsonify({"ok": False, "errors": {"input": [str(e)]}}), 400
+    except ProfilerBusy as e:
+        return jsonify({"ok": False, "errors": {"profiler": [str(e)]}}), 409
+
+    return (
+        collapsed(counts),
+        200,
+        {"Content-Type": "text/plain; charset=utf-8", "Cache-Control": "no-store"},
+    )
+
+
+@blueprint.route("/requests", methods=["GET"])
+def _requests_status():
+    return jsonify({"ok": True, **request_profiler.status()}), 200
+
+
+@blueprint.route("/requests", methods=["POST"])
+def _requests_start():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return (
+            jsonify(
+                {"ok": False, "errors": {"input": ["The body must be a JSON object."]}}
+            ),
+            400,
+        )
+
+    try:
+        fraction = float(data.get("fraction", 1.0))
+        seconds = float(data.get("seconds", DEFAULT_PROFILE_SECONDS))
+    except (TypeError, ValueError):
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {"input": ["The fraction and seconds must be numbers."]},
+                }
+            ),
+            400,
+        )
+
+    try:
+        request_profiler.start(data.get("prefix", "/"), fraction, seconds)
+    except ValueError as e:
+        return jsonify({"ok": False, "errors": {"input": [str(e)]}}), 400
+
+    return jsonify({"ok": True, **request_profiler.status()}), 200
+
+
+@blueprint.route("/requests", methods=["DELETE"])
+def _requests_stop():
+    request_profiler.stop()
+    return jsonify({"ok": True, **request_profiler.status()}), 200
+
+
+@blueprint.route("/requests/stats")
+def _requests_stats():
+    # The raw pstats file (for snakeviz, flameprof, gprof2dot...) or a text report
+    fmt = request.args.get("format", "text")
+
+    if fmt == "pstats":
+        data = request_profiler.dump()
+        content_type = "application/octet-stream"
+        headers = {"Content-Disposition": 'attachment; filename="requests.prof"'}
+    elif fmt == "text":
+        sort = request.args.get("sort", "cumulative")
+        if sort not in REPORT_SORT_KEYS:
+            return (
+                jsonify(
+                    {
+                        "ok": False,
+                        "errors": {
+                            "sort": [
+                                f"The sort must be one of {', '.join(REPORT_SORT_KEYS)}."
+                            ]
+                        },
+                    }
+                ),
+                400,
+            )
+
+        data = request_profiler.report(sort, request.args.get("limit", 50, type=int))
+        content_type = "text/plain; charset=utf-8"
+        headers = {}
+    else:
+        return (
+            jsonify(
+                {
+                    "ok": False,
+                    "errors": {"format": ["The format must be pstats or text."]},
+                }
+            ),
+            400,
+        )
+
+    if data is None:
+        return (
+            jsonify(
+                {"ok": False, "errors": {"profiler": ["No requests profiled yet."]}}
+            ),
+            404,
+        )
+
+    return (
+        data,
+        200,
+        {"Content-Type": content_type, "Cache-Control": "no-store", **headers},
+    )
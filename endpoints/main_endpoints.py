@@ -18,8 +18,12 @@ from flask import Blueprint, render_template, session, redirect
 from forms.login import LoginForm
 from forms.signup import SignupForm
 
-# Database
-from helpers.db import users_collection
+# Page Cache
+from helpers.page_cache import page_cache
+
+# Sessions
+from helpers.session_cache import session_cache
+from helpers.sessions import log_out_session
 
 # Create a Blueprint for main routes
 blueprint = Blueprint("main", __name__, url_prefix="/")
@@ -38,17 +42,20 @@ def inject_recaptcha_details():
 
 
 @blueprint.route("/")
+@page_cache.cached()
 def _index():
     return render_template("index.html")
 
 
 @blueprint.route("/signup")
+@page_cache.cached()
 def _signup():
     form = SignupForm()
     return render_template("login_signup/signup.html", form=form)
 
 
 @blueprint.route("/login")
+@page_cache.cached()
 def _login():
     form = LoginForm()
     return render_template("login_signup/login.html", form=form)
@@ -63,10 +70,12 @@ def _logout():
 
     sid = session["sid"]
 
-    # Assusimg the sid is stored in the database within a user document in the
-    # users collection, the sid will be in one of the users "sessions" array
+    # Stop trusting the session in this process straight away
+    session_cache.invalidate(sid)
+
+    # Archive the session in a single atomic operation
 
-    query = users_collection.find_one({"sessions.sid": sid})
+    query = log_out_session(sid)
 
     if query is None:
         return redirect(
@@ -78,35 +87,6 @@ def _logout():
             "/?utm_source=internal&utm_medium=redirect&utm_campaign=home_redirect&utm_content=logged_out_error"
         )
 
-    # Add the session to the "logged_out_sessions" array (if it exists, otherwise create it)
-    if "logged_out_sessions" not in query:
-        users_collection.update_one(
-            {"uuid": query["uuid"]},
-            {"$set": {"logged_out_sessions": [query["sessions"][0]]}},
-        )
-    else:
-        users_collection.update_one(
-            {"uuid": query["uuid"]},
-            {"$push": {"logged_out_sessions": query["sessions"][0]}},
-        )
-
-    # Create an index to delete any logged out sessions that are older than 30 days
-    # Every session has a "created_at" field that is a datetime object in UTC
-
-    # Ensure the index does not already exist
-    if not "logged_out_sessions.created_at_1" in users_collection.index_information():
-        # Create the index
-        users_collection.create_index(
-            [("logged_out_sessions.created_at", 1)],
-            expireAfterSeconds=2592000,  # 30 days
-        )
-
-    # Remove the session from the "sessions" array
-    users_collection.update_one(
-        {"uuid": query["uuid"]},
-        {"$pull": {"sessions": {"sid": sid}}},
-    )
-
     # Remove the session from the session cookie
     session.pop("sid")
 
@@ -117,10 +97,12 @@ def _logout():
 
 
 @blueprint.route("/terms")
+@page_cache.cached()
 def _terms():
     return render_template("policies/terms.html")
 
 
 @blueprint.route("/privacy")
+@page_cache.cached()
 def _privacy():
     return render_template("policies/privacy.html")
@@ -0,0 +1,41 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This is the redirect endpoints file. Every scan of a dynamic QR code lands here, so the redirect is served
+from memory: targets come from the redirect cache and scans are counted in memory, without a database round
+trip in the request.
+"""
+
+# Import the required modules
+
+# Flask Modules
+from flask import Blueprint, abort, redirect, request
+
+# QR Codes
+from helpers.qr_codes import resolve_target
+from helpers.scan_counter import scan_counter
+
+# Create a Blueprint for the redirect routes
+blueprint = Blueprint("redirect", __name__, url_prefix="/q")
+
+# Route Endpoints
+
+
+@blueprint.route("/<code>")
+def _redirect(code):
+    target = resolve_target(code)
+
+    if target is None:
+        abort(404)
+
+    scan_counter.record(
+        code,
+        request.headers.get("User-Agent"),
+        request.headers.get("CF-IPCountry"),
+    )
+
+    # The target can change at any time, and every scan should reach us to be counted
+    response = redirect(target, 302)
+    response.headers["Cache-Control"] = "no-store"
+    return response
@@ -0,0 +1,23 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the filters shared by the forms, applied to the submitted data before it is validated.
+"""
+
+
+def normalise_email(email: str | None) -> str | None:
+    """
+    Normalises an email address, so that signing up and logging in map one address (in any case, or with
+    stray whitespace) to one account.
+
+    Args:
+        email (str | None): The email address as entered, or None if none was submitted.
+
+    Returns:
+        str | None: The stripped, lowercased email address.
+    """
+    if email is None:
+        return None
+
+    return email.strip().lower()
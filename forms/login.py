@@ -10,8 +10,13 @@ from flask_wtf import FlaskForm
 from wtforms import PasswordField, EmailField
 from wtforms.validators import DataRequired, Email
 
+# Filters
+from forms.filters import normalise_email
+
 
 # Create the login form
 class LoginForm(FlaskForm):
-    email = EmailField("Email", validators=[DataRequired(), Email()])
+    email = EmailField(
+        "Email", validators=[DataRequired(), Email()], filters=[normalise_email]
+    )
     password = PasswordField("Password", validators=[DataRequired()])
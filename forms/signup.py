@@ -10,11 +10,16 @@ from flask_wtf import FlaskForm
 from wtforms import PasswordField, EmailField, StringField
 from wtforms.validators import DataRequired, Email, EqualTo
 
+# Filters
+from forms.filters import normalise_email
+
 
 # Create the login form
 class SignupForm(FlaskForm):
     name = StringField("Name", validators=[DataRequired()])
-    email = EmailField("Email", validators=[DataRequired(), Email()])
+    email = EmailField(
+        "Email", validators=[DataRequired(), Email()], filters=[normalise_email]
+    )
     password = PasswordField("Password", validators=[DataRequired()])
     confirm_password = PasswordField(
         "Confirm Password", validators=[DataRequired(), EqualTo("password")]
@@ -0,0 +1,264 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the admission control middleware. Waitress queues requests without limit once all its
+threads are busy, so when MongoDB or reCAPTCHA slows down, requests pile up and every page gets slow. Instead,
+every request is classified by its path (auth, API, pages or redirects) and turned away straight away when
+its class already has too many requests in flight (503), or when its client has used up its share of that
+class (429), with a Retry-After header either way.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Werkzeug Modules
+from werkzeug.wsgi import ClosingIterator
+
+# Constants
+# The number of threads serving requests, which the default concurrency caps are fractions of
+SERVER_THREADS = int(os.getenv("waitress_threads", 16))
+
+# Request classes, by path prefix (checked in order); requests that match none are pages
+CLASS_PREFIXES = (
+    ("/api/forms/", "auth"),
+    ("/api/", "api"),
+    ("/q/", "redirect"),
+)
+
+# Paths that are never shed: health checks must keep answering under load, and static files are cheap
+EXEMPT_PREFIXES = ("/healthz", "/readyz", "/internal/", "/static/", "/assets/")
+
+# Per class: the maximum requests in flight, and the per-client token bucket (tokens per second, burst).
+# Auth requests wait on reCAPTCHA and password hashing, so they get the smallest share of the threads;
+# redirects are answered from memory, and many scanners can share one address behind carrier NAT.
+DEFAULT_LIMITS = {
+    "auth": (max(1, SERVER_THREADS // 4), 1.0, 10),
+    "api": (max(1, SERVER_THREADS // 2), 10.0, 40),
+    "pages": (max(1, SERVER_THREADS // 2), 10.0, 50),
+    "redirect": (SERVER_THREADS, 50.0, 200),
+}
+
+# The most clients tracked per class; the least recently seen are forgotten first
+MAX_CLIENTS = 65536
+
+# Seconds a client is told to wait when a class is at its concurrency cap
+BUSY_RETRY_AFTER = 1
+
+
+class RequestClass:
+    """
+    The concurrency cap and per-client token buckets of one class of requests.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_in_flight: int,
+        rate: float,
+        burst: int,
+        max_clients: int = MAX_CLIENTS,
+    ) -> None:
+        if max_in_flight <= 0 or rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid admission limits for {name} requests.")
+
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+
+        self.in_flight = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.admitted = 0
+        self.shed_busy = 0
+        self.shed_rate_limited = 0
+
+    def admit(self, client: str) -> tuple[int, int]:
+        """
+        Decides whether a request can be handled now, and takes a slot if so.
+
+        Args:
+            client (str): The address of the client.
+
+        Returns:
+            tuple[int, int]: The status to turn the request away with and the seconds to retry after, or
+                (0, 0) if the request was admitted (and must be released once it is done).
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens < 1:
+                self._buckets[client] = (tokens, now)
+                self.shed_rate_limited += 1
+                return 429, math.ceil((1 - tokens) / self.rate)
+
+            if self.in_flight >= self.max_in_flight:
+                # Busy requests do not cost the client a token, it did nothing wrong
+                self._buckets[client] = (tokens, now)
+                self.shed_busy += 1
+                return 503, BUSY_RETRY_AFTER
+
+            self._buckets[client] = (tokens - 1, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+            self.in_flight += 1
+            self.admitted += 1
+            return 0, 0
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "rate": self.rate,
+                "burst": self.burst,
+                "clients": len(self._buckets),
+                "admitted": self.admitted,
+                "shed_busy": self.shed_busy,
+                "shed_rate_limited": self.shed_rate_limited,
+            }
+
+
+def _limits_from_env(name: str, defaults: tuple) -> tuple:
+    max_in_flight, rate, burst = defaults
+    return (
+        int(os.getenv(f"admission_{name}_max_in_flight", max_in_flight)),
+        float(os.getenv(f"admission_{name}_rate", rate)),
+        int(os.getenv(f"admission_{name}_burst", burst)),
+    )
+
+
+class AdmissionControl:
+    """
+    WSGI middleware shedding the requests that cannot be handled promptly.
+
+    It wraps the outermost WSGI app (see init_app), so shed requests never reach Flask, sessions or the
+    database. Clients are identified by the CF-Connecting-IP header set by Cloudflare, falling back to the
+    address of the connection; a request holds its slot until its response has been sent (including
+    streamed responses).
+    """
+
+    def __init__(self, limits: dict | None = None) -> None:
+        self.app = None
+
+        if limits is None:
+            limits = {
+                name: _limits_from_env(name, defaults)
+                for name, defaults in DEFAULT_LIMITS.items()
+            }
+
+        self.classes = {
+            name: RequestClass(name, *values) for name, values in limits.items()
+        }
+
+    def init_app(self, app) -> None:
+        """
+        Wraps the WSGI app of a Flask app, outside any middleware already applied (e.g. ProxyFix).
+
+        Args:
+            app (Flask): The Flask app.
+
+        Returns:
+            None
+        """
+        self.app = app.wsgi_app
+        app.wsgi_app = self
+
+    def classify(self, path: str) -> str | None:
+        """
+        Returns the class of a request.
+
+        Args:
+            path (str): The path of the request.
+
+        Returns:
+            str | None: The class name, or None if the request is exempt.
+        """
+        if path.startswith(EXEMPT_PREFIXES):
+            return None
+
+        for prefix, name in CLASS_PREFIXES:
+            if path.startswith(prefix):
+                return name
+
+        return "pages"
+
+    def __call__(self, environ, start_response):
+        name = self.classify(environ.get("PATH_INFO", ""))
+        if name is None:
+            return self.app(environ, start_response)
+
+        request_class = self.classes[name]
+        client = environ.get("HTTP_CF_CONNECTING_IP") or environ.get("REMOTE_ADDR", "")
+        status, retry_after = request_class.admit(client)
+
+        if status:
+            return _reject(environ, start_response, name, status, retry_after)
+
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            request_class.release()
+            raise
+
+        return ClosingIterator(response, request_class.release)
+
+    def stats(self) -> dict:
+        """
+        Returns the in-flight requests and shedding counters of every class.
+
+        Returns:
+            dict: The stats of each class.
+        """
+        return {
+            name: request_class.stats() for name, request_class in self.classes.items()
+        }
+
+
+def _reject(environ, start_response, name: str, status: int, retry_after: int):
+    if status == 429:
+        message = "Too many requests, please slow down."
+        status_line = "429 Too Many Requests"
+    else:
+        message = "The server is busy, please try again shortly."
+        status_line = "503 Service Unavailable"
+
+    # API clients get the usual JSON error body
+    if name in ("api", "auth"):
+        body = json.dumps({"ok": False, "errors": {"server": [message]}}).encode()
+        content_type = "application/json"
+    else:
+        body = message.encode()
+        content_type = "text/plain; charset=utf-8"
+
+    start_response(
+        status_line,
+        [
+            ("Content-Type", content_type),
+            ("Content-Length", str(len(body))),
+            ("Retry-After", str(retry_after)),
+            ("Cache-Control", "no-store"),
+        ],
+    )
+    return [body]
+
+
+admission = AdmissionControl()
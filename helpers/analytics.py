@@ -0,0 +1,229 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the scan analytics rollups. Scans are never stored one by one: the scan counter
+(helpers/scan_counter.py) aggregates them in memory and upserts one rollup document per code and hour, and
+per code and day, with the scan total and a breakdown by device, operating system, browser and country.
+Dashboard charts read a handful of these documents instead of aggregating raw scans.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import datetime
+import re
+from collections import Counter
+
+# Third Party Modules
+from pymongo import UpdateOne
+
+# Database
+from helpers.db import scan_rollups_collection
+
+# User Agents
+from helpers.user_agent_parser import parse_user_agent
+
+# Constants
+GRANULARITIES = {
+    "hour": datetime.timedelta(hours=1),
+    "day": datetime.timedelta(days=1),
+}
+
+# Hourly rollups are removed by a TTL index on "expires_at" after this long; daily rollups are kept
+HOURLY_RETENTION = datetime.timedelta(days=35)
+
+# The longest range that can be read at once, per granularity
+MAX_RANGE = {
+    "hour": datetime.timedelta(days=7),
+    "day": datetime.timedelta(days=366),
+}
+
+DIMENSIONS = ("device", "os", "browser", "country")
+
+# Country codes as sent by Cloudflare in CF-IPCountry ("XX" when unknown, "T1" for Tor)
+COUNTRY_PATTERN = re.compile(r"^[A-Z][A-Z0-9]$")
+UNKNOWN_COUNTRY = "XX"
+
+# Breakdown values become field names, which must not contain dots or start with a dollar sign
+FIELD_UNSAFE_PATTERN = re.compile(r"[.$]")
+MAX_FIELD_LENGTH = 64
+
+
+def bucket_start(timestamp: datetime.datetime, granularity: str) -> datetime.datetime:
+    """
+    Returns the start of the rollup bucket a time falls in.
+
+    Args:
+        timestamp (datetime.datetime): The time, in UTC.
+        granularity (str): "hour" or "day".
+
+    Returns:
+        datetime.datetime: The start of the bucket.
+    """
+    if granularity == "day":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def normalise_country(country: str | None) -> str:
+    """
+    Validates a country code from the CF-IPCountry header.
+
+    Args:
+        country (str | None): The header value.
+
+    Returns:
+        str: The country code, or "XX" if it is missing or invalid.
+    """
+    if country and COUNTRY_PATTERN.match(country):
+        return country
+    return UNKNOWN_COUNTRY
+
+
+def _field(value: str) -> str:
+    return FIELD_UNSAFE_PATTERN.sub("_", value)[:MAX_FIELD_LENGTH] or "Other"
+
+
+def _rollup_id(code: str, granularity: str, bucket: datetime.datetime) -> str:
+    return f"{code}:{granularity}:{bucket:%Y%m%d%H}"
+
+
+def aggregate_scans(scans: dict) -> dict:
+    """
+    Turns buffered scans into rollup increments.
+
+    Args:
+        scans (dict): Scan counts keyed by (code, hour, user agent, country), where hour is the start of the
+            hour the scans happened in.
+
+    Returns:
+        dict: Per (code, granularity, bucket), a Counter of the fields to increment.
+    """
+    rollups = {}
+
+    for (code, hour, user_agent, country), count in scans.items():
+        device, os_family, browser = parse_user_agent(user_agent)
+        fields = {
+            "total": count,
+            f"device.{_field(device)}": count,
+            f"os.{_field(os_family)}": count,
+            f"browser.{_field(browser)}": count,
+            f"country.{normalise_country(country)}": count,
+        }
+
+        for granularity in GRANULARITIES:
+            key = (code, granularity, bucket_start(hour, granularity))
+            rollups.setdefault(key, Counter()).update(fields)
+
+    return rollups
+
+
+def merge_rollups(into: dict, rollups: dict) -> None:
+    """
+    Adds rollup increments to others, e.g. to retry increments that failed to be written.
+
+    Args:
+        into (dict): The increments to add to.
+        rollups (dict): The increments to add (see aggregate_scans).
+
+    Returns:
+        None
+    """
+    for key, fields in rollups.items():
+        into.setdefault(key, Counter()).update(fields)
+
+
+def rollup_updates(rollups: dict) -> list[UpdateOne]:
+    """
+    Builds the upserts writing rollup increments.
+
+    Args:
+        rollups (dict): The increments to write (see aggregate_scans).
+
+    Returns:
+        list[UpdateOne]: One upsert per rollup document.
+    """
+    operations = []
+
+    for (code, granularity, bucket), fields in rollups.items():
+        on_insert = {"code": code, "granularity": granularity, "bucket": bucket}
+        if granularity == "hour":
+            on_insert["expires_at"] = bucket + HOURLY_RETENTION
+
+        operations.append(
+            UpdateOne(
+                {"_id": _rollup_id(code, granularity, bucket)},
+                {"$inc": dict(fields), "$setOnInsert": on_insert},
+                upsert=True,
+            )
+        )
+
+    return operations
+
+
+def read_rollups(
+    code: str,
+    granularity: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+) -> dict:
+    """
+    Reads the analytics of a code over a range of time.
+
+    Args:
+        code (str): The code.
+        granularity (str): "hour" or "day".
+        start (datetime.datetime): The start of the range (rounded down to the start of its bucket).
+        end (datetime.datetime): The end of the range, exclusive.
+
+    Returns:
+        dict: The scan total per bucket ("series", with empty buckets included), and the total and breakdowns
+            over the whole range.
+    """
+    start = bucket_start(start, granularity)
+    step = GRANULARITIES[granularity]
+
+    documents = scan_rollups_collection.find(
+        {
+            "code": code,
+            "granularity": granularity,
+            "bucket": {"$gte": start, "$lt": end},
+        },
+        {
+            "_id": 0,
+            "bucket": 1,
+            "total": 1,
+            **{dimension: 1 for dimension in DIMENSIONS},
+        },
+    )
+
+    totals = {}
+    breakdowns = {dimension: Counter() for dimension in DIMENSIONS}
+
+    for document in documents:
+        bucket = document["bucket"]
+        if bucket.tzinfo is None:
+            bucket = bucket.replace(tzinfo=datetime.UTC)
+
+        totals[bucket] = document.get("total", 0)
+        for dimension in DIMENSIONS:
+            breakdowns[dimension].update(document.get(dimension, {}))
+
+    series = []
+    bucket = start
+    while bucket < end:
+        series.append({"bucket": bucket.isoformat(), "scans": totals.get(bucket, 0)})
+        bucket += step
+
+    return {
+        "granularity": granularity,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total": sum(totals.values()),
+        "series": series,
+        "breakdown": {
+            dimension: dict(counts.most_common())
+            for dimension, counts in breakdowns.items()
+        },
+    }
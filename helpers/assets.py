@@ -0,0 +1,119 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file serves the fingerprinted static assets produced by build_assets.py. Templates link to assets with
+asset_url(), which returns the fingerprinted URL when the asset has been built, and falls back to the raw
+file in static/ otherwise (e.g. in development before the first build).
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import json
+import mimetypes
+import os
+
+# Flask Modules
+from flask import abort, request, send_from_directory, url_for
+
+# Constants
+DIST_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static", "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+URL_PREFIX = "/assets"
+
+# Precompressed variants, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# Fingerprinted files never change, so browsers and CDNs may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# The loaded manifest: source path -> {"path": fingerprinted path, "encodings": [...]}
+_manifest = {}
+
+# The fingerprinted paths that may be served, with their available encodings
+_served = {}
+
+
+def load_manifest() -> None:
+    """
+    Loads the asset manifest written by build_assets.py, if there is one.
+
+    Returns:
+        None
+    """
+    global _manifest, _served
+
+    try:
+        with open(MANIFEST_PATH) as manifest_file:
+            _manifest = json.load(manifest_file)["assets"]
+    except FileNotFoundError:
+        _manifest = {}
+
+    _served = {asset["path"]: set(asset["encodings"]) for asset in _manifest.values()}
+
+
+def asset_url(filename: str) -> str:
+    """
+    Returns the URL of a static asset.
+
+    Args:
+        filename (str): The path of the asset inside static/, e.g. "css/tailwind.css".
+
+    Returns:
+        str: The fingerprinted URL if the asset has been built, otherwise the plain static URL.
+    """
+    asset = _manifest.get(filename)
+
+    if asset is None:
+        return url_for("static", filename=filename)
+
+    return f"{URL_PREFIX}/{asset['path']}"
+
+
+def serve_asset(filename: str):
+    """
+    Serves a fingerprinted asset, picking a precompressed variant supported by the client.
+    """
+    encodings = _served.get(filename)
+
+    if encodings is None:
+        abort(404)
+
+    accepted = request.accept_encodings
+
+    for encoding, extension in ENCODINGS:
+        if encoding in encodings and accepted[encoding]:
+            response = send_from_directory(
+                DIST_DIR,
+                filename + extension,
+                # Keep the type of the original file rather than the compressed one
+                mimetype=mimetypes.guess_type(filename)[0],
+                max_age=None,
+            )
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(DIST_DIR, filename, max_age=None)
+
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def init_app(app) -> None:
+    """
+    Loads the manifest, registers the asset route and makes asset_url() available to templates.
+
+    Args:
+        app (Flask): The Flask app.
+
+    Returns:
+        None
+    """
+    load_manifest()
+
+    app.add_url_rule(
+        f"{URL_PREFIX}/<path:filename>", endpoint="assets", view_func=serve_asset
+    )
+    app.add_template_global(asset_url)
@@ -0,0 +1,174 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the records of bulk QR generation jobs. A job is stored when a batch starts and its
+progress is written back at most once per PROGRESS_INTERVAL_SECONDS, so that progress can be polled from any
+process and the per-user job limit holds across processes. Finished jobs are removed by a TTL index on
+"created_at" (see INDEXES in helpers/db.py).
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import datetime
+import time
+import uuid
+
+# Third Party Modules
+from pymongo.errors import PyMongoError
+
+# Database
+from helpers.db import batch_jobs_collection
+
+# Import the custom logger
+from helpers.logger import QRLOG_DB
+
+# Constants
+# How often a running job writes its progress
+PROGRESS_INTERVAL_SECONDS = 1
+
+# Running jobs that have not written progress for this long are treated as abandoned (e.g. the process
+# running them was killed), so that they stop counting towards the per-user limit
+JOB_STALE_AFTER = datetime.timedelta(minutes=5)
+
+# The fields returned to the job's owner
+PUBLIC_FIELDS = {
+    "_id": 1,
+    "status": 1,
+    "total": 1,
+    "completed": 1,
+    "failed": 1,
+    "created_at": 1,
+    "updated_at": 1,
+}
+
+
+class BatchJob:
+    """
+    A running job, which buffers its progress and writes it to the database periodically.
+    """
+
+    def __init__(self, job_id: str, total: int) -> None:
+        self.id = job_id
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+
+        self._written_at = time.monotonic()
+
+    def _write(self, fields: dict) -> None:
+        self._written_at = time.monotonic()
+
+        try:
+            batch_jobs_collection.update_one({"_id": self.id}, {"$set": fields})
+        except PyMongoError as e:
+            # Progress is informational, it must never fail the batch itself
+            QRLOG_DB.warning(
+                f"Failed to write the progress of batch job {self.id}: {e}"
+            )
+
+    def advance(self, ok: bool) -> None:
+        """
+        Records one finished item.
+
+        Args:
+            ok (bool): Whether the item was rendered successfully.
+
+        Returns:
+            None
+        """
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+        if time.monotonic() - self._written_at >= PROGRESS_INTERVAL_SECONDS:
+            self._write(
+                {
+                    "completed": self.completed,
+                    "failed": self.failed,
+                    "updated_at": datetime.datetime.now(datetime.UTC),
+                }
+            )
+
+    def finish(self, status: str) -> None:
+        """
+        Records the end of the job.
+
+        Args:
+            status (str): "done", or "cancelled" if the client went away before the end.
+
+        Returns:
+            None
+        """
+        self._write(
+            {
+                "status": status,
+                "completed": self.completed,
+                "failed": self.failed,
+                "updated_at": datetime.datetime.now(datetime.UTC),
+            }
+        )
+
+
+def start_job(user_uuid: str, total: int, max_running: int) -> BatchJob | None:
+    """
+    Records a new job, unless the user already has too many running.
+
+    The job is stored first and the user's running jobs counted afterwards, so that concurrent requests
+    cannot both slip under the limit.
+
+    Args:
+        user_uuid (str): The uuid of the user starting the job.
+        total (int): The number of items in the job.
+        max_running (int): The number of jobs a user may run at the same time.
+
+    Returns:
+        BatchJob | None: The job, or None if the user is at their limit.
+    """
+    now = datetime.datetime.now(datetime.UTC)
+    job_id = str(uuid.uuid4())
+
+    batch_jobs_collection.insert_one(
+        {
+            "_id": job_id,
+            "user_uuid": user_uuid,
+            "status": "running",
+            "total": total,
+            "completed": 0,
+            "failed": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+    )
+
+    running = batch_jobs_collection.count_documents(
+        {
+            "user_uuid": user_uuid,
+            "status": "running",
+            "updated_at": {"$gt": now - JOB_STALE_AFTER},
+        }
+    )
+
+    if running > max_running:
+        batch_jobs_collection.delete_one({"_id": job_id})
+        return None
+
+    return BatchJob(job_id, total)
+
+
+def find_job(job_id: str, user_uuid: str) -> dict | None:
+    """
+    Looks up one of a user's jobs.
+
+    Args:
+        job_id (str): The id of the job.
+        user_uuid (str): The uuid of the user owning the job.
+
+    Returns:
+        dict | None: The job's status and progress, or None if the user has no such job.
+    """
+    return batch_jobs_collection.find_one(
+        {"_id": job_id, "user_uuid": user_uuid}, PUBLIC_FIELDS
+    )
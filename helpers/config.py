@@ -0,0 +1,15 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the settings of the site shared by several parts of the app.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import os
+
+# Constants
+# The public URL of the site, without a trailing slash, used for the absolute links in the sitemap and emails
+BASE_URL = os.getenv("base_url", "https://betterqr.app").rstrip("/")
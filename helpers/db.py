@@ -7,43 +7,356 @@ You may not use, copy, distribute, modify, or sell this code without the express
 
 # Python Standard Library
 import os
+import threading
+import time
 
 # Third Party Modules
+import pymongo
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from dotenv import load_dotenv
 
-# Import the custom logger and setup function
-from helpers.logger import QRLOG_DB, setup_betterqr_logging
+# Import the custom logger
+from helpers.logger import QRLOG_DB
 
-# Load the environment variables
-load_dotenv()
+# Session lifetime, used by the sessions TTL index
+from helpers.session_cache import SESSION_LIFETIME
 
-# Ensure logging is configured
-setup_betterqr_logging()
+# Request instrumentation
+from helpers.metrics import MongoCommandListener
 
-uri = os.getenv("mongodb_uri")
+# Constants
+DATABASE_NAME = "betterqr"
 
-# Create a new client and connect to the server
-client = MongoClient(uri, server_api=ServerApi("1"))
+# How long bulk QR generation job records are kept
+BATCH_JOB_RETENTION_SECONDS = 24 * 60 * 60
 
-# Send a ping to confirm a successful connection
-try:
-    client.admin.command("ping")
-    QRLOG_DB.info("Successfully connected to the MongoDB server")
-except Exception as e:
-    QRLOG_DB.error(f"Failed to connect to the MongoDB server: {e}")
-    exit(1)
+# How long delivered (or abandoned) emails are kept in the mail queue
+MAIL_RETENTION_SECONDS = 30 * 24 * 60 * 60
 
-QRLOG_DB.info("Database connection established.")
-QRLOG_DB.info("Creating links to the databases and collections.")
+# How long the readiness check waits for the server
+PING_TIMEOUT_SECONDS = 2
+
+# How long to wait between attempts to ensure the indexes in the background
+INDEX_RETRY_SECONDS = 30
+
+# The client is created on first use, so that importing this module never touches the network
+_client = None
+_client_lock = threading.Lock()
+
+# Every LazyCollection, so that they can drop the client's collections after a fork
+_lazy_collections = []
+
+
+def get_client() -> MongoClient:
+    """
+    Returns the MongoDB client, creating it on first use.
+
+    Creating the client does not wait for the server: connections are opened in the background and by
+    the first operation that needs one. The pool and timeouts are configured through the environment.
+
+    Returns:
+        MongoClient: The client shared by the whole process.
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    os.getenv("mongodb_uri"),
+                    server_api=ServerApi("1"),
+                    event_listeners=[MongoCommandListener()],
+                    maxPoolSize=int(os.getenv("mongodb_max_pool_size", 100)),
+                    minPoolSize=int(os.getenv("mongodb_min_pool_size", 0)),
+                    maxIdleTimeMS=int(os.getenv("mongodb_max_idle_time_ms", 300000)),
+                    connectTimeoutMS=int(os.getenv("mongodb_connect_timeout_ms", 5000)),
+                    serverSelectionTimeoutMS=int(
+                        os.getenv("mongodb_server_selection_timeout_ms", 5000)
+                    ),
+                    socketTimeoutMS=int(os.getenv("mongodb_socket_timeout_ms", 10000)),
+                )
+                QRLOG_DB.info("MongoDB client created.")
+
+    return _client
+
+
+def _reset_after_fork() -> None:
+    """
+    Drops the client in a forked child, which creates its own on first use: a client's connections and
+    monitoring threads cannot be shared with the parent.
+    """
+    global _client, _client_lock
+
+    _client = None
+    _client_lock = threading.Lock()
+
+    for collection in _lazy_collections:
+        collection.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_database():
+    """
+    Returns the betterqr database.
+
+    Returns:
+        Database: The database.
+    """
+    return get_client()[DATABASE_NAME]
+
+
+class LazyCollection:
+    """
+    Stands in for a collection until it is first used, then forwards to it.
+    """
+
+    def __init__(self, name: str, database: str = DATABASE_NAME) -> None:
+        self.name = name
+        self.database = database
+        self._collection = None
+        _lazy_collections.append(self)
+
+    def _get(self):
+        if self._collection is None:
+            self._collection = get_client()[self.database][self.name]
+        return self._collection
+
+    def reset(self) -> None:
+        """
+        Forgets the collection, so that it is looked up again (from a new client) on next use.
+        """
+        self._collection = None
+
+    def __getattr__(self, attribute):
+        return getattr(self._get(), attribute)
+
+    def __repr__(self) -> str:
+        return f"LazyCollection({self.name!r})"
 
-# Create links to the databases and collections
-betterqr_db = client["betterqr"]
 
 # Create a collection for the users
-users_collection = betterqr_db["users"]
+users_collection = LazyCollection("users")
+
+# Create a collection for the login sessions, one document per session keyed by sid
+sessions_collection = LazyCollection("user_sessions")
+
+# Create a collection for the dynamic QR codes, one document per code keyed by the code
+qr_codes_collection = LazyCollection("qr_codes")
+
+# Create a collection for the hourly and daily scan analytics rollups of the dynamic QR codes
+scan_rollups_collection = LazyCollection("scan_rollups")
+
+# Create a collection for the progress of bulk QR generation jobs
+batch_jobs_collection = LazyCollection("qr_batch_jobs")
+
+# Create a collection for the outgoing emails waiting to be delivered
+mail_queue_collection = LazyCollection("mail_queue")
+
+# Create a capped collection of revoked session ids, tailed by servers without change streams
+session_revocations_collection = LazyCollection("session_revocations")
+
+
+def ping() -> bool:
+    """
+    Checks whether the MongoDB server is reachable, waiting at most PING_TIMEOUT_SECONDS.
+
+    Returns:
+        bool: True if the server answered the ping.
+    """
+    try:
+        with pymongo.timeout(PING_TIMEOUT_SECONDS):
+            get_client().admin.command("ping")
+    except PyMongoError as e:
+        QRLOG_DB.warning(f"MongoDB ping failed: {e}")
+        return False
+
+    return True
+
+
+# Index registry
+# Every index the app relies on, per collection. They are ensured once, at startup or through the
+# "flask ensure-indexes" command, so that no request ever has to issue DDL.
+INDEXES = {
+    "users": [
+        {"keys": [("email", ASCENDING)], "unique": True},
+        {"keys": [("uuid", ASCENDING)], "unique": True},
+    ],
+    # Sessions are looked up by sid, which is their _id and therefore always indexed
+    "user_sessions": [
+        {"keys": [("user_uuid", ASCENDING)]},
+        {
+            "keys": [("created_at", ASCENDING)],
+            "expireAfterSeconds": int(SESSION_LIFETIME.total_seconds()),
+        },
+    ],
+    # Codes are resolved by their _id; a user's codes are listed newest first, a page at a time
+    "qr_codes": [
+        {"keys": [("owner", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    # Rollups are upserted by _id, and read as a range of buckets of one code; hourly rollups expire
+    "scan_rollups": [
+        {
+            "keys": [
+                ("code", ASCENDING),
+                ("granularity", ASCENDING),
+                ("bucket", ASCENDING),
+            ]
+        },
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    # Counting a user's running jobs is the only query besides lookups by _id
+    "qr_batch_jobs": [
+        {"keys": [("user_uuid", ASCENDING), ("status", ASCENDING)]},
+        {
+            "keys": [("created_at", ASCENDING)],
+            "expireAfterSeconds": BATCH_JOB_RETENTION_SECONDS,
+        },
+    ],
+    # Senders claim the next due email; finished emails expire (pending ones have no "finished_at")
+    "mail_queue": [
+        {"keys": [("status", ASCENDING), ("next_attempt_at", ASCENDING)]},
+        {
+            "keys": [("finished_at", ASCENDING)],
+            "expireAfterSeconds": MAIL_RETENTION_SECONDS,
+        },
+    ],
+}
+
+# Indexes of the Flask-Session collection, which lives in the database named by "mongodb_db"
+FLASK_SESSION_INDEXES = [{"keys": [("expiration", ASCENDING)], "expireAfterSeconds": 0}]
+
+# Indexes that used to be created by the app and must be removed
+RETIRED_INDEXES = {
+    # A TTL index on an array inside the user document expires the whole user, not the array entry
+    "users": ["logged_out_sessions.created_at_1"],
+    # Replaced by the (owner, created_at, _id) index, which serves the same queries
+    "qr_codes": ["owner_1"],
+}
+
+
+def index_name(keys: list) -> str:
+    """
+    Generates the default MongoDB name for an index.
+
+    Args:
+        keys (list): The (field, direction) pairs of the index.
+
+    Returns:
+        str: The index name, e.g. "email_1".
+    """
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def _registered_collections():
+    """
+    Yields the name, collection and registered indexes of every indexed collection.
+    """
+    for collection_name, indexes in INDEXES.items():
+        yield collection_name, get_database()[collection_name], indexes
+
+    session_db = os.getenv("mongodb_db")
+    session_collection = os.getenv("mongodb_session_collection")
+
+    if session_db and session_collection:
+        yield (
+            f"{session_db}.{session_collection}",
+            get_client()[session_db][session_collection],
+            FLASK_SESSION_INDEXES,
+        )
+
+
+def ensure_indexes() -> None:
+    """
+    Creates every index in the registry and drops the retired ones.
+
+    Creating an index that already exists is a no-op, so this is safe to run on every startup. Failures
+    are logged rather than raised so that one bad index (e.g. duplicate emails preventing a unique index)
+    does not stop the others from being created.
+
+    Returns:
+        None
+    """
+    for collection_name, collection, indexes in _registered_collections():
+        for index in indexes:
+            options = {key: value for key, value in index.items() if key != "keys"}
+
+            try:
+                collection.create_index(index["keys"], **options)
+            except OperationFailure as e:
+                QRLOG_DB.error(
+                    f"Failed to create index {index_name(index['keys'])} on {collection_name}: {e}"
+                )
+
+    for collection_name, names in RETIRED_INDEXES.items():
+        collection = get_database()[collection_name]
+        existing = collection.index_information()
+
+        for name in names:
+            if name in existing:
+                collection.drop_index(name)
+                QRLOG_DB.warning(f"Dropped retired index {name} on {collection_name}")
+
+    QRLOG_DB.info("Database indexes ensured.")
+
+
+def report_indexes() -> dict:
+    """
+    Compares the indexes in the database with the registry.
+
+    Returns:
+        dict: Per collection, the registered indexes that are "missing", the indexes that exist but are not
+            registered ("unexpected"), and the indexes that have not been used since the server started
+            ("unused", only when the server allows $indexStats).
+    """
+    report = {}
+
+    for collection_name, collection, indexes in _registered_collections():
+        existing = collection.index_information()
+        expected = {index_name(index["keys"]) for index in indexes} | {"_id_"}
+
+        try:
+            unused = sorted(
+                stats["name"]
+                for stats in collection.aggregate([{"$indexStats": {}}])
+                if stats["accesses"]["ops"] == 0
+            )
+        except OperationFailure:
+            unused = None
+
+        report[collection_name] = {
+            "missing": sorted(expected - set(existing)),
+            "unexpected": sorted(set(existing) - expected),
+            "unused": unused,
+        }
+
+    return report
+
+
+def ensure_indexes_in_background() -> threading.Thread:
+    """
+    Ensures the indexes from a background thread, retrying until the server is reachable, so that
+    starting the app never waits for (or fails because of) the database.
+
+    Returns:
+        threading.Thread: The started thread.
+    """
+
+    def run():
+        while True:
+            try:
+                ensure_indexes()
+                return
+            except PyMongoError as e:
+                QRLOG_DB.warning(
+                    f"Could not ensure indexes, retrying in {INDEX_RETRY_SECONDS}s: {e}"
+                )
+                time.sleep(INDEX_RETRY_SECONDS)
 
-# Log the successful creation of the links
-QRLOG_DB.info("Links to the databases and collections created.")
-QRLOG_DB.info("Database setup complete.")
+    thread = threading.Thread(target=run, name="betterqr-index-bootstrap", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,41 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the guard used by the internal (operator only) endpoints.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import hmac
+import os
+
+# Flask Modules
+from flask import request, jsonify
+
+# Constants
+INTERNAL_KEY_HEADER = "X-Internal-Key"
+
+
+def require_internal_key():
+    """
+    Rejects requests that do not carry the internal API key.
+
+    Meant to be registered as a before_request hook on internal blueprints. When no key is configured
+    the internal endpoints are disabled entirely and look like they do not exist.
+
+    Returns:
+        Response | None: An error response if the request is not allowed, otherwise None.
+    """
+    expected_key = os.getenv("internal_api_key")
+
+    if not expected_key:
+        return "The page you are looking for does not exist.", 404
+
+    provided_key = request.headers.get(INTERNAL_KEY_HEADER, "")
+
+    if not hmac.compare_digest(provided_key.encode(), expected_key.encode()):
+        return jsonify({"ok": False, "errors": {"auth": ["Invalid internal key."]}}), 403
+
+    return None
@@ -1,17 +1,54 @@
 # Import the required modules
+import atexit
+import datetime
 import logging
+import os
+import queue
 import re
+import threading
+from logging.handlers import QueueHandler
+
+# Third Party Modules
+import msgspec
 
 # Constants
 # Output file name
 OUTPUT_FILE_NAME = "logs/betterqr.log"
 
+# Maximum number of records waiting to be written before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv("log_queue_size", 10000))
+
+# Maximum number of records written between two flushes
+LOG_BATCH_SIZE = 256
+
+# Output format, "text" or "json" (one JSON object per line)
+LOG_FORMAT = os.getenv("log_format", "text")
+
+
+# Date format used by every text formatter
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# ANSI escape sequences regex pattern
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1B[@-_][0-?]*[ -/]*[@-~]")
+
+# Extra fields of betterqr.requests records, in display order, with their colour and format.
+# "{c}" and "{r}" are replaced by the field colour and the reset sequence.
+REQUEST_FIELDS = (
+    ("method", "METHOD", "{c}%(method)s{r} "),
+    ("path", "PATH", "{c}%(path)s{r} "),
+    ("addr", "ADDR", "{c}%(addr)s{r} "),
+    ("real_addr", "REAL_ADDR", "({c}%(real_addr)s{r}) "),
+    ("status", "STATUS", "{c}%(status)s{r}"),
+    ("duration", "DURATION", " {c}%(duration)sms{r}"),
+    ("db_ops", "DB", " {c}db=%(db_ops)s{r}"),
+    ("db_time", "DB", "{c}/%(db_time)sms{r}"),
+    ("external_time", "EXTERNAL", " {c}ext=%(external_time)sms{r}"),
+)
+
 
 # Helper functions
 def remove_ansi_escape_sequences(s: str) -> str:
-    # ANSI escape sequences regex pattern
-    ansi_escape_pattern = re.compile(r"\x1B[@-_][0-?]*[ -/]*[@-~]")
-    return ansi_escape_pattern.sub("", s)
+    return ANSI_ESCAPE_PATTERN.sub("", s)
 
 
 # Custom formatter class with colors
@@ -28,19 +65,28 @@ class CustomFormatter(logging.Formatter):
     }
     RESET = "\033[0m"
 
+    def __init__(self):
+        super().__init__()
+        # One formatter per level, built once
+        self._formatters = {}
+
+    def _build(self, levelname):
+        log_fmt = f'{self.COLORS.get("DATE")}%(asctime)s{self.RESET} {self.COLORS.get(levelname, "")}%(levelname)s{self.RESET}     {self.COLORS.get("NAME")}%(name)s{self.RESET} %(message)s'
+        return logging.Formatter(log_fmt, DATE_FORMAT)
+
     def format(self, record):
-        log_fmt = f'{self.COLORS.get("DATE")}%(asctime)s{self.RESET} {self.COLORS.get(record.levelname, "")}%(levelname)s{self.RESET}     {self.COLORS.get("NAME")}%(name)s{self.RESET} %(message)s'
-        formatter = logging.Formatter(log_fmt, "%Y-%m-%d %H:%M:%S")
+        formatter = self._formatters.get(record.levelname)
+        if formatter is None:
+            formatter = self._formatters[record.levelname] = self._build(
+                record.levelname
+            )
         return formatter.format(record)
 
 
-# Custom formatter that removes ANSI colors
+# Custom formatter without ANSI colors
 class CustomFileFormatter(logging.Formatter):
-    def format(self, record):
-        log_fmt = "%(asctime)s %(levelname)s %(name)s %(message)s"
-        formatter = logging.Formatter(log_fmt, "%Y-%m-%d %H:%M:%S")
-        original_format = formatter.format(record)
-        return remove_ansi_escape_sequences(original_format)
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s", DATE_FORMAT)
 
 
 # Define the betterqr sub-loggers
@@ -64,84 +110,265 @@ class CustomRequestFormatter(logging.Formatter):
         "ADDR": "\033[35m",  # Magenta
         "REAL_ADDR": "\033[1;95m",  # Bold Magenta
         "STATUS": "\033[1;93m",  # Bold Yellow
+        "DURATION": "\033[1;97m",  # Bold White
+        "DB": "\033[32m",  # Green
+        "EXTERNAL": "\033[36m",  # Cyan
     }
     RESET = "\033[0m"
 
-    def format(self, record):
+    def __init__(self):
+        super().__init__()
+        # One formatter per (level, fields present) shape, built once
+        self._formatters = {}
+
+    def _build(self, levelname, fields):
         log_fmt = (
-            f'{self.COLORS.get("DATE")}%(asctime)s{self.RESET} '
-            f'{self.COLORS.get(record.levelname, "")}%(levelname)s{self.RESET} '
-            f'{self.COLORS.get("NAME")}%(name)s{self.RESET} '
+            f'{self.COLORS.get("DATE", "")}%(asctime)s{self.RESET} '
+            f'{self.COLORS.get(levelname, "")}%(levelname)s{self.RESET} '
+            f'{self.COLORS.get("NAME", "")}%(name)s{self.RESET} '
+        )
+        for name, color, fmt in REQUEST_FIELDS:
+            if name in fields:
+                log_fmt += fmt.format(c=self.COLORS.get(color, ""), r=self.RESET)
+
+        return logging.Formatter(log_fmt, DATE_FORMAT)
+
+    def format(self, record):
+        shape = (
+            record.levelname,
+            tuple(name for name, _, _ in REQUEST_FIELDS if hasattr(record, name)),
         )
-        if hasattr(record, "method"):
-            log_fmt += f'{self.COLORS.get("METHOD")}%(method)s{self.RESET} '
-        if hasattr(record, "path"):
-            log_fmt += f'{self.COLORS.get("PATH")}%(path)s{self.RESET} '
-        if hasattr(record, "addr"):
-            log_fmt += f'{self.COLORS.get("ADDR")}%(addr)s{self.RESET} '
-        if hasattr(record, "real_addr"):
-            log_fmt += f'({self.COLORS.get("REAL_ADDR")}%(real_addr)s{self.RESET}) '
-        if hasattr(record, "status"):
-            log_fmt += f'{self.COLORS.get("STATUS")}%(status)s{self.RESET}'
-
-        formatter = logging.Formatter(log_fmt, "%Y-%m-%d %H:%M:%S")
+
+        formatter = self._formatters.get(shape)
+        if formatter is None:
+            formatter = self._formatters[shape] = self._build(*shape)
         return formatter.format(record)
 
 
 # Custom file formatter for betterqr.requests without ANSI colors
-class CustomRequestFileFormatter(logging.Formatter):
+class CustomRequestFileFormatter(CustomRequestFormatter):
+    COLORS = {}
+    RESET = ""
+
+
+# Formatter that writes every record as one JSON object per line, for log shippers
+class JSONLinesFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__()
+        self._encoder = msgspec.json.Encoder()
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.UTC
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, _, _ in REQUEST_FIELDS:
+            if hasattr(record, name):
+                entry[name] = getattr(record, name)
+
+        return self._encoder.encode(entry).decode()
+
+
+# Formatter that picks the request or the generic format depending on the logger
+class DispatchFormatter(logging.Formatter):
+    def __init__(self, request_formatter, default_formatter):
+        super().__init__()
+        self.request_formatter = request_formatter
+        self.default_formatter = default_formatter
+
     def format(self, record):
-        log_fmt = "%(asctime)s %(levelname)s %(name)s "
-        if hasattr(record, "method"):
-            log_fmt += "%(method)s "
-        if hasattr(record, "path"):
-            log_fmt += "%(path)s "
-        if hasattr(record, "addr"):
-            log_fmt += "%(addr)s "
-        if hasattr(record, "real_addr"):
-            log_fmt += "(%(real_addr)s) "
-        if hasattr(record, "status"):
-            log_fmt += "%(status)s"
-
-        formatter = logging.Formatter(log_fmt, "%Y-%m-%d %H:%M:%S")
-        original_format = formatter.format(record)
-        return remove_ansi_escape_sequences(original_format)
-
-
-# Create file and console handlers for QRLOG_REQUESTS
-file_handler_requests = logging.FileHandler(
-    filename=OUTPUT_FILE_NAME, mode="a"
-)  # Append mode
-file_handler_requests.setFormatter(CustomRequestFileFormatter())
-console_handler_requests = logging.StreamHandler()
-console_handler_requests.setFormatter(CustomRequestFormatter())
-
-# Add handlers to QRLOG_REQUESTS
-QRLOG_REQUESTS.addHandler(file_handler_requests)
-QRLOG_REQUESTS.addHandler(console_handler_requests)
-
-# Create file and console handlers for other loggers
-file_handler_main = logging.FileHandler(
-    filename=OUTPUT_FILE_NAME, mode="a"
-)  # Append mode
-file_handler_main.setFormatter(CustomFileFormatter())
-console_handler_main = logging.StreamHandler()
-console_handler_main.setFormatter(CustomFormatter())
-
-# Add handlers to the other loggers
-QRLOG_MAIN.addHandler(file_handler_main)
-QRLOG_MAIN.addHandler(console_handler_main)
-QRLOG_DB.addHandler(file_handler_main)
-QRLOG_DB.addHandler(console_handler_main)
+        if record.name == QRLOG_REQUESTS.name:
+            return self.request_formatter.format(record)
+        return self.default_formatter.format(record)
+
+
+# Handler mixin that leaves flushing to the listener, so that a whole batch is flushed at once
+class DeferredFlushMixin:
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+            self.stream.write(msg + self.terminator)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class BatchedFileHandler(DeferredFlushMixin, logging.FileHandler):
+    pass
+
+
+class BatchedStreamHandler(DeferredFlushMixin, logging.StreamHandler):
+    pass
+
+
+# Queue handler that drops records instead of blocking when the queue is full
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+# Listener that writes queued records from a single background thread
+class BatchQueueListener:
+    """
+    Writes records from a queue to a set of handlers on one background thread.
+
+    All records that are waiting when the thread wakes up are written as one batch (up to LOG_BATCH_SIZE),
+    and the handlers are flushed once per batch rather than once per record.
+    """
+
+    _sentinel = None
+
+    def __init__(self, queue, *handlers, batch_size=LOG_BATCH_SIZE):
+        self.queue = queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._monitor, name="betterqr-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Writes every record still in the queue, then stops the background thread.
+        """
+        if not self.running:
+            return
+
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+    def _monitor(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                    continue
+
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+
+            for handler in self.handlers:
+                handler.flush()
+
+            if stop:
+                return
+
+
+# Create one file handler and one console handler shared by every betterqr logger
+os.makedirs(os.path.dirname(OUTPUT_FILE_NAME), exist_ok=True)
+
+file_handler = BatchedFileHandler(filename=OUTPUT_FILE_NAME, mode="a")  # Append mode
+file_handler.setFormatter(
+    DispatchFormatter(CustomRequestFileFormatter(), CustomFileFormatter())
+)
+console_handler = BatchedStreamHandler()
+console_handler.setFormatter(
+    DispatchFormatter(CustomRequestFormatter(), CustomFormatter())
+)
+
+# Records are only put on a queue by the logging threads, and written by the listener's thread
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(log_queue)
+queue_listener = BatchQueueListener(log_queue, file_handler, console_handler)
+
+# Attach the queue handler to the parent of all betterqr loggers
+QRLOG_ROOT = logging.getLogger("betterqr")
+QRLOG_ROOT.addHandler(queue_handler)
+QRLOG_ROOT.propagate = False
+
+
+def logging_stats() -> dict:
+    """
+    Returns the state of the logging queue.
+
+    Returns:
+        dict: The number of records waiting to be written and the number of records dropped.
+    """
+    return {"queued": log_queue.qsize(), "dropped": queue_handler.dropped}
+
+
+def stop_betterqr_logging() -> None:
+    """
+    Flushes every queued record and stops the background writer. Registered to run at exit.
+
+    Returns:
+        None
+    """
+    queue_listener.stop()
+
+
+atexit.register(stop_betterqr_logging)
+
+
+def _flush_before_fork() -> None:
+    # Anything left in the handlers' buffers would otherwise be written by the child as well
+    file_handler.flush()
+    console_handler.flush()
+
+
+def _restart_after_fork() -> None:
+    """
+    Gives a forked child its own queue and background writer, as the parent's writer thread does not exist
+    in the child (records still queued in the parent are written by the parent).
+    """
+    global log_queue
+
+    was_running = queue_listener._thread is not None
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler.queue = log_queue
+    queue_handler._dropped_lock = threading.Lock()
+    queue_listener.queue = log_queue
+    queue_listener._thread = None
+
+    if was_running:
+        queue_listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_flush_before_fork, after_in_child=_restart_after_fork)
 
 
 # Setup function
-def setup_betterqr_logging(level=logging.INFO) -> None:
+def setup_betterqr_logging(level=logging.INFO, log_format=None) -> None:
     """
-    Sets the levels for all betterqr related loggers.
+    Sets the levels for all betterqr related loggers and starts the background writer.
 
     Args:
         level (int): The logging level to set.
+        log_format (str | None): "text" or "json", defaults to the "log_format" environment variable.
 
     Returns:
         None
@@ -155,11 +382,25 @@ def setup_betterqr_logging(level=logging.INFO) -> None:
     }:
         raise ValueError("The level must be a valid logging level.")
 
+    log_format = log_format or LOG_FORMAT
+
+    if log_format not in {"text", "json"}:
+        raise ValueError("The log format must be either 'text' or 'json'.")
+
+    if log_format == "json":
+        json_formatter = JSONLinesFormatter()
+        file_handler.setFormatter(json_formatter)
+        console_handler.setFormatter(json_formatter)
+
     # Define betterqr logging levels
     logging.getLogger("betterqr.main").setLevel(level)
     logging.getLogger("betterqr.requests").setLevel(level)
     logging.getLogger("betterqr.db").setLevel(level)
 
+    # Start writing queued records (only once, this function may be called several times)
+    if not queue_listener.running:
+        queue_listener.start()
+
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,418 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the outgoing mail queue. Emails are rendered when they are queued and stored in the
+mail_queue collection, and a background thread in every process delivers the ones that are due, so that no
+request waits for a mail server, and emails queued before a restart or while the mail server is down are
+still delivered later. A sender claims an email by pushing its next attempt back with an atomic update, so
+an email whose sender died mid-delivery is retried once the claim runs out (delivery is at least once).
+
+Emails are delivered over SMTP, or with "mail_backend" set to "outbox", written as .eml files to a local
+directory, standing in for a mail server in development and testing.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import atexit
+import datetime
+import functools
+import os
+import smtplib
+import threading
+import uuid
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+# Third Party Modules
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+# Flask Modules
+from flask import render_template
+
+# Database
+from helpers.db import mail_queue_collection
+
+# Import the custom logger
+from helpers.logger import QRLOG_MAIN
+
+# Constants
+IMAGES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "static", "images"
+)
+
+# Images that emails can embed, referenced from their HTML as cid:<filename without extension>
+INLINE_IMAGES = {
+    "betterqr-email-banner.svg": ("image", "svg+xml"),
+}
+
+DEFAULT_FROM = "BetterQR <no-reply@betterqr.app>"
+DEFAULT_SMTP_PORT = 25
+DEFAULT_SMTP_TIMEOUT = 10
+DEFAULT_OUTBOX_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "outbox")
+
+# How often each process looks for due emails when it has not queued any itself
+DEFAULT_POLL_INTERVAL_SECONDS = 10
+
+# How long a claimed email is left to its sender before another one may retry it
+CLAIM_SECONDS = 60
+
+# Delivery attempts before an email is given up on, and the delay before each retry (doubling)
+MAX_ATTEMPTS = 8
+RETRY_BASE_SECONDS = 30
+
+
+class SmtpMailBackend:
+    """
+    Delivers emails to an SMTP server.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = DEFAULT_SMTP_PORT,
+        username: str | None = None,
+        password: str | None = None,
+        starttls: bool = False,
+        timeout: float = DEFAULT_SMTP_TIMEOUT,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, message: EmailMessage) -> None:
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            smtp.send_message(message)
+
+
+class OutboxMailBackend:
+    """
+    Writes emails to .eml files in a local directory instead of sending them, for development and testing.
+    """
+
+    def __init__(self, directory: str = DEFAULT_OUTBOX_DIR) -> None:
+        self.directory = directory
+
+    def send(self, message: EmailMessage) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+        name = f"{datetime.datetime.now(datetime.UTC):%Y%m%dT%H%M%S}-{uuid.uuid4().hex}.eml"
+        path = os.path.join(self.directory, name)
+
+        # Written under a temporary name and renamed, so that a reader never sees half an email
+        with open(path + ".tmp", "wb") as file:
+            file.write(message.as_bytes())
+        os.replace(path + ".tmp", path)
+
+
+def create_mail_backend():
+    """
+    Creates the delivery backend selected by the "mail_backend" environment variable.
+
+    Returns:
+        SmtpMailBackend | OutboxMailBackend: The backend.
+    """
+    backend = os.getenv("mail_backend", "smtp")
+
+    if backend == "outbox":
+        directory = os.getenv("mail_outbox_dir", DEFAULT_OUTBOX_DIR)
+        QRLOG_MAIN.warning(f"Using the outbox mail backend, emails go to {directory}.")
+        return OutboxMailBackend(directory)
+
+    if backend != "smtp":
+        raise ValueError("The mail backend must be either 'smtp' or 'outbox'.")
+
+    return SmtpMailBackend(
+        os.getenv("mail_smtp_host", "localhost"),
+        port=int(os.getenv("mail_smtp_port", DEFAULT_SMTP_PORT)),
+        username=os.getenv("mail_smtp_username"),
+        password=os.getenv("mail_smtp_password"),
+        starttls=os.getenv("mail_smtp_starttls", "false").lower() == "true",
+        timeout=float(os.getenv("mail_smtp_timeout", DEFAULT_SMTP_TIMEOUT)),
+    )
+
+
+@functools.lru_cache(maxsize=len(INLINE_IMAGES))
+def _inline_image(filename: str) -> bytes:
+    with open(os.path.join(IMAGES_DIR, filename), "rb") as file:
+        return file.read()
+
+
+def build_message(mail: dict, sender: str = DEFAULT_FROM) -> EmailMessage:
+    """
+    Builds the MIME message of a queued email: plain text, with an HTML alternative and its inline images.
+
+    Args:
+        mail (dict): The mail queue document.
+        sender (str): The From address.
+
+    Returns:
+        EmailMessage: The message.
+    """
+    message = EmailMessage()
+    message["Subject"] = mail["subject"]
+    message["From"] = sender
+    message["To"] = mail["to"]
+    message["Date"] = formatdate(localtime=False)
+    message["Message-ID"] = make_msgid(idstring=mail["_id"], domain="betterqr.app")
+
+    message.set_content(mail["text"])
+    message.add_alternative(mail["html"], subtype="html")
+
+    html = message.get_payload()[1]
+    for filename in mail.get("inline", []):
+        maintype, subtype = INLINE_IMAGES[filename]
+        html.add_related(
+            _inline_image(filename),
+            maintype=maintype,
+            subtype=subtype,
+            cid=f"<{os.path.splitext(filename)[0]}>",
+            filename=filename,
+        )
+
+    return message
+
+
+class MailSender:
+    """
+    Delivers the queued emails that are due in the background.
+
+    It wakes up every poll interval, or straight away when this process queues an email, and delivers due
+    emails until there are none left. Failed deliveries are retried with a doubling delay, up to
+    MAX_ATTEMPTS times.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        interval: float = DEFAULT_POLL_INTERVAL_SECONDS,
+        sender: str = DEFAULT_FROM,
+    ) -> None:
+        self.interval = interval
+        self.sender = sender
+
+        # The backend is created on first use, so that importing this module never needs mail settings
+        self._backend = backend
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._atexit_registered = False
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = create_mail_backend()
+        return self._backend
+
+    def wake(self) -> None:
+        """
+        Makes the background thread look for due emails now.
+
+        Returns:
+            None
+        """
+        self._wake.set()
+
+    def _claim(self) -> dict | None:
+        now = datetime.datetime.now(datetime.UTC)
+
+        return mail_queue_collection.find_one_and_update(
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {
+                "$set": {
+                    "next_attempt_at": now + datetime.timedelta(seconds=CLAIM_SECONDS)
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _deliver(self, mail: dict) -> None:
+        now = datetime.datetime.now(datetime.UTC)
+
+        try:
+            self.backend.send(build_message(mail, self.sender))
+        except Exception as e:
+            # Any failure (including a malformed email) is retried, so that one email cannot stop the sender
+            if mail["attempts"] >= MAX_ATTEMPTS:
+                QRLOG_MAIN.error(f"Giving up on email {mail['_id']}: {e}")
+                update = {"status": "failed", "finished_at": now, "last_error": str(e)}
+                self.failed += 1
+            else:
+                QRLOG_MAIN.warning(
+                    f"Could not deliver email {mail['_id']}, retrying: {e}"
+                )
+                delay = RETRY_BASE_SECONDS * 2 ** (mail["attempts"] - 1)
+                update = {
+                    "next_attempt_at": now + datetime.timedelta(seconds=delay),
+                    "last_error": str(e),
+                }
+                self.retried += 1
+        else:
+            update = {"status": "sent", "finished_at": now}
+            self.sent += 1
+
+        mail_queue_collection.update_one({"_id": mail["_id"]}, {"$set": update})
+
+    def deliver_due(self) -> int:
+        """
+        Delivers every email that is due.
+
+        Returns:
+            int: The number of emails attempted.
+        """
+        attempted = 0
+
+        while not self._stop.is_set():
+            mail = self._claim()
+            if mail is None:
+                break
+
+            self._deliver(mail)
+            attempted += 1
+
+        return attempted
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.deliver_due()
+            except PyMongoError as e:
+                QRLOG_MAIN.warning(f"Could not read the mail queue: {e}")
+
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self) -> None:
+        """
+        Starts delivering emails in the background (only once, this may be called several times).
+
+        Returns:
+            None
+        """
+        if self.running:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="betterqr-mail-sender", daemon=True
+        )
+        self._thread.start()
+
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self) -> None:
+        """
+        Stops the background thread, letting a delivery in progress finish. Emails still queued are
+        delivered by another process, or after the next start.
+
+        Returns:
+            None
+        """
+        self._stop.set()
+        self._wake.set()
+
+        if self.running:
+            self._thread.join(DEFAULT_SMTP_TIMEOUT)
+        self._thread = None
+
+    def reset_after_fork(self) -> None:
+        """
+        Restarts the background thread in a forked child if it was running in the parent.
+
+        Returns:
+            None
+        """
+        was_running = self._thread is not None
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+        if was_running:
+            self.start()
+
+    def stats(self) -> dict:
+        """
+        Returns the delivery counters of this process.
+
+        Returns:
+            dict: Whether the sender is running, and how many emails it sent, retried and gave up on.
+        """
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+# The sender shared by the whole process
+mail_sender = MailSender(
+    interval=float(os.getenv("mail_poll_interval", DEFAULT_POLL_INTERVAL_SECONDS)),
+    sender=os.getenv("mail_from", DEFAULT_FROM),
+)
+
+# Forked server workers deliver emails too
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=mail_sender.reset_after_fork)
+
+
+def queue_mail(to: str, subject: str, template: str, inline=(), **context) -> str:
+    """
+    Renders an email and queues it for delivery. Must be called with an app context.
+
+    Args:
+        to (str): The recipient.
+        subject (str): The subject.
+        template (str): The template name: emails/<template>.txt and emails/<template>.html are rendered.
+        inline (Iterable[str]): The INLINE_IMAGES the HTML references.
+        **context: The template variables.
+
+    Raises:
+        PyMongoError: If the email could not be queued.
+
+    Returns:
+        str: The id of the queued email.
+    """
+    now = datetime.datetime.now(datetime.UTC)
+
+    mail = {
+        "_id": str(uuid.uuid4()),
+        "to": to,
+        "subject": subject,
+        "text": render_template(f"emails/{template}.txt", **context),
+        "html": render_template(f"emails/{template}.html", **context),
+        "inline": [filename for filename in inline if filename in INLINE_IMAGES],
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now,
+    }
+
+    mail_queue_collection.insert_one(mail)
+    mail_sender.wake()
+
+    return mail["_id"]
@@ -0,0 +1,236 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the request instrumentation. Every request gets a RequestStats object that collects its
+duration and the time it spent in MongoDB commands and external HTTP calls, and finished requests are added
+to rolling per-endpoint latency windows exposed by the internal metrics endpoint.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import contextlib
+import contextvars
+import threading
+import time
+from collections import deque
+
+# Third Party Modules
+from pymongo import monitoring
+
+# Constants
+# Number of recent requests kept per endpoint to compute percentiles from
+WINDOW_SIZE = 1024
+
+# Percentiles reported for every endpoint
+PERCENTILES = (50, 95, 99)
+
+
+class RequestStats:
+    """
+    The timings collected for a single request.
+    """
+
+    __slots__ = (
+        "started_at",
+        "duration",
+        "db_ops",
+        "db_time",
+        "external_calls",
+        "external_time",
+    )
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.duration = 0.0
+        self.db_ops = 0
+        self.db_time = 0.0
+        self.external_calls = 0
+        self.external_time = 0.0
+
+
+# The stats of the request being handled by the current thread, if any
+_current_request = contextvars.ContextVar("betterqr_request_stats", default=None)
+
+
+class EndpointWindow:
+    """
+    A rolling window of the most recent requests to one endpoint.
+    """
+
+    def __init__(self, size: int = WINDOW_SIZE) -> None:
+        self.count = 0
+        self.durations = deque(maxlen=size)
+        self.db_ops = deque(maxlen=size)
+        self.db_times = deque(maxlen=size)
+        self.external_times = deque(maxlen=size)
+
+    def add(self, stats: RequestStats) -> None:
+        self.count += 1
+        self.durations.append(stats.duration)
+        self.db_ops.append(stats.db_ops)
+        self.db_times.append(stats.db_time)
+        self.external_times.append(stats.external_time)
+
+    def snapshot(self) -> dict:
+        durations = sorted(self.durations)
+        samples = len(durations)
+
+        snapshot = {"count": self.count, "samples": samples}
+
+        for percentile in PERCENTILES:
+            index = min(samples - 1, (samples * percentile) // 100)
+            snapshot[f"p{percentile}_ms"] = round(durations[index] * 1000, 3)
+
+        snapshot["mean_db_ops"] = round(sum(self.db_ops) / samples, 3)
+        snapshot["mean_db_ms"] = round(sum(self.db_times) / samples * 1000, 3)
+        snapshot["mean_external_ms"] = round(
+            sum(self.external_times) / samples * 1000, 3
+        )
+
+        return snapshot
+
+
+# Per-endpoint windows and process-wide totals
+_windows = {}
+_windows_lock = threading.Lock()
+_totals = {"requests": 0, "db_ops": 0, "db_time": 0.0}
+_external_totals = {}
+
+
+def start_request() -> RequestStats:
+    """
+    Starts collecting stats for the request handled by the current thread.
+
+    Returns:
+        RequestStats: The stats object for the request.
+    """
+    stats = RequestStats()
+    _current_request.set(stats)
+    return stats
+
+
+def finish_request(endpoint: str) -> RequestStats | None:
+    """
+    Stops collecting stats for the current request and adds them to the endpoint's window.
+
+    Args:
+        endpoint (str): The endpoint the request was routed to.
+
+    Returns:
+        RequestStats | None: The finished stats, or None if start_request was not called.
+    """
+    stats = _current_request.get()
+
+    if stats is None:
+        return None
+
+    _current_request.set(None)
+    stats.duration = time.perf_counter() - stats.started_at
+
+    with _windows_lock:
+        window = _windows.get(endpoint)
+        if window is None:
+            window = _windows[endpoint] = EndpointWindow()
+        window.add(stats)
+        _totals["requests"] += 1
+
+    return stats
+
+
+def record_db_command(duration: float) -> None:
+    """
+    Attributes a database command to the current request (if any) and the process totals.
+
+    Args:
+        duration (float): How long the command took, in seconds.
+
+    Returns:
+        None
+    """
+    stats = _current_request.get()
+
+    if stats is not None:
+        stats.db_ops += 1
+        stats.db_time += duration
+
+    with _windows_lock:
+        _totals["db_ops"] += 1
+        _totals["db_time"] += duration
+
+
+@contextlib.contextmanager
+def track_external(name: str):
+    """
+    Attributes the time spent in the wrapped block to the current request as an external call.
+
+    Args:
+        name (str): The name of the external service, used to break down the process totals.
+    """
+    started_at = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started_at
+        stats = _current_request.get()
+
+        if stats is not None:
+            stats.external_calls += 1
+            stats.external_time += duration
+
+        with _windows_lock:
+            service = _external_totals.get(name)
+            if service is None:
+                service = _external_totals[name] = {"calls": 0, "time": 0.0}
+            service["calls"] += 1
+            service["time"] += duration
+
+
+def endpoint_stats() -> dict:
+    """
+    Returns the latency percentiles and mean database/external time of every endpoint.
+
+    Returns:
+        dict: A snapshot per endpoint, keyed by endpoint name.
+    """
+    with _windows_lock:
+        return {
+            endpoint: window.snapshot()
+            for endpoint, window in sorted(_windows.items())
+        }
+
+
+def totals() -> dict:
+    """
+    Returns the process-wide request, database and external call counters.
+
+    Returns:
+        dict: A copy of the counters, with external calls broken down by service.
+    """
+    with _windows_lock:
+        return {
+            **_totals,
+            "external": {
+                name: dict(service) for name, service in _external_totals.items()
+            },
+        }
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Attributes every MongoDB command to the request that issued it.
+
+    Commands are run on the thread that issued them, so the current request is the one in the thread's
+    context.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record_db_command(event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        record_db_command(event.duration_micros / 1_000_000)
@@ -0,0 +1,136 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the full-page response cache for public pages. A cached page is rendered and minified
+once per endpoint and variant, then served from memory with a strong ETag, so that repeat visitors get a
+304 and everyone else skips template rendering and minification.
+
+Cached pages must not contain anything user specific: the CSRF token of the login and signup forms is
+fetched separately from /api/forms/csrf.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import functools
+import re
+
+# Third Party Modules
+import xxhash
+
+# Flask Modules
+from flask import Response, current_app, request, session
+
+
+class PageCache:
+    """
+    An in-memory cache of rendered and minified HTML pages.
+    """
+
+    def __init__(self) -> None:
+        self._entries = {}
+        self._minify = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app, minify=None) -> None:
+        """
+        Hands minification of cached pages over from Flask-Minify to the cache.
+
+        Must be called once all blueprints are registered. The cached endpoints are added to Flask-Minify's
+        bypass list, and their output is minified once when it is cached instead of on every response.
+
+        Args:
+            app (Flask): The Flask app.
+            minify (Minify | None): The Flask-Minify extension, if the app uses it.
+
+        Returns:
+            None
+        """
+        self._minify = minify
+
+        if minify is None:
+            return
+
+        endpoints = [
+            endpoint
+            for endpoint, view in app.view_functions.items()
+            if getattr(view, "_page_cached", False)
+        ]
+        minify.bypass = list(minify.bypass) + [
+            f"^{re.escape(endpoint)}$" for endpoint in endpoints
+        ]
+
+    def cached(self, variant=None):
+        """
+        Decorator caching the HTML returned by a view.
+
+        Pages are not cached in debug mode (so template changes show up) or when the session has flashed
+        messages waiting to be displayed.
+
+        Args:
+            variant (callable | None): Returns a key for the variant of the page to serve, for pages that
+                differ between requests in a known way.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if current_app.debug or "_flashes" in session:
+                    return view(*args, **kwargs)
+
+                key = (request.endpoint, variant() if variant else None)
+                entry = self._entries.get(key)
+
+                if entry is None:
+                    self.misses += 1
+
+                    html = view(*args, **kwargs)
+                    if not isinstance(html, str):
+                        return html
+
+                    entry = self._entries[key] = self._store(html)
+                else:
+                    self.hits += 1
+
+                body, etag = entry
+                response = Response(body, mimetype="text/html")
+                response.set_etag(etag)
+                response.headers["Cache-Control"] = "no-cache"
+                return response.make_conditional(request)
+
+            wrapper._page_cached = True
+            return wrapper
+
+        return decorator
+
+    def _store(self, html: str) -> tuple[bytes, str]:
+        if self._minify is not None:
+            html = self._minify.get_minified_or_cached(html, "html")
+
+        body = html.encode()
+        return body, xxhash.xxh3_128_hexdigest(body)
+
+    def clear(self) -> None:
+        """
+        Drops every cached page.
+
+        Returns:
+            None
+        """
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: The number of cached pages, hits and misses.
+        """
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# The cache shared by the whole process
+page_cache = PageCache()
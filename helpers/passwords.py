@@ -0,0 +1,170 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the password hashing pool. Password hashing is deliberately slow, so it is run in a
+small pool of separate processes instead of on the request threads, with an admission limit so that a burst
+of logins or signups is rejected quickly instead of queueing behind the pool.
+
+This module is imported by the pool's worker processes, so it must stay free of app and database imports.
+The workers are spawned, so they also re-import the script that was run (e.g. app.py), which is why the app
+starts its background work from its entry points rather than on import.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Third Party Modules
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Constants
+# The hash parameters new and upgraded passwords are hashed with
+PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+
+# How long a request waits for its password check before giving up
+PASSWORD_TIMEOUT_SECONDS = 10
+
+
+class PasswordPoolSaturated(Exception):
+    """
+    Raised when the password pool cannot take any more work right now.
+    """
+
+
+def needs_rehash(pwhash: str) -> bool:
+    """
+    Checks whether a password hash was made with outdated parameters.
+
+    Args:
+        pwhash (str): The stored password hash.
+
+    Returns:
+        bool: True if the hash should be upgraded to PASSWORD_HASH_METHOD.
+    """
+    return pwhash.split("$", 1)[0] != PASSWORD_HASH_METHOD
+
+
+def _verify_and_rehash(pwhash: str, password: str) -> tuple[bool, str | None]:
+    # Runs in a worker process
+    if not check_password_hash(pwhash, password):
+        return False, None
+
+    if needs_rehash(pwhash):
+        return True, generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+    return True, None
+
+
+def _hash(password: str) -> str:
+    # Runs in a worker process
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+
+# The pool is created on first use, in the process that uses it
+_executor = None
+_executor_lock = threading.Lock()
+
+_workers = int(os.getenv("password_workers", max(1, (os.cpu_count() or 1) // 2)))
+_max_pending = int(os.getenv("password_max_pending", _workers * 2))
+_admission = threading.BoundedSemaphore(_max_pending)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Workers are spawned rather than forked, as forking a process with running request
+                # threads can copy locks in a held state
+                _executor = ProcessPoolExecutor(
+                    max_workers=_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+
+    return _executor
+
+
+def _reset_after_fork() -> None:
+    # The parent's pool (its workers and management thread) stays with the parent, a forked child starts
+    # its own on first use
+    global _executor, _executor_lock, _admission
+
+    _executor = None
+    _executor_lock = threading.Lock()
+    _admission = threading.BoundedSemaphore(_max_pending)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _submit(function, *args):
+    """
+    Runs a function in the pool, within the admission limit, and waits for its result.
+    """
+    global _executor
+
+    if not _admission.acquire(blocking=False):
+        raise PasswordPoolSaturated()
+
+    try:
+        future = _get_executor().submit(function, *args)
+    except BrokenProcessPool:
+        _admission.release()
+        _executor = None
+        raise PasswordPoolSaturated()
+    except BaseException:
+        _admission.release()
+        raise
+
+    # The slot is only freed once the work is done, even if the request stops waiting for it
+    future.add_done_callback(lambda _: _admission.release())
+
+    try:
+        return future.result(timeout=PASSWORD_TIMEOUT_SECONDS)
+    except TimeoutError:
+        raise PasswordPoolSaturated()
+    except BrokenProcessPool:
+        _executor = None
+        raise PasswordPoolSaturated()
+
+
+def verify_password(pwhash: str, password: str) -> tuple[bool, str | None]:
+    """
+    Checks a password against its stored hash in the password pool.
+
+    Args:
+        pwhash (str): The stored password hash.
+        password (str): The password to check.
+
+    Raises:
+        PasswordPoolSaturated: If the pool is too busy to check the password right now.
+
+    Returns:
+        tuple[bool, str | None]: Whether the password is correct, and a new hash to store if the stored
+            one uses outdated parameters.
+    """
+    return _submit(_verify_and_rehash, pwhash, password)
+
+
+def hash_password(password: str) -> str:
+    """
+    Hashes a new password with PASSWORD_HASH_METHOD in the password pool.
+
+    Args:
+        password (str): The password to hash.
+
+    Raises:
+        PasswordPoolSaturated: If the pool is too busy to hash the password right now.
+
+    Returns:
+        str: The password hash to store.
+    """
+    return _submit(_hash, password)
@@ -0,0 +1,328 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the on-demand profilers behind the internal profiling endpoints. The stack sampler records
+what every thread of the process is running, a number of times per second, as collapsed stacks (the input
+of flamegraph.pl, speedscope and similar tools). The request profiler runs cProfile on a fraction of the
+requests whose path starts with a given prefix, and merges their profiles into one set of pstats.
+
+Both only see the process that handles the request starting them, i.e. one worker when serving with several.
+While the request profiler is off it costs each request one attribute check.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import cProfile
+import functools
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+# Flask Modules
+from flask import g, request
+
+# Constants
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stack sampling limits: the sampling request holds a server thread for its whole duration
+DEFAULT_SAMPLE_SECONDS = 10
+MAX_SAMPLE_SECONDS = 60
+DEFAULT_SAMPLE_RATE = 100
+MAX_SAMPLE_RATE = 1000
+
+# Request profiling limits: it turns itself off after this long, in case it is forgotten
+DEFAULT_PROFILE_SECONDS = 60
+MAX_PROFILE_SECONDS = 600
+
+# Pstats sort keys accepted for text reports
+REPORT_SORT_KEYS = ("cumulative", "tottime", "calls", "ncalls")
+
+
+class ProfilerBusy(Exception):
+    """
+    Raised when the stacks are sampled while another sampling is running.
+    """
+
+
+@functools.lru_cache(maxsize=16384)
+def _frame_label(code) -> str:
+    # Paths are shortened to the project or the installed package, and ";" separates frames
+    filename = code.co_filename
+    if filename.startswith(ROOT_DIR):
+        filename = os.path.relpath(filename, ROOT_DIR)
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[-1]
+
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+_sampling_lock = threading.Lock()
+
+
+def sample_stacks(seconds: float, rate: float) -> dict[str, int]:
+    """
+    Samples the stacks of every other thread of the process.
+
+    Args:
+        seconds (float): How long to sample for.
+        rate (float): How many samples to take per second.
+
+    Raises:
+        ValueError: If the duration or rate is out of range.
+        ProfilerBusy: If the stacks are already being sampled.
+
+    Returns:
+        dict[str, int]: How many times each collapsed stack (thread name first, innermost frame last,
+            separated by ";") was seen.
+    """
+    if not 0 < seconds <= MAX_SAMPLE_SECONDS:
+        raise ValueError(
+            f"The duration must be between 0 and {MAX_SAMPLE_SECONDS} seconds."
+        )
+    if not 0 < rate <= MAX_SAMPLE_RATE:
+        raise ValueError(
+            f"The rate must be between 0 and {MAX_SAMPLE_RATE} samples per second."
+        )
+
+    if not _sampling_lock.acquire(blocking=False):
+        raise ProfilerBusy("The stacks are already being sampled.")
+
+    try:
+        sampler = threading.get_ident()
+        interval = 1 / rate
+        counts = {}
+
+        next_sample = time.perf_counter()
+        deadline = next_sample + seconds
+
+        while next_sample < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for ident, frame in sys._current_frames().items():
+                if ident == sampler:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}").replace(";", ":"))
+
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+
+            next_sample += interval
+            delay = next_sample - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind (e.g. waiting for the GIL), so skip the missed samples instead of bunching up
+                next_sample = time.perf_counter()
+
+        return counts
+    finally:
+        _sampling_lock.release()
+
+
+def collapsed(counts: dict[str, int]) -> str:
+    """
+    Formats sampled stacks as collapsed stack lines.
+
+    Args:
+        counts (dict[str, int]): The counts returned by sample_stacks.
+
+    Returns:
+        str: One "stack count" line per stack.
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+class RequestProfiler:
+    """
+    Profiles a sampled fraction of the requests matching a path prefix with cProfile.
+
+    cProfile only profiles the thread that enables it, so every chosen request gets its own profile, from
+    the before_request hook to the end of the request (the view, the after_request hooks and logging), and
+    the finished profiles are merged. Starting a new profiling session discards the results of the last one.
+    """
+
+    def __init__(self) -> None:
+        # (generation, prefix, fraction, ends_at) while profiling, None otherwise. Read on every request
+        # without the lock, and replaced as a whole.
+        self.active = None
+
+        self._generation = 0
+        self._stats = None
+        self._lock = threading.Lock()
+
+        self.prefix = None
+        self.fraction = None
+        self.profiled = 0
+
+    def init_app(self, app) -> None:
+        """
+        Registers the request hooks. Requests are profiled from the hooks registered after these.
+
+        Args:
+            app (Flask): The Flask app.
+
+        Returns:
+            None
+        """
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def start(self, prefix: str, fraction: float, seconds: float) -> None:
+        """
+        Starts profiling requests, discarding the results of the last session.
+
+        Args:
+            prefix (str): Only requests whose path starts with this are profiled.
+            fraction (float): The fraction of the matching requests to profile.
+            seconds (float): How long to profile for.
+
+        Raises:
+            ValueError: If any of the arguments is out of range.
+
+        Returns:
+            None
+        """
+        if not isinstance(prefix, str) or not prefix.startswith("/"):
+            raise ValueError("The prefix must be a path starting with /.")
+        if not 0 < fraction <= 1:
+            raise ValueError("The fraction must be between 0 and 1.")
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ValueError(
+                f"The duration must be between 0 and {MAX_PROFILE_SECONDS} seconds."
+            )
+
+        with self._lock:
+            self._generation += 1
+            self._stats = None
+            self.prefix = prefix
+            self.fraction = fraction
+            self.profiled = 0
+            self.active = (
+                self._generation,
+                prefix,
+                fraction,
+                time.monotonic() + seconds,
+            )
+
+    def stop(self) -> None:
+        """
+        Stops profiling requests, keeping the results collected so far.
+
+        Returns:
+            None
+        """
+        self.active = None
+
+    def _before_request(self):
+        active = self.active
+        if active is None:
+            return
+
+        generation, prefix, fraction, ends_at = active
+
+        if time.monotonic() >= ends_at:
+            # Only stop the session that ran out, not one started since
+            if self.active is active:
+                self.active = None
+            return
+
+        if not request.path.startswith(prefix) or random.random() >= fraction:
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running on this thread
+            return
+
+        g._request_profile = (generation, profile)
+
+    def _teardown_request(self, exc):
+        profiled = g.pop("_request_profile", None)
+        if profiled is None:
+            return
+
+        generation, profile = profiled
+        profile.disable()
+
+        stats = pstats.Stats(profile)
+
+        with self._lock:
+            # The session was restarted while this request was running
+            if generation != self._generation:
+                return
+
+            if self._stats is None:
+                self._stats = stats
+            else:
+                self._stats.add(stats)
+            self.profiled += 1
+
+    def status(self) -> dict:
+        """
+        Returns the state of the profiler.
+
+        Returns:
+            dict: Whether it is profiling, its settings and how many requests it has profiled.
+        """
+        active = self.active
+
+        return {
+            "active": active is not None,
+            "prefix": self.prefix,
+            "fraction": self.fraction,
+            "seconds_left": (
+                round(max(0.0, active[3] - time.monotonic()), 1) if active else 0
+            ),
+            "profiled": self.profiled,
+        }
+
+    def dump(self) -> bytes | None:
+        """
+        Returns the merged profile in the pstats file format (as written by cProfile's -o option).
+
+        Returns:
+            bytes | None: The profile, or None if no request has been profiled.
+        """
+        with self._lock:
+            if self._stats is None:
+                return None
+            return marshal.dumps(self._stats.stats)
+
+    def report(self, sort: str = "cumulative", limit: int = 50) -> str | None:
+        """
+        Returns the merged profile as a pstats text report.
+
+        Args:
+            sort (str): The pstats sort key (see REPORT_SORT_KEYS).
+            limit (int): The number of functions to list.
+
+        Returns:
+            str | None: The report, or None if no request has been profiled.
+        """
+        stream = io.StringIO()
+
+        with self._lock:
+            if self._stats is None:
+                return None
+
+            self._stats.stream = stream
+            self._stats.sort_stats(sort).print_stats(limit)
+
+        return stream.getvalue()
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,400 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the store of dynamic QR codes. Every code is a document in the qr_codes collection keyed
+by the code itself, holding the URL that /q/<code> redirects to. Targets are resolved through the redirect
+cache (helpers/redirect_cache.py), which edits made here invalidate.
+
+A user's codes are listed newest first with keyset pagination on the (owner, created_at, _id) index: each
+page continues from the last code of the previous one, so every page costs the same however many codes the
+user has. The number of codes a user owns is kept in "counters.qr_codes" on their user document instead of
+being counted.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import base64
+import binascii
+import datetime
+import re
+import secrets
+import string
+from urllib.parse import urlsplit
+
+# Third Party Modules
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+# Database
+from helpers.db import qr_codes_collection, users_collection
+
+# Redirect Cache
+from helpers.redirect_cache import redirect_cache
+
+# Import the custom logger
+from helpers.logger import QRLOG_DB
+
+# Constants
+CODE_ALPHABET = string.ascii_letters + string.digits
+CODE_LENGTH = 7
+
+# Codes are only looked up if they could have been generated, so that junk never reaches the database
+CODE_PATTERN = re.compile(r"^[A-Za-z0-9]{1,32}$")
+
+MAX_TARGET_LENGTH = 2048
+
+# How many times a new code is generated again if it is already taken
+CODE_ATTEMPTS = 5
+
+# The fields returned to the owner of a code
+PUBLIC_FIELDS = {
+    "_id": 1,
+    "target": 1,
+    "scans": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "last_scanned_at": 1,
+}
+
+# The fields shown in the list of a user's codes
+LIST_FIELDS = {"_id": 1, "target": 1, "scans": 1, "created_at": 1}
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.UTC)
+
+
+class InvalidTarget(ValueError):
+    """
+    Raised when a target URL is not allowed.
+    """
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a page cursor was not returned by list_codes.
+    """
+
+
+def validate_target(target) -> str:
+    """
+    Checks that a target is an absolute http(s) URL.
+
+    Args:
+        target: The target to check.
+
+    Raises:
+        InvalidTarget: If the target is not allowed.
+
+    Returns:
+        str: The target.
+    """
+    if not isinstance(target, str) or not target:
+        raise InvalidTarget("The target must be a URL.")
+
+    if len(target) > MAX_TARGET_LENGTH:
+        raise InvalidTarget(
+            f"The target must be at most {MAX_TARGET_LENGTH} characters long."
+        )
+
+    try:
+        parts = urlsplit(target)
+    except ValueError:
+        raise InvalidTarget("The target must be a URL.")
+
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        raise InvalidTarget("The target must be an http or https URL.")
+
+    return target
+
+
+def generate_code() -> str:
+    """
+    Generates a random code.
+
+    Returns:
+        str: The code.
+    """
+    return "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+
+
+def create_code(owner: str, target: str) -> dict:
+    """
+    Creates a dynamic QR code.
+
+    Args:
+        owner (str): The uuid of the user creating the code.
+        target (str): The URL the code redirects to.
+
+    Raises:
+        InvalidTarget: If the target is not allowed.
+
+    Returns:
+        dict: The stored code document.
+    """
+    validate_target(target)
+    now = datetime.datetime.now(datetime.UTC)
+
+    for attempt in range(CODE_ATTEMPTS):
+        document = {
+            "_id": generate_code(),
+            "owner": owner,
+            "target": target,
+            "scans": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+        try:
+            qr_codes_collection.insert_one(document)
+        except DuplicateKeyError:
+            if attempt == CODE_ATTEMPTS - 1:
+                raise
+            continue
+
+        # The code may have been scanned (and cached as not existing) before it was created
+        redirect_cache.invalidate(document["_id"])
+
+        try:
+            users_collection.update_one(
+                {"uuid": owner}, {"$inc": {"counters.qr_codes": 1}}
+            )
+        except PyMongoError as e:
+            # The code exists, only the count is off until the counters are recounted
+            QRLOG_DB.warning(f"Could not count the new code of user {owner}: {e}")
+
+        return document
+
+
+def update_target(code: str, owner: str, target: str) -> dict | None:
+    """
+    Changes the URL a code redirects to.
+
+    Args:
+        code (str): The code to change.
+        owner (str): The uuid of the user changing the code, who must own it.
+        target (str): The new URL.
+
+    Raises:
+        InvalidTarget: If the target is not allowed.
+
+    Returns:
+        dict | None: The updated code, or None if the user owns no such code.
+    """
+    validate_target(target)
+
+    document = qr_codes_collection.find_one_and_update(
+        {"_id": code, "owner": owner},
+        {
+            "$set": {
+                "target": target,
+                "updated_at": datetime.datetime.now(datetime.UTC),
+            }
+        },
+        projection=PUBLIC_FIELDS,
+        return_document=ReturnDocument.AFTER,
+    )
+
+    if document is not None:
+        redirect_cache.invalidate(code)
+
+    return document
+
+
+def find_code(code: str, owner: str) -> dict | None:
+    """
+    Looks up one of a user's codes.
+
+    Args:
+        code (str): The code to look up.
+        owner (str): The uuid of the user owning the code.
+
+    Returns:
+        dict | None: The code, or None if the user owns no such code.
+    """
+    return qr_codes_collection.find_one({"_id": code, "owner": owner}, PUBLIC_FIELDS)
+
+
+def encode_cursor(document: dict) -> str:
+    """
+    Encodes the position after a code in the list of its owner's codes.
+
+    Args:
+        document (dict): The code, with its "_id" and "created_at".
+
+    Returns:
+        str: The cursor, safe to use in a URL.
+    """
+    created_at = document["created_at"]
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=datetime.UTC)
+
+    # MongoDB stores times to the millisecond, so this is exact
+    millis = (created_at - EPOCH) // datetime.timedelta(milliseconds=1)
+
+    return (
+        base64.urlsafe_b64encode(f"{millis}.{document['_id']}".encode())
+        .decode()
+        .rstrip("=")
+    )
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, str]:
+    """
+    Decodes a cursor returned by encode_cursor.
+
+    Args:
+        cursor (str): The cursor.
+
+    Raises:
+        InvalidCursor: If the cursor is malformed.
+
+    Returns:
+        tuple[datetime.datetime, str]: The creation time and code of the last code listed.
+    """
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        millis, code = decoded.split(".", 1)
+        created_at = EPOCH + datetime.timedelta(milliseconds=int(millis))
+    except (binascii.Error, UnicodeDecodeError, ValueError, OverflowError):
+        raise InvalidCursor("The cursor is invalid.")
+
+    if not CODE_PATTERN.match(code):
+        raise InvalidCursor("The cursor is invalid.")
+
+    return created_at, code
+
+
+def list_codes(
+    owner: str, limit: int = DEFAULT_PAGE_SIZE, cursor: str | None = None
+) -> tuple[list[dict], str | None]:
+    """
+    Lists one page of a user's codes, newest first.
+
+    Args:
+        owner (str): The uuid of the user owning the codes.
+        limit (int): The number of codes per page, at most MAX_PAGE_SIZE.
+        cursor (str | None): The cursor returned with the previous page, or None for the first page.
+
+    Raises:
+        ValueError: If the limit is out of range.
+        InvalidCursor: If the cursor is malformed.
+
+    Returns:
+        tuple[list[dict], str | None]: The codes (with LIST_FIELDS), and the cursor of the next page, or
+            None if this is the last page.
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"The limit must be between 1 and {MAX_PAGE_SIZE}.")
+
+    query = {"owner": owner}
+
+    if cursor is not None:
+        created_at, code = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": code}},
+        ]
+
+    # One more code than shown tells whether there is a next page. The planner serves this from the
+    # (owner, created_at, _id) index (no hint, which would fail while the index is still being built)
+    codes = list(
+        qr_codes_collection.find(query, LIST_FIELDS)
+        .sort([("created_at", -1), ("_id", -1)])
+        .limit(limit + 1)
+    )
+
+    if len(codes) <= limit:
+        return codes, None
+
+    codes = codes[:limit]
+    return codes, encode_cursor(codes[-1])
+
+
+def count_codes(owner: str) -> int:
+    """
+    Returns how many codes a user owns, from their counter.
+
+    Args:
+        owner (str): The uuid of the user.
+
+    Returns:
+        int: The number of codes.
+    """
+    user = users_collection.find_one({"uuid": owner}, {"counters.qr_codes": 1})
+    if user is None:
+        return 0
+
+    return user.get("counters", {}).get("qr_codes", 0)
+
+
+def recount_codes() -> int:
+    """
+    Sets the code counter of every user to the number of codes they own, for users who created codes
+    before the counters existed, or whose counter missed a code.
+
+    Returns:
+        int: The number of users whose counter changed.
+    """
+    counts = {
+        result["_id"]: result["count"]
+        for result in qr_codes_collection.aggregate(
+            [{"$group": {"_id": "$owner", "count": {"$sum": 1}}}]
+        )
+    }
+
+    changed = 0
+
+    for user in users_collection.find(
+        {"$or": [{"uuid": {"$in": list(counts)}}, {"counters.qr_codes": {"$ne": 0}}]},
+        {"uuid": 1, "counters.qr_codes": 1},
+    ):
+        count = counts.get(user["uuid"], 0)
+
+        if user.get("counters", {}).get("qr_codes") != count:
+            users_collection.update_one(
+                {"_id": user["_id"]}, {"$set": {"counters.qr_codes": count}}
+            )
+            changed += 1
+
+    QRLOG_DB.info(f"Recounted the QR codes of {changed} users")
+
+    return changed
+
+
+def resolve_target(code: str) -> str | None:
+    """
+    Resolves the target of a scanned code, from the redirect cache when possible.
+
+    If the database cannot be reached, the last known target is used, however old.
+
+    Args:
+        code (str): The scanned code.
+
+    Raises:
+        PyMongoError: If the code is not cached and the database cannot be reached.
+
+    Returns:
+        str | None: The URL to redirect to, or None if the code does not exist.
+    """
+    if not CODE_PATTERN.match(code):
+        return None
+
+    cached, target = redirect_cache.get(code)
+    if cached:
+        return target
+
+    try:
+        document = qr_codes_collection.find_one({"_id": code}, {"target": 1})
+    except PyMongoError:
+        cached, target = redirect_cache.get_stale(code)
+        if cached:
+            return target
+        raise
+
+    target = document["target"] if document is not None else None
+    redirect_cache.set(code, target)
+    return target
@@ -0,0 +1,241 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the reCAPTCHA verifier. Tokens are checked locally first (shape and replays), and only
+then sent to a verification backend: Google's siteverify API through a pooled, time-bounded HTTP session,
+or a local fake used for offline load testing (set "recaptcha_backend" to "fake").
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Third Party Modules
+import requests
+from requests.adapters import HTTPAdapter
+
+# Request instrumentation
+from helpers.metrics import track_external
+
+# Import the custom logger
+from helpers.logger import QRLOG_MAIN
+
+# Constants
+VERIFY_URL = "https://www.google.com/recaptcha/api/siteverify"
+
+# reCAPTCHA tokens are long URL-safe base64 strings
+TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{20,4096}$")
+
+# Google only accepts a token within two minutes of it being issued
+TOKEN_LIFETIME_SECONDS = 120
+
+DEFAULT_CONNECT_TIMEOUT = 2.0
+DEFAULT_READ_TIMEOUT = 3.0
+DEFAULT_POOL_SIZE = 16
+DEFAULT_REPLAY_CACHE_SIZE = 4096
+
+
+class RecaptchaResult:
+    """
+    The outcome of a verification.
+
+    "error" is None on success, otherwise one of "invalid-token", "replayed-token", "failed" (rejected by
+    the backend) or "unavailable" (the backend could not be reached or answered nonsense).
+    """
+
+    __slots__ = ("ok", "error")
+
+    def __init__(self, ok: bool, error: str | None = None) -> None:
+        self.ok = ok
+        self.error = error
+
+
+class GoogleRecaptchaBackend:
+    """
+    Verifies tokens with Google's siteverify API over a persistent connection pool.
+    """
+
+    def __init__(
+        self,
+        secret: str | None,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        pool_size: int = DEFAULT_POOL_SIZE,
+    ) -> None:
+        self.secret = secret
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        self.session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0),
+        )
+
+    def verify(self, token: str, remote_ip: str | None) -> dict:
+        data = {"secret": self.secret, "response": token, "remoteip": remote_ip}
+
+        with track_external("recaptcha"):
+            response = self.session.post(VERIFY_URL, data=data, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+
+
+class FakeRecaptchaBackend:
+    """
+    Verifies tokens locally, without any network call, for offline and load testing.
+
+    Every token is accepted unless it starts with "fail". An artificial latency can be configured to
+    simulate the upstream round trip.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+
+    def verify(self, token: str, remote_ip: str | None) -> dict:
+        with track_external("recaptcha"):
+            if self.latency:
+                time.sleep(self.latency)
+
+            if token.startswith("fail"):
+                return {"success": False, "error-codes": ["invalid-input-response"]}
+
+            return {"success": True, "score": 0.9}
+
+
+class RecaptchaVerifier:
+    """
+    Verifies reCAPTCHA tokens against a backend.
+
+    Empty and malformed tokens are rejected before any network call. Tokens that have already been
+    verified are kept in a small replay cache for their lifetime, and rejected locally if they are
+    submitted again (Google would reject them as duplicates anyway, after a round trip).
+    """
+
+    def __init__(
+        self,
+        backend,
+        replay_cache_size: int = DEFAULT_REPLAY_CACHE_SIZE,
+    ) -> None:
+        self.backend = backend
+        self.replay_cache_size = replay_cache_size
+
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _claim(self, token: str) -> bool:
+        """
+        Marks a token as used, returning False if it was already used.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            # Forget tokens that Google would reject as expired anyway
+            while self._seen:
+                oldest_token, seen_at = next(iter(self._seen.items()))
+                if now - seen_at < TOKEN_LIFETIME_SECONDS:
+                    break
+                del self._seen[oldest_token]
+
+            if token in self._seen:
+                return False
+
+            self._seen[token] = now
+
+            if len(self._seen) > self.replay_cache_size:
+                self._seen.popitem(last=False)
+
+            return True
+
+    def _release(self, token: str) -> None:
+        """
+        Forgets a claimed token, so that it can be submitted again.
+        """
+        with self._lock:
+            self._seen.pop(token, None)
+
+    def verify(self, token: str | None, remote_ip: str | None) -> RecaptchaResult:
+        """
+        Verifies a token.
+
+        Args:
+            token (str | None): The token submitted by the client.
+            remote_ip (str | None): The address of the client.
+
+        Returns:
+            RecaptchaResult: The outcome of the verification.
+        """
+        if not token or not TOKEN_PATTERN.match(token):
+            return RecaptchaResult(False, "invalid-token")
+
+        if not self._claim(token):
+            return RecaptchaResult(False, "replayed-token")
+
+        try:
+            result = self.backend.verify(token, remote_ip)
+        except (requests.RequestException, ValueError) as e:
+            QRLOG_MAIN.warning(f"reCAPTCHA verification unavailable: {e}")
+
+            # The token was never checked, so retrying the form with it must not count as a replay
+            self._release(token)
+            return RecaptchaResult(False, "unavailable")
+
+        if not isinstance(result, dict) or result.get("success") is not True:
+            return RecaptchaResult(False, "failed")
+
+        return RecaptchaResult(True)
+
+
+# The verifier shared by the whole process, created on first use
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def create_recaptcha_backend():
+    """
+    Creates the verification backend selected by the "recaptcha_backend" environment variable.
+
+    Returns:
+        GoogleRecaptchaBackend | FakeRecaptchaBackend: The backend.
+    """
+    backend = os.getenv("recaptcha_backend", "google")
+
+    if backend == "fake":
+        QRLOG_MAIN.warning("Using the fake reCAPTCHA backend, tokens are not verified.")
+        return FakeRecaptchaBackend(
+            latency=float(os.getenv("recaptcha_fake_latency_ms", 0)) / 1000
+        )
+
+    if backend != "google":
+        raise ValueError("The reCAPTCHA backend must be either 'google' or 'fake'.")
+
+    return GoogleRecaptchaBackend(
+        os.getenv("recaptcha_secret_key"),
+        connect_timeout=float(
+            os.getenv("recaptcha_connect_timeout", DEFAULT_CONNECT_TIMEOUT)
+        ),
+        read_timeout=float(os.getenv("recaptcha_read_timeout", DEFAULT_READ_TIMEOUT)),
+        pool_size=int(os.getenv("recaptcha_pool_size", DEFAULT_POOL_SIZE)),
+    )
+
+
+def get_recaptcha_verifier() -> RecaptchaVerifier:
+    """
+    Returns the process-wide verifier, creating it on first use.
+
+    Returns:
+        RecaptchaVerifier: The verifier.
+    """
+    global _verifier
+
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                _verifier = RecaptchaVerifier(create_recaptcha_backend())
+
+    return _verifier
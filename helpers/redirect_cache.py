@@ -0,0 +1,129 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the in-process cache of dynamic QR code targets used by the /q/<code> redirects, so that
+a scan is answered from memory instead of from the database.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import os
+
+# Cache
+from helpers.ttl_cache import TTLCache
+
+# Constants
+# Cache sizing, configurable through the environment
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_TTL_SECONDS = 30
+DEFAULT_NEGATIVE_TTL_SECONDS = 5
+
+
+class RedirectCache(TTLCache):
+    """
+    A cache mapping codes to their target URL.
+
+    Codes that do not exist are cached too (with a shorter TTL), so that scans of unknown codes do not each
+    cost a database lookup. Edits made by this process invalidate the entry straight away; the TTL bounds
+    how long an edit made by another process takes to show up here.
+
+    Expired entries are kept until they are evicted, so that the last known target can still be served
+    while the database is unreachable.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL_SECONDS,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL_SECONDS,
+    ) -> None:
+        super().__init__(max_entries, ttl, keep_expired=True)
+        self.negative_ttl = negative_ttl
+
+        self.negative_hits = 0
+        self.stale_hits = 0
+
+    def _hit(self, value) -> None:
+        if value is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+
+    def get(self, code: str) -> tuple[bool, str | None]:
+        """
+        Looks up the target of a code.
+
+        Args:
+            code (str): The code to look up.
+
+        Returns:
+            tuple[bool, str | None]: Whether the code was cached, and its target (None if the code is cached
+                as not existing).
+        """
+        return self.lookup(code)
+
+    def get_stale(self, code: str) -> tuple[bool, str | None]:
+        """
+        Looks up the target of a code, even if its entry has expired.
+
+        Args:
+            code (str): The code to look up.
+
+        Returns:
+            tuple[bool, str | None]: Whether the code was cached, and its last known target.
+        """
+        with self._lock:
+            entry = self._entries.get(code)
+
+            if entry is None:
+                return False, None
+
+            self.stale_hits += 1
+            return True, entry[0]
+
+    def set(self, code: str, target: str | None) -> None:
+        """
+        Stores the target of a code.
+
+        Args:
+            code (str): The code.
+            target (str | None): Its target URL, or None if the code does not exist.
+
+        Returns:
+            None
+        """
+        self.store(code, target, self.ttl if target is not None else self.negative_ttl)
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters, used to size the cache.
+
+        Returns:
+            dict: The current size, limits and hit/miss/eviction counters.
+        """
+        stats = super().stats()
+        lookups = stats["hits"] + self.negative_hits + stats["misses"]
+
+        stats.update(
+            {
+                "negative_ttl": self.negative_ttl,
+                "negative_hits": self.negative_hits,
+                "hit_ratio": (
+                    (stats["hits"] + self.negative_hits) / lookups if lookups else 0.0
+                ),
+                "stale_hits": self.stale_hits,
+            }
+        )
+        return stats
+
+
+# The cache shared by the whole process
+redirect_cache = RedirectCache(
+    max_entries=int(os.getenv("redirect_cache_max_entries", DEFAULT_MAX_ENTRIES)),
+    ttl=float(os.getenv("redirect_cache_ttl", DEFAULT_TTL_SECONDS)),
+    negative_ttl=float(
+        os.getenv("redirect_cache_negative_ttl", DEFAULT_NEGATIVE_TTL_SECONDS)
+    ),
+)
@@ -0,0 +1,440 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the session revocation channel. Every process keeps the sessions it has validated in its
+session cache (see helpers/session_cache.py), so a session logged out through one worker would otherwise
+still be accepted by the others until their cache entries expire. Instead, a background thread in every
+process drops revoked sessions from its own cache as soon as they are revoked:
+
+- On a replica set (or a sharded cluster), it watches a change stream on the sessions collection for
+  sessions being logged out or deleted, so revoking a session needs no extra write.
+- On a standalone server, which has no change streams, revocations are also written to a small capped
+  collection, which it tails instead.
+
+Whenever the thread may have missed revocations (it lost its place in the stream or the collection, or could
+not reach the database), it clears the whole session cache: a missed revocation then costs one database
+lookup per cached session instead of letting a revoked session through.
+
+Both channels can be tried against a local single-node replica set:
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval "rs.initiate()"
+    python -m helpers.revocation "mongodb://localhost:27017/?replicaSet=rs0"
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import atexit
+import datetime
+import os
+import sys
+import threading
+import time
+
+# Third Party Modules
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, OperationFailure, PyMongoError
+
+# Database
+from helpers.db import (
+    get_database,
+    session_revocations_collection,
+    sessions_collection,
+)
+
+# Session Cache
+from helpers.session_cache import session_cache
+
+# Import the custom logger
+from helpers.logger import QRLOG_DB
+
+# Constants
+CHANNELS = ("auto", "change_stream", "capped", "off")
+
+# The capped collection only has to hold the revocations of the time a listener may take to read them
+REVOCATIONS_SIZE_BYTES = 1024 * 1024
+REVOCATIONS_MAX_DOCUMENTS = 10000
+
+# How long a wait for the next revocation may block, so that stop() is noticed
+AWAIT_SECONDS = 1
+
+# How long to wait before reconnecting after an error
+RETRY_SECONDS = 5
+
+# Server error codes meaning change streams are unavailable (not a replica set), and that the position to
+# resume from is no longer in the oplog
+CHANGE_STREAMS_UNSUPPORTED = (40573,)
+CHANGE_STREAM_HISTORY_LOST = (136, 280, 286)
+
+# Change stream events revoking sessions: logging out sets "logged_out_at", and the TTL index (or a cleanup)
+# deletes them. Dropping or renaming the collection invalidates the stream.
+CHANGE_STREAM_PIPELINE = [
+    {
+        "$match": {
+            "$or": [
+                {"operationType": "delete"},
+                {
+                    "operationType": "update",
+                    "updateDescription.updatedFields.logged_out_at": {"$exists": True},
+                },
+                {
+                    "operationType": {
+                        "$in": ["drop", "rename", "dropDatabase", "invalidate"]
+                    }
+                },
+            ]
+        }
+    }
+]
+
+
+class RevocationListener:
+    """
+    Drops the sessions revoked by any process from this process's session cache, from a change stream or by
+    tailing the capped revocations collection.
+
+    With the "auto" channel it watches the change stream, and falls back to the capped collection when the
+    server does not support change streams.
+    """
+
+    def __init__(self, channel: str = "auto") -> None:
+        if channel not in CHANNELS:
+            raise ValueError(f"The channel must be one of {', '.join(CHANNELS)}.")
+
+        self.channel = channel
+
+        # The channel in use: "change_stream" or "capped", or None until the listener has connected
+        self.active_channel = None if channel == "auto" else channel
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._atexit_registered = False
+
+        # Set while the stream or cursor is open, so that callers can wait for the listener to be ready
+        self.connected = threading.Event()
+
+        # Where to resume the change stream from after an error, and whether revocations may have been
+        # missed since the last time the listener was connected
+        self._resume_token = None
+        self._gap = False
+
+        self.revoked = 0
+        self.cache_clears = 0
+        self.errors = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def publishes(self) -> bool:
+        """
+        Whether revocations have to be written to the capped collection, i.e. unless every process is known to
+        watch the change stream instead.
+        """
+        return self.channel != "off" and self.active_channel != "change_stream"
+
+    def _revoke(self, sids) -> None:
+        for sid in sids:
+            session_cache.invalidate(sid)
+            self.revoked += 1
+
+    def _connected(self) -> None:
+        if self._gap:
+            session_cache.clear()
+            self.cache_clears += 1
+            self._gap = False
+
+        self.connected.set()
+
+    def _watch(self) -> None:
+        with sessions_collection.watch(
+            CHANGE_STREAM_PIPELINE,
+            resume_after=self._resume_token,
+            max_await_time_ms=AWAIT_SECONDS * 1000,
+        ) as stream:
+            if self.active_channel != "change_stream":
+                QRLOG_DB.info("Watching the sessions change stream for revocations.")
+            self.active_channel = "change_stream"
+
+            # Resuming from a token replays what was missed, otherwise the cache has to be cleared
+            if self._resume_token is not None:
+                self._gap = False
+            self._connected()
+
+            while not self._stop.is_set() and stream.alive:
+                change = stream.try_next()
+                self._resume_token = stream.resume_token
+
+                if change is None:
+                    continue
+
+                if change["operationType"] in ("update", "delete"):
+                    self._revoke([change["documentKey"]["_id"]])
+                else:
+                    # The collection is gone (with every session in it), and the stream cannot resume
+                    session_cache.clear()
+                    self.cache_clears += 1
+                    self._resume_token = None
+                    break
+
+    def ensure_capped_collection(self) -> None:
+        """
+        Creates the capped revocations collection, unless it already exists.
+
+        Returns:
+            None
+        """
+        try:
+            get_database().create_collection(
+                session_revocations_collection.name,
+                capped=True,
+                size=REVOCATIONS_SIZE_BYTES,
+                max=REVOCATIONS_MAX_DOCUMENTS,
+            )
+        except CollectionInvalid:
+            # Created by another process
+            return
+
+        # A tailable cursor on an empty collection dies straight away, so it is never left empty
+        session_revocations_collection.insert_one(
+            {"sids": [], "revoked_at": datetime.datetime.now(datetime.UTC)}
+        )
+
+    def _tail(self) -> None:
+        self.ensure_capped_collection()
+
+        # The whole collection is read first, which replays the revocations missed while disconnected (as
+        # long as they have not been overwritten, so the cache is still cleared after a gap)
+        cursor = session_revocations_collection.find(
+            {}, cursor_type=CursorType.TAILABLE_AWAIT
+        ).max_await_time_ms(AWAIT_SECONDS * 1000)
+
+        try:
+            if self.active_channel != "capped":
+                QRLOG_DB.info("Tailing the session revocations collection.")
+            self.active_channel = "capped"
+            self._connected()
+
+            while not self._stop.is_set() and cursor.alive:
+                try:
+                    revocation = cursor.next()
+                except StopIteration:
+                    continue
+
+                self._revoke(revocation["sids"])
+        finally:
+            cursor.close()
+
+        # The cursor dies when the collection is dropped or it falls behind the capped collection
+        if not self._stop.is_set():
+            self._gap = True
+            self.connected.clear()
+            self._stop.wait(AWAIT_SECONDS)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.active_channel == "capped":
+                    self._tail()
+                else:
+                    self._watch()
+            except OperationFailure as e:
+                self.connected.clear()
+                self._gap = True
+
+                if e.code in CHANGE_STREAMS_UNSUPPORTED and self.channel == "auto":
+                    QRLOG_DB.info(
+                        "Change streams are not supported by the database, falling back to tailing "
+                        "the session revocations collection."
+                    )
+                    self.active_channel = "capped"
+                    continue
+
+                if e.code in CHANGE_STREAM_HISTORY_LOST:
+                    self._resume_token = None
+
+                self.errors += 1
+                QRLOG_DB.warning(
+                    f"Session revocation listener error, retrying in {RETRY_SECONDS}s: {e}"
+                )
+                self._stop.wait(RETRY_SECONDS)
+            except PyMongoError as e:
+                self.connected.clear()
+                self._gap = True
+                self.errors += 1
+                QRLOG_DB.warning(
+                    f"Session revocation listener error, retrying in {RETRY_SECONDS}s: {e}"
+                )
+                self._stop.wait(RETRY_SECONDS)
+
+        self.connected.clear()
+
+    def start(self) -> None:
+        """
+        Starts listening for revocations in the background (only once, this may be called several times).
+
+        Returns:
+            None
+        """
+        if self.channel == "off" or self.running:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="betterqr-session-revocation", daemon=True
+        )
+        self._thread.start()
+
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self) -> None:
+        """
+        Stops the background thread.
+
+        Returns:
+            None
+        """
+        self._stop.set()
+
+        if self.running:
+            self._thread.join(AWAIT_SECONDS * 2)
+        self._thread = None
+
+    def reset_after_fork(self) -> None:
+        """
+        Restarts the background thread in a forked child if it was running in the parent. The child's cache
+        is a copy of the parent's, so it starts out assuming it missed revocations.
+
+        Returns:
+            None
+        """
+        was_running = self._thread is not None
+
+        self._thread = None
+        self._stop = threading.Event()
+        self.connected = threading.Event()
+        self._gap = True
+
+        if was_running:
+            self.start()
+
+    def stats(self) -> dict:
+        """
+        Returns the state and counters of the listener.
+
+        Returns:
+            dict: The configured and active channels, whether it is running and connected, how many sessions
+                it dropped from the cache, how many times it cleared the cache and how many errors it hit.
+        """
+        return {
+            "running": self.running,
+            "connected": self.connected.is_set(),
+            "channel": self.channel,
+            "active_channel": self.active_channel,
+            "revoked": self.revoked,
+            "cache_clears": self.cache_clears,
+            "errors": self.errors,
+        }
+
+
+# The listener shared by the whole process
+revocation_listener = RevocationListener(
+    os.getenv("session_revocation_channel", "auto")
+)
+
+# Forked server workers have their own session caches to keep up to date
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=revocation_listener.reset_after_fork)
+
+
+def publish_revocation(sids: list[str]) -> None:
+    """
+    Announces revoked sessions to the processes tailing the capped revocations collection. With change
+    streams, the revocation itself is the announcement, and nothing is written.
+
+    Failing to publish never fails the revocation: the sessions are revoked in the database, and the other
+    processes stop accepting them once their cache entries expire.
+
+    Args:
+        sids (list[str]): The revoked session ids.
+
+    Returns:
+        None
+    """
+    if not sids or not revocation_listener.publishes:
+        return
+
+    try:
+        # Inserting into a missing collection would create it uncapped, which cannot be tailed
+        if revocation_listener.active_channel is None:
+            revocation_listener.ensure_capped_collection()
+
+        session_revocations_collection.insert_one(
+            {"sids": sids, "revoked_at": datetime.datetime.now(datetime.UTC)}
+        )
+    except PyMongoError as e:
+        QRLOG_DB.warning(
+            f"Could not publish the revocation of {len(sids)} sessions: {e}"
+        )
+
+
+def _self_test(channel: str) -> float | None:
+    # Imported here, as it imports this module
+    from helpers.sessions import create_session, log_out_session
+
+    global revocation_listener
+
+    revocation_listener = RevocationListener(channel)
+    revocation_listener.start()
+
+    try:
+        if not revocation_listener.connected.wait(RETRY_SECONDS * 2):
+            print(f"{channel}: the listener did not connect")
+            return None
+
+        if revocation_listener.active_channel != channel:
+            print(
+                f"{channel}: unsupported by this server, fell back to the capped collection"
+            )
+            return None
+
+        session = create_session("revocation-self-test", None, None)
+        session_cache.set(session["_id"], session["user_uuid"], 60)
+
+        # Logging out does not touch the local cache (the logout endpoint does), only the listener does
+        started = time.perf_counter()
+        log_out_session(session["_id"])
+
+        while session_cache.get(session["_id"]) is not None:
+            if time.perf_counter() - started > AWAIT_SECONDS * 5:
+                print(f"{channel}: the session was not dropped from the cache")
+                return None
+            time.sleep(0.001)
+
+        elapsed = time.perf_counter() - started
+        sessions_collection.delete_one({"_id": session["_id"]})
+
+        print(
+            f"{channel}: dropped from the cache {elapsed * 1000:.1f}ms after logging out"
+        )
+        return elapsed
+    finally:
+        revocation_listener.stop()
+
+
+if __name__ == "__main__":
+    # Run as python -m helpers.revocation [mongodb uri], with a single-node replica set to test both channels
+    if len(sys.argv) > 1:
+        os.environ["mongodb_uri"] = sys.argv[1]
+
+    # The sessions helpers use the imported module (not __main__), so the test runs inside it
+    from helpers import revocation
+
+    results = [
+        revocation._self_test(channel) for channel in ("change_stream", "capped")
+    ]
+    sys.exit(0 if all(result is not None for result in results) else 1)
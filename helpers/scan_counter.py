@@ -0,0 +1,320 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the scan counters of dynamic QR codes. Scans are counted in memory by the /q/<code>
+redirects and written to the database by a background thread, as one bulk_write of code counters and one of
+analytics rollups (helpers/analytics.py) per interval, so that a redirect never waits for a write.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import atexit
+import datetime
+import os
+import threading
+
+# Third Party Modules
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+# Database
+from helpers.db import qr_codes_collection, scan_rollups_collection
+
+# Analytics
+from helpers.analytics import aggregate_scans, merge_rollups, rollup_updates
+from helpers.user_agent_parser import MAX_USER_AGENT_LENGTH
+
+# Import the custom logger
+from helpers.logger import QRLOG_DB
+
+# Constants
+# How often the counters are written, configurable through the environment
+DEFAULT_FLUSH_INTERVAL_SECONDS = 5
+
+
+def _failed_indexes(error: BulkWriteError) -> set[int]:
+    """
+    Returns the positions of the operations of an unordered bulk write that failed (all the others were
+    applied).
+    """
+    return {
+        write_error["index"] for write_error in error.details.get("writeErrors", [])
+    }
+
+
+class ScanCounter:
+    """
+    Buffers scan counts in memory and writes them to the database periodically.
+
+    Counts that fail to be written are kept and retried with the next flush, so scans are only lost if the
+    process dies before the database comes back.
+    """
+
+    def __init__(self, interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS) -> None:
+        self.interval = interval
+
+        self._counts = {}
+        self._last_scanned = {}
+        self._scans = {}
+        self._lock = threading.Lock()
+
+        # Only one flush writes at a time, so that retried counts are never written twice
+        self._flush_lock = threading.Lock()
+
+        # Rollup increments that failed to be written (only used with the flush lock held)
+        self._pending_rollups = {}
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._atexit_registered = False
+
+        self.flushes = 0
+        self.flushed_scans = 0
+        self.failed_flushes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def record(
+        self, code: str, user_agent: str | None = None, country: str | None = None
+    ) -> None:
+        """
+        Counts one scan of a code.
+
+        Args:
+            code (str): The code that was scanned.
+            user_agent (str | None): The User-Agent header of the scan, parsed later for the analytics.
+            country (str | None): The country the scan came from (the CF-IPCountry header).
+
+        Returns:
+            None
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        hour = now.replace(minute=0, second=0, microsecond=0)
+
+        if user_agent:
+            user_agent = user_agent[:MAX_USER_AGENT_LENGTH]
+
+        key = (code, hour, user_agent, country)
+
+        with self._lock:
+            self._counts[code] = self._counts.get(code, 0) + 1
+            self._last_scanned[code] = now
+            self._scans[key] = self._scans.get(key, 0) + 1
+
+    def flush(self) -> int:
+        """
+        Writes the buffered counts and analytics rollups to the database.
+
+        Returns:
+            int: The number of scans written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, {}
+                last_scanned, self._last_scanned = self._last_scanned, {}
+                scans, self._scans = self._scans, {}
+
+            if not counts and not scans and not self._pending_rollups:
+                return 0
+
+            # What is put back if the flush fails unexpectedly, narrowed as each part is written
+            unwritten = (counts, last_scanned, scans)
+            rollups = None
+
+            try:
+                if counts:
+                    operations = [
+                        UpdateOne(
+                            {"_id": code},
+                            {
+                                "$inc": {"scans": count},
+                                "$max": {"last_scanned_at": last_scanned[code]},
+                            },
+                        )
+                        for code, count in counts.items()
+                    ]
+
+                    try:
+                        qr_codes_collection.bulk_write(operations, ordered=False)
+                    except BulkWriteError as e:
+                        # The other counts were written, so only the failed ones are retried (retrying them
+                        # all would count their scans twice); the rollups are written as usual
+                        codes = list(counts)
+                        failed = {codes[index] for index in _failed_indexes(e)}
+
+                        self._restore(
+                            {code: counts[code] for code in failed}, last_scanned, {}
+                        )
+                        counts = {
+                            code: count
+                            for code, count in counts.items()
+                            if code not in failed
+                        }
+
+                        self.failed_flushes += 1
+                        QRLOG_DB.warning(
+                            f"Failed to write the scans of {len(failed)} codes, retrying later: {e}"
+                        )
+                    except PyMongoError as e:
+                        self._restore(counts, last_scanned, scans)
+                        self.failed_flushes += 1
+                        QRLOG_DB.warning(
+                            f"Failed to write the scans of {len(counts)} codes, retrying later: {e}"
+                        )
+                        return 0
+
+                # The counts are written (or put back) by now, so only the scans are left to restore
+                unwritten = ({}, {}, scans)
+
+                # User agents are parsed here, on the background thread, rather than in the redirects
+                merged = aggregate_scans(scans)
+                merge_rollups(merged, self._pending_rollups)
+                rollups = merged
+                self._pending_rollups = {}
+                unwritten = ({}, {}, {})
+
+                try:
+                    scan_rollups_collection.bulk_write(
+                        rollup_updates(rollups), ordered=False
+                    )
+                except BulkWriteError as e:
+                    # Only the failed upserts are retried (they are in the order of the rollups)
+                    keys = list(rollups)
+                    self._pending_rollups = {
+                        keys[index]: rollups[keys[index]]
+                        for index in _failed_indexes(e)
+                    }
+                    self.failed_flushes += 1
+                    QRLOG_DB.warning(
+                        f"Failed to write {len(self._pending_rollups)} scan rollups, retrying later: {e}"
+                    )
+                except PyMongoError as e:
+                    # The counts are written already, so only the rollups are retried
+                    self._pending_rollups = rollups
+                    self.failed_flushes += 1
+                    QRLOG_DB.warning(
+                        f"Failed to write {len(rollups)} scan rollups, retrying later: {e}"
+                    )
+            except Exception:
+                # Anything else (e.g. a bug parsing a user agent) must not lose the buffers it swapped out
+                self._restore(*unwritten)
+                if rollups is not None:
+                    self._pending_rollups = rollups
+                self.failed_flushes += 1
+                raise
+
+            scans_written = sum(counts.values())
+            self.flushes += 1
+            self.flushed_scans += scans_written
+            return scans_written
+
+    def _restore(self, counts: dict, last_scanned: dict, scans: dict) -> None:
+        with self._lock:
+            for code, count in counts.items():
+                self._counts[code] = self._counts.get(code, 0) + count
+                if code not in self._last_scanned:
+                    self._last_scanned[code] = last_scanned[code]
+
+            for key, count in scans.items():
+                self._scans[key] = self._scans.get(key, 0) + count
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                # flush() has put back what it did not write, so the thread carries on and retries it
+                QRLOG_DB.exception("Failed to flush the scan counts, retrying later")
+
+    def start(self) -> None:
+        """
+        Starts writing the counts in the background (only once, this may be called several times), and
+        registers a final flush at exit.
+
+        Returns:
+            None
+        """
+        if self.running:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="betterqr-scan-counter", daemon=True
+        )
+        self._thread.start()
+
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self) -> None:
+        """
+        Stops the background thread and writes whatever is still buffered.
+
+        Returns:
+            None
+        """
+        self._stop.set()
+
+        if self.running:
+            self._thread.join()
+        self._thread = None
+
+        self.flush()
+
+    def reset_after_fork(self) -> None:
+        """
+        Clears the counter in a forked child, whose copy of the parent's buffered scans would otherwise be
+        written twice, and restarts the background thread there if it was running in the parent.
+
+        Returns:
+            None
+        """
+        was_running = self._thread is not None
+
+        self._counts = {}
+        self._last_scanned = {}
+        self._scans = {}
+        self._pending_rollups = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+        if was_running:
+            self.start()
+
+    def stats(self) -> dict:
+        """
+        Returns the counter state.
+
+        Returns:
+            dict: The number of codes and scans waiting to be written, and the flush counters.
+        """
+        with self._lock:
+            pending_codes = len(self._counts)
+            pending_scans = sum(self._counts.values())
+
+        return {
+            "pending_codes": pending_codes,
+            "pending_scans": pending_scans,
+            "pending_rollups": len(self._pending_rollups),
+            "interval": self.interval,
+            "flushes": self.flushes,
+            "flushed_scans": self.flushed_scans,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+# The counter shared by the whole process
+scan_counter = ScanCounter(
+    interval=float(os.getenv("scan_flush_interval", DEFAULT_FLUSH_INTERVAL_SECONDS))
+)
+
+# Forked server workers count their own scans
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=scan_counter.reset_after_fork)
@@ -0,0 +1,101 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the in-process cache of validated session ids used by the ensure_session hook, so that
+a session only has to be looked up in the database once every few seconds rather than on every request.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import datetime
+import os
+
+# Cache
+from helpers.ttl_cache import TTLCache
+
+# Constants
+# How long a session stays valid after it was created
+SESSION_LIFETIME = datetime.timedelta(days=30)
+
+# Cache sizing, configurable through the environment
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 60
+
+
+class SessionCache(TTLCache):
+    """
+    A cache of validated session ids, mapping each sid to the uuid of the user owning it.
+
+    Every entry expires either after the cache TTL or when the session itself expires, whichever comes
+    first. Revocations are broadcast to every process (see helpers/revocation.py), and the TTL bounds how
+    long a revoked session can keep being accepted here if a broadcast is missed.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL_SECONDS,
+    ) -> None:
+        super().__init__(max_entries, ttl)
+
+    def get(self, sid: str) -> str | None:
+        """
+        Looks up a validated session id.
+
+        Args:
+            sid (str): The session id to look up.
+
+        Returns:
+            str | None: The uuid of the user owning the session, or None if the sid is not cached.
+        """
+        return self.lookup(sid)[1]
+
+    def set(
+        self,
+        sid: str,
+        user_uuid: str,
+        expires_in: float,
+        generation: int | None = None,
+    ) -> None:
+        """
+        Stores a validated session id.
+
+        Args:
+            sid (str): The session id that was validated.
+            user_uuid (str): The uuid of the user owning the session.
+            expires_in (float): The number of seconds until the session itself expires.
+            generation (int | None): The cache's generation from before the session was looked up, so that a
+                session revoked during the lookup is not cached.
+
+        Returns:
+            None
+        """
+        self.store(sid, user_uuid, min(expires_in, self.ttl), generation)
+
+
+# Helper functions
+def session_expires_in(created_at: datetime.datetime) -> float:
+    """
+    Calculates the number of seconds until a session expires.
+
+    Args:
+        created_at (datetime.datetime): When the session was created. Naive datetimes are assumed to be UTC,
+            which is how pymongo returns them.
+
+    Returns:
+        float: The number of seconds left, zero or negative if the session has already expired.
+    """
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=datetime.UTC)
+
+    expires_at = created_at + SESSION_LIFETIME
+    return (expires_at - datetime.datetime.now(datetime.UTC)).total_seconds()
+
+
+# The cache shared by the whole process
+session_cache = SessionCache(
+    max_entries=int(os.getenv("session_cache_max_entries", DEFAULT_MAX_ENTRIES)),
+    ttl=float(os.getenv("session_cache_ttl", DEFAULT_TTL_SECONDS)),
+)
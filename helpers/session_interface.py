@@ -0,0 +1,32 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the Flask session interface, backed by MongoDB through Flask-Session.
+"""
+
+# Import the required modules
+
+# Flask Extensions
+from flask_session.base import ServerSideSessionInterface
+from flask_session.mongodb import MongoDBSessionInterface
+
+# Database
+from helpers.db import LazyCollection
+
+
+class MongoSessionInterface(MongoDBSessionInterface):
+    """
+    Flask-Session's MongoDB session interface, without creating its TTL index when the app is set up.
+
+    Flask-Session creates the index in its constructor, which waits for the server and fails the app
+    setup if it is unreachable. The index is in the registry in helpers/db.py instead. The store is looked up
+    through the shared client on first use, so that forked server workers each use their own client.
+    """
+
+    def __init__(self, app, db: str, collection: str, **kwargs) -> None:
+        self.client = None
+        self.store = LazyCollection(collection, database=db)
+        self.use_deprecated_method = False
+
+        ServerSideSessionInterface.__init__(self, app, **kwargs)
@@ -0,0 +1,203 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the session store. Every login session is stored as its own document in the sessions
+collection, keyed by its sid, and expired by a TTL index on "created_at" (see INDEXES in helpers/db.py).
+Logged out sessions stay in the collection, marked with "logged_out_at", until the TTL index removes them.
+Revoking sessions is announced to every process, which drop them from their session caches (see
+helpers/revocation.py).
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import datetime
+import uuid
+
+# Third Party Modules
+from pymongo.errors import BulkWriteError
+
+# Database
+from helpers.db import sessions_collection, users_collection
+
+# Session Cache
+from helpers.session_cache import SESSION_LIFETIME, session_cache
+
+# Session Revocation
+from helpers.revocation import publish_revocation
+
+# Import the custom logger
+from helpers.logger import QRLOG_DB
+
+
+def create_session(user_uuid: str, ip: str | None, user_agent: str | None) -> dict:
+    """
+    Creates a new login session for a user.
+
+    Args:
+        user_uuid (str): The uuid of the user logging in.
+        ip (str | None): The address the user is logging in from.
+        user_agent (str | None): The user agent the user is logging in with.
+
+    Returns:
+        dict: The stored session document.
+    """
+    new_session = {
+        "_id": str(uuid.uuid4()),
+        "user_uuid": user_uuid,
+        "created_at": datetime.datetime.now(datetime.UTC),
+        "ip": ip,
+        "user_agent": user_agent,
+    }
+
+    sessions_collection.insert_one(new_session)
+
+    return new_session
+
+
+def find_session(sid: str) -> dict | None:
+    """
+    Looks up a session by its sid.
+
+    Args:
+        sid (str): The session id to look up.
+
+    Returns:
+        dict | None: The session's owner and creation time, or None if no such session exists.
+    """
+    return sessions_collection.find_one(
+        {"_id": sid, "logged_out_at": {"$exists": False}},
+        {"user_uuid": 1, "created_at": 1},
+    )
+
+
+def log_out_session(sid: str) -> dict | None:
+    """
+    Logs out a session by its sid, archiving it in place.
+
+    This is a single atomic operation: only the matching session is archived, and if the same session is
+    logged out concurrently (e.g. from two tabs) exactly one of the calls succeeds.
+
+    Args:
+        sid (str): The session id to log out.
+
+    Returns:
+        dict | None: The session's owner and creation time, or None if no active session with that sid
+            exists.
+    """
+    session = sessions_collection.find_one_and_update(
+        {"_id": sid, "logged_out_at": {"$exists": False}},
+        {"$set": {"logged_out_at": datetime.datetime.now(datetime.UTC)}},
+        projection={"user_uuid": 1, "created_at": 1},
+    )
+
+    if session is not None:
+        publish_revocation([sid])
+
+    return session
+
+
+def log_out_user_sessions(user_uuid: str) -> int:
+    """
+    Logs out every active session of a user (e.g. after a password change, or to sign out a compromised
+    account), on every worker.
+
+    Sessions created while this runs are not logged out.
+
+    Args:
+        user_uuid (str): The uuid of the user to sign out.
+
+    Returns:
+        int: The number of sessions logged out.
+    """
+    sids = [
+        session["_id"]
+        for session in sessions_collection.find(
+            {"user_uuid": user_uuid, "logged_out_at": {"$exists": False}},
+            {"_id": 1},
+        )
+    ]
+
+    if not sids:
+        return 0
+
+    result = sessions_collection.update_many(
+        {"_id": {"$in": sids}, "logged_out_at": {"$exists": False}},
+        {"$set": {"logged_out_at": datetime.datetime.now(datetime.UTC)}},
+    )
+
+    # Announced (and dropped from this process's cache) even if some were logged out concurrently
+    publish_revocation(sids)
+    for sid in sids:
+        session_cache.invalidate(sid)
+
+    return result.modified_count
+
+
+def migrate_embedded_sessions() -> int:
+    """
+    Moves sessions embedded in the "sessions" and "logged_out_sessions" arrays of user documents into the
+    sessions collection.
+
+    The migration is idempotent: sessions that were already copied are skipped, and the arrays are only
+    removed from a user once all of their sessions have been copied. Sessions that have already expired
+    are dropped rather than copied, and logged out sessions are copied as logged out at migration time.
+
+    Returns:
+        int: The number of sessions copied into the sessions collection.
+    """
+    now = datetime.datetime.now(datetime.UTC)
+    migrated = 0
+
+    for user in users_collection.find(
+        {
+            "$or": [
+                {"sessions": {"$exists": True}},
+                {"logged_out_sessions": {"$exists": True}},
+            ]
+        },
+        {"uuid": 1, "sessions": 1, "logged_out_sessions": 1},
+    ):
+        documents = []
+
+        for field in ("sessions", "logged_out_sessions"):
+            for embedded in user.get(field) or []:
+                created_at = embedded["created_at"]
+                if created_at.tzinfo is None:
+                    created_at = created_at.replace(tzinfo=datetime.UTC)
+
+                if now - created_at >= SESSION_LIFETIME:
+                    continue
+
+                document = {
+                    "_id": embedded["sid"],
+                    "user_uuid": user["uuid"],
+                    "created_at": created_at,
+                    "ip": embedded.get("ip"),
+                    "user_agent": embedded.get("user_agent"),
+                }
+
+                if field == "logged_out_sessions":
+                    document["logged_out_at"] = now
+
+                documents.append(document)
+
+        if documents:
+            try:
+                result = sessions_collection.insert_many(documents, ordered=False)
+                migrated += len(result.inserted_ids)
+            except BulkWriteError as e:
+                # Duplicate keys mean the session was copied by an earlier run
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                    raise
+                migrated += e.details["nInserted"]
+
+        users_collection.update_one(
+            {"_id": user["_id"]},
+            {"$unset": {"sessions": "", "logged_out_sessions": ""}},
+        )
+
+    QRLOG_DB.info(f"Migrated {migrated} embedded sessions to the sessions collection")
+
+    return migrated
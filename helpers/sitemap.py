@@ -0,0 +1,227 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file generates the sitemap. The URLs come from the public routes in the app's url_map plus any
+registered sources (e.g. public QR landing pages), and the sitemap is rendered once and served from memory
+with an ETag and Last-Modified. Once there are more URLs than fit in one sitemap, /sitemap.xml becomes a
+sitemap index pointing at gzip-compressed child sitemaps, which are streamed as they are compressed.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import datetime
+import os
+import threading
+import time
+import zlib
+from xml.sax.saxutils import escape
+
+# Third Party Modules
+import xxhash
+
+# Flask Modules
+from flask import Response, abort, request
+
+# Site settings
+from helpers.config import BASE_URL
+
+# Constants
+# The sitemap protocol allows at most 50,000 URLs per sitemap
+URLS_PER_SITEMAP = 50000
+
+# Blueprints whose routes are listed, and routes that should not be
+PUBLIC_BLUEPRINTS = {"main"}
+EXCLUDED_ENDPOINTS = {"main._logout"}
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XMLNS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+# Number of URLs compressed at a time when streaming a child sitemap
+STREAM_CHUNK_SIZE = 1000
+
+
+def _url_entry(loc: str, lastmod: datetime.datetime | None) -> str:
+    if lastmod is None:
+        return f"<url><loc>{escape(loc)}</loc></url>\n"
+    return f"<url><loc>{escape(loc)}</loc><lastmod>{lastmod.date().isoformat()}</lastmod></url>\n"
+
+
+class Sitemap:
+    """
+    The sitemap of the app, rendered once and rebuilt when invalidated or older than its TTL.
+    """
+
+    def __init__(self, base_url: str, ttl: float) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+
+        self._app = None
+        self._sources = []
+        self._lock = threading.Lock()
+
+        # The last build, as one tuple that is replaced whole, so that a request never mixes two builds:
+        # (urls, index body, index ETag, child ETags, Last-Modified, monotonic build time)
+        self._built = None
+
+    def init_app(self, app) -> None:
+        """
+        Registers the sitemap routes.
+
+        Args:
+            app (Flask): The Flask app.
+
+        Returns:
+            None
+        """
+        self._app = app
+        app.add_url_rule("/sitemap.xml", endpoint="sitemap", view_func=self.serve)
+        app.add_url_rule(
+            "/sitemaps/<int:number>.xml.gz",
+            endpoint="sitemap_child",
+            view_func=self.serve_child,
+        )
+
+    def register_source(self, source) -> None:
+        """
+        Adds a source of URLs to the sitemap.
+
+        Args:
+            source (callable): Returns an iterable of (path, lastmod) pairs, where lastmod is a datetime or
+                None. Called whenever the sitemap is rebuilt.
+
+        Returns:
+            None
+        """
+        self._sources.append(source)
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """
+        Makes the next request rebuild the sitemap.
+
+        Returns:
+            None
+        """
+        self._built = None
+
+    def _route_paths(self):
+        for rule in self._app.url_map.iter_rules():
+            blueprint = rule.endpoint.rpartition(".")[0]
+
+            if (
+                blueprint in PUBLIC_BLUEPRINTS
+                and rule.endpoint not in EXCLUDED_ENDPOINTS
+                and "GET" in rule.methods
+                and not rule.arguments
+            ):
+                yield rule.rule, None
+
+    def _build(self) -> tuple:
+        urls = []
+        for source in (self._route_paths, *self._sources):
+            for path, lastmod in source():
+                urls.append((self.base_url + path, lastmod))
+
+        child_etags = []
+
+        if len(urls) <= URLS_PER_SITEMAP:
+            index = (
+                XML_HEADER
+                + f'<urlset xmlns="{XMLNS}">\n'
+                + "".join(_url_entry(loc, lastmod) for loc, lastmod in urls)
+                + "</urlset>\n"
+            )
+        else:
+            children = (len(urls) + URLS_PER_SITEMAP - 1) // URLS_PER_SITEMAP
+            index = (
+                XML_HEADER
+                + f'<sitemapindex xmlns="{XMLNS}">\n'
+                + "".join(
+                    f"<sitemap><loc>{escape(self.base_url)}/sitemaps/{number}.xml.gz</loc></sitemap>\n"
+                    for number in range(children)
+                )
+                + "</sitemapindex>\n"
+            )
+
+            # The index only changes with the number of children, so each child is tagged by its own URLs
+            for start in range(0, len(urls), URLS_PER_SITEMAP):
+                digest = xxhash.xxh3_128()
+                for loc, lastmod in urls[start : start + URLS_PER_SITEMAP]:
+                    digest.update(_url_entry(loc, lastmod).encode())
+                child_etags.append(digest.hexdigest())
+
+        index = index.encode()
+        built_at = datetime.datetime.now(datetime.UTC).replace(microsecond=0)
+
+        return (
+            urls,
+            index,
+            xxhash.xxh3_128_hexdigest(index),
+            child_etags,
+            built_at,
+            time.monotonic(),
+        )
+
+    def _is_stale(self, built: tuple | None) -> bool:
+        return built is None or time.monotonic() - built[5] > self.ttl
+
+    def _ensure_built(self) -> tuple:
+        built = self._built
+
+        if self._is_stale(built):
+            with self._lock:
+                built = self._built
+                if self._is_stale(built):
+                    built = self._built = self._build()
+
+        return built
+
+    def serve(self):
+        _, index, etag, _, built_at, _ = self._ensure_built()
+
+        response = Response(index, mimetype="application/xml")
+        response.set_etag(etag)
+        response.last_modified = built_at
+        return response.make_conditional(request)
+
+    def serve_child(self, number: int):
+        urls, _, _, child_etags, built_at, _ = self._ensure_built()
+
+        start = number * URLS_PER_SITEMAP
+        if len(urls) <= URLS_PER_SITEMAP or start >= len(urls):
+            abort(404)
+
+        chunk = urls[start : start + URLS_PER_SITEMAP]
+
+        response = Response(self._stream_child(chunk), mimetype="application/gzip")
+        response.set_etag(child_etags[number])
+        response.last_modified = built_at
+        return response.make_conditional(request)
+
+    def _stream_child(self, urls: list):
+        # wbits=31 writes a gzip container
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+        yield compressor.compress(
+            (XML_HEADER + f'<urlset xmlns="{XMLNS}">\n').encode()
+        )
+
+        for start in range(0, len(urls), STREAM_CHUNK_SIZE):
+            entries = "".join(
+                _url_entry(loc, lastmod)
+                for loc, lastmod in urls[start : start + STREAM_CHUNK_SIZE]
+            )
+            data = compressor.compress(entries.encode())
+            if data:
+                yield data
+
+        yield compressor.compress(b"</urlset>\n") + compressor.flush()
+
+
+# The sitemap shared by the whole process
+sitemap = Sitemap(
+    base_url=BASE_URL,
+    ttl=float(os.getenv("sitemap_ttl", 3600)),
+)
@@ -0,0 +1,162 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the bounded in-process cache that the session and redirect caches are built on.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A bounded, thread-safe LRU cache whose entries expire after a time to live.
+
+    Entries are evicted least recently used first once the cache is full. Expired entries are dropped when
+    they are looked up, unless keep_expired is set, in which case they stay until they are evicted or
+    replaced, so that a subclass can still read them.
+    """
+
+    def __init__(
+        self, max_entries: int, ttl: float, keep_expired: bool = False
+    ) -> None:
+        if max_entries <= 0:
+            raise ValueError("The cache must be able to hold at least one entry.")
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.keep_expired = keep_expired
+
+        # Key: (value, monotonic expiry time), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Bumped by every invalidation, so that a value read before one can be refused (see store)
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _hit(self, value) -> None:
+        """
+        Counts a lookup that found a fresh entry (called with the lock held).
+        """
+        self.hits += 1
+
+    def lookup(self, key) -> tuple[bool, object]:
+        """
+        Looks up a key.
+
+        Args:
+            key: The key to look up.
+
+        Returns:
+            tuple[bool, object]: Whether a fresh entry was found, and its value (None if not found).
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            value, expires_at = entry
+
+            if expires_at <= now:
+                if not self.keep_expired:
+                    del self._entries[key]
+                    self.expirations += 1
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self._hit(value)
+            return True, value
+
+    def store(self, key, value, ttl: float, generation: int | None = None) -> None:
+        """
+        Stores a value, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key: The key.
+            value: The value.
+            ttl (float): The number of seconds the entry stays fresh. Nothing is stored if it is not positive.
+            generation (int | None): The cache's generation from before the value was read. Nothing is stored
+                if the cache was invalidated or cleared since, as the value may be what was invalidated.
+
+        Returns:
+            None
+        """
+        if ttl <= 0:
+            return
+
+        expires_at = time.monotonic() + ttl
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        """
+        Removes a key from the cache, e.g. when the value it caches changes.
+
+        Args:
+            key: The key to remove.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.generation += 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """
+        Removes every entry from the cache.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters, used to size the cache.
+
+        Returns:
+            dict: The current size, limits and hit/miss/eviction counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,80 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains user agent parsing for scan analytics. Parsing a user agent runs dozens of regular
+expressions (around a millisecond each time), while scans come from a fairly small set of distinct user
+agents, so parsed results are memoised in a bounded LRU cache.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import functools
+import os
+
+# Third Party Modules
+from user_agents import parse
+
+# Constants
+# Number of distinct user agents kept parsed, configurable through the environment
+UA_CACHE_SIZE = int(os.getenv("ua_cache_size", 4096))
+
+# Longer user agents are truncated before parsing and caching
+MAX_USER_AGENT_LENGTH = 512
+
+UNKNOWN = "Other"
+
+
+@functools.lru_cache(maxsize=UA_CACHE_SIZE)
+def _parse(user_agent: str) -> tuple[str, str, str]:
+    parsed = parse(user_agent)
+
+    if parsed.is_bot:
+        device = "bot"
+    elif parsed.is_tablet:
+        device = "tablet"
+    elif parsed.is_mobile:
+        device = "mobile"
+    elif parsed.is_pc:
+        device = "desktop"
+    else:
+        device = "other"
+
+    return device, parsed.os.family or UNKNOWN, parsed.browser.family or UNKNOWN
+
+
+def parse_user_agent(user_agent: str | None) -> tuple[str, str, str]:
+    """
+    Classifies a user agent.
+
+    Args:
+        user_agent (str | None): The User-Agent header of a request.
+
+    Returns:
+        tuple[str, str, str]: The device type ("mobile", "tablet", "desktop", "bot" or "other"), the operating
+            system family and the browser family.
+    """
+    if not user_agent:
+        return "other", UNKNOWN, UNKNOWN
+
+    return _parse(user_agent[:MAX_USER_AGENT_LENGTH])
+
+
+def user_agent_cache_stats() -> dict:
+    """
+    Returns the parse cache counters, used to size the cache.
+
+    Returns:
+        dict: The current size, limit and hit/miss counters.
+    """
+    info = _parse.cache_info()
+    lookups = info.hits + info.misses
+
+    return {
+        "size": info.currsize,
+        "max_entries": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_ratio": info.hits / lookups if lookups else 0.0,
+    }
@@ -0,0 +1,327 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains bulk QR generation. A batch is parsed from CSV or JSON lines, rendered in chunks on the
+rendering pool (qr/pool.py) with a bounded number of chunks in flight, and streamed back as a ZIP archive or
+as JSON lines of data URIs in the order the renders complete, so that neither the input nor the output of a
+batch is ever held in memory all at once.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import base64
+import csv
+import io
+import re
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# Third Party Modules
+import msgspec
+
+# QR Code Modules
+from qr.cache import render_cache, render_key
+from qr.pool import QR_WORKERS, get_executor, render_chunk, reset_executor
+from qr.render import FORMATS
+
+# Constants
+# Items per pool task; larger chunks amortise the cost of sending work to the pool
+CHUNK_SIZE = 16
+
+# Chunks a batch may have queued on the pool at a time, so that one batch cannot flood the pool
+MAX_CHUNKS_IN_FLIGHT = QR_WORKERS * 2
+
+# Characters allowed in archive entry names; anything else is replaced
+NAME_PATTERN = re.compile(r"[^A-Za-z0-9._-]+")
+MAX_NAME_LENGTH = 100
+
+
+class BatchInputError(ValueError):
+    """
+    Raised when the input of a batch cannot be parsed.
+    """
+
+
+class BatchItem(msgspec.Struct):
+    """
+    One QR code of a batch: the data to encode, and optionally the name of its file.
+    """
+
+    data: str
+    name: str | None = None
+
+
+_item_decoder = msgspec.json.Decoder(BatchItem)
+
+
+def parse_csv(body: bytes) -> list[BatchItem]:
+    """
+    Parses a batch from CSV, with a header row naming a "data" column and optionally a "name" column.
+
+    Args:
+        body (bytes): The UTF-8 CSV document.
+
+    Raises:
+        BatchInputError: If the CSV is invalid.
+
+    Returns:
+        list[BatchItem]: The items of the batch.
+    """
+    try:
+        reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+
+        if reader.fieldnames is None or "data" not in reader.fieldnames:
+            raise BatchInputError(
+                'The CSV must have a header row with a "data" column.'
+            )
+
+        items = []
+        for row in reader:
+            if not row["data"]:
+                raise BatchInputError(f"Line {reader.line_num} has no data.")
+            items.append(BatchItem(data=row["data"], name=row.get("name") or None))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise BatchInputError(f"The CSV is invalid: {e}")
+
+    return items
+
+
+def parse_ndjson(body: bytes) -> list[BatchItem]:
+    """
+    Parses a batch from JSON lines, one {"data": ..., "name": ...} object per line.
+
+    Args:
+        body (bytes): The JSON lines document.
+
+    Raises:
+        BatchInputError: If a line is invalid.
+
+    Returns:
+        list[BatchItem]: The items of the batch.
+    """
+    items = []
+
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+
+        try:
+            item = _item_decoder.decode(line)
+        except msgspec.DecodeError as e:
+            raise BatchInputError(f"Line {line_number} is invalid: {e}")
+
+        if not item.data:
+            raise BatchInputError(f"Line {line_number} has no data.")
+
+        items.append(item)
+
+    return items
+
+
+def entry_names(items: list[BatchItem], fmt: str) -> list[str]:
+    """
+    Picks a unique, safe file name for every item of a batch.
+
+    Args:
+        items (list[BatchItem]): The items of the batch.
+        fmt (str): The output format, used as the file extension.
+
+    Returns:
+        list[str]: The file name of every item, in order.
+    """
+    names = []
+    seen = set()
+
+    for index, item in enumerate(items):
+        name = item.name or ""
+        if name.lower().endswith(f".{fmt}"):
+            name = name[: -len(fmt) - 1]
+
+        name = NAME_PATTERN.sub("-", name).strip(".-")[:MAX_NAME_LENGTH]
+        name = name or f"{index + 1:05d}"
+
+        if name in seen:
+            name = f"{name}-{index + 1}"
+
+        seen.add(name)
+        names.append(f"{name}.{fmt}")
+
+    return names
+
+
+def render_batch(
+    payloads: list[bytes], ec_level: str, fmt: str, size: int | None, style: dict
+):
+    """
+    Renders a batch, through the render cache and on the rendering pool.
+
+    Cached renders are yielded straight away, and the rest are sent to the pool in chunks. Closing the
+    generator cancels the chunks that have not started yet.
+
+    Args:
+        payloads (list[bytes]): The data to encode, per item.
+        ec_level (str): The error correction level.
+        fmt (str): The output format ("svg" or "png").
+        size (int | None): The size of PNG renders, in pixels.
+        style (dict): The complete render style.
+
+    Yields:
+        tuple: An (index, output, error) triple per item, in the order they complete, with either the output
+            or the error set.
+    """
+    keys = [render_key(payload, ec_level, fmt, size, style) for payload in payloads]
+    items = iter(enumerate(payloads))
+    exhausted = False
+
+    executor = get_executor()
+    in_flight = {}
+
+    try:
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < MAX_CHUNKS_IN_FLIGHT:
+                chunk = []
+
+                for index, payload in items:
+                    output = render_cache.get(keys[index], fmt)
+
+                    if output is not None:
+                        yield index, output, None
+                        continue
+
+                    chunk.append((index, payload))
+                    if len(chunk) == CHUNK_SIZE:
+                        break
+                else:
+                    exhausted = True
+
+                if chunk:
+                    try:
+                        future = executor.submit(
+                            render_chunk, chunk, ec_level, fmt, size, style
+                        )
+                    except BrokenProcessPool:
+                        # A worker died earlier in the batch, so carry on with a new pool
+                        reset_executor(executor)
+                        executor = get_executor()
+                        future = executor.submit(
+                            render_chunk, chunk, ec_level, fmt, size, style
+                        )
+                    in_flight[future] = chunk
+
+            if not in_flight:
+                continue
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                chunk = in_flight.pop(future)
+
+                try:
+                    results = future.result()
+                except BrokenProcessPool:
+                    reset_executor(executor)
+                    results = [
+                        (index, None, "The renderer failed.") for index, _ in chunk
+                    ]
+
+                for index, output, error in results:
+                    if output is not None:
+                        render_cache.put(keys[index], fmt, output)
+                    yield index, output, error
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+class _ChunkWriter:
+    """
+    A write-only, unseekable file that keeps what is written to it until it is drained.
+    """
+
+    def __init__(self) -> None:
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(results, names: list[str], fmt: str):
+    """
+    Streams the results of a batch as a ZIP archive, with one file per item plus an errors.csv listing the
+    items that could not be rendered.
+
+    The archive is written to an unseekable stream, so sizes and checksums follow each file instead of
+    preceding it, and every file is sent as soon as it has been written.
+
+    Args:
+        results (iterable): The (index, output, error) triples of the batch (see render_batch).
+        names (list[str]): The file name of every item (see entry_names).
+        fmt (str): The output format. PNGs are compressed already, so they are stored as they are.
+
+    Yields:
+        bytes: The archive, piece by piece.
+    """
+    writer = _ChunkWriter()
+    compression = zipfile.ZIP_DEFLATED if fmt == "svg" else zipfile.ZIP_STORED
+    errors = []
+
+    with zipfile.ZipFile(writer, "w", compression=compression) as archive:
+        for index, output, error in results:
+            if error is not None:
+                errors.append((index + 1, names[index], error))
+                continue
+
+            archive.writestr(names[index], output)
+
+            data = writer.drain()
+            if data:
+                yield data
+
+        if errors:
+            errors_csv = io.StringIO()
+            csv_writer = csv.writer(errors_csv)
+            csv_writer.writerow(("line", "name", "error"))
+            csv_writer.writerows(errors)
+            archive.writestr("errors.csv", errors_csv.getvalue())
+
+    yield writer.drain()
+
+
+def stream_ndjson(results, names: list[str], fmt: str):
+    """
+    Streams the results of a batch as JSON lines, one object per item with its data URI or error.
+
+    Args:
+        results (iterable): The (index, output, error) triples of the batch (see render_batch).
+        names (list[str]): The file name of every item (see entry_names).
+        fmt (str): The output format.
+
+    Yields:
+        bytes: One JSON line per item.
+    """
+    prefix = f"data:{FORMATS[fmt]};base64,"
+    encoder = msgspec.json.Encoder()
+
+    for index, output, error in results:
+        if error is not None:
+            line = {"index": index, "name": names[index], "error": error}
+        else:
+            line = {
+                "index": index,
+                "name": names[index],
+                "data_uri": prefix + base64.b64encode(output).decode(),
+            }
+
+        yield encoder.encode(line) + b"\n"
@@ -0,0 +1,282 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the content-addressed cache of rendered QR codes. Renders are keyed by an xxhash of
+everything that affects the output (payload, error correction level, format, size and style), and kept in an
+in-process LRU cache backed by an optional on-disk cache shared between processes, so that a QR code is only
+encoded and rendered once.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Third Party Modules
+import msgspec
+import xxhash
+
+# QR Code Modules
+from qr.encoder import encode
+from qr.render import FORMATS, check_logo, normalise_style, render_matrix
+
+# Constants
+# Cache sizing, configurable through the environment
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def render_key(
+    payload: bytes, ec_level: str, fmt: str, size: int | None, style: dict
+) -> str:
+    """
+    Computes the cache key of a render.
+
+    Args:
+        payload (bytes): The encoded data.
+        ec_level (str): The error correction level.
+        fmt (str): The output format ("svg" or "png").
+        size (int | None): The size of PNG renders, in pixels.
+        style (dict): The complete render style.
+
+    Returns:
+        str: The hex digest identifying the render.
+    """
+    key = msgspec.msgpack.encode([payload, ec_level, fmt, size, sorted(style.items())])
+    return xxhash.xxh3_128_hexdigest(key)
+
+
+class RenderCache:
+    """
+    A bounded, thread-safe LRU cache of rendered QR codes, optionally backed by a directory on disk.
+
+    The memory cache is bounded by both the number of entries and their total size. Files on disk are
+    written atomically and never expire, since a key always maps to the same output; the directory can be
+    cleared at any time.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        directory: str | None = None,
+    ) -> None:
+        if max_entries <= 0:
+            raise ValueError("The cache must be able to hold at least one entry.")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{fmt}")
+
+    def _store(self, key: str, data: bytes) -> None:
+        # Called with the lock held
+        if len(data) > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+
+        self._entries[key] = data
+        self._size += len(data)
+
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def _read_disk(self, key: str, fmt: str) -> bytes | None:
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key, fmt), "rb") as cache_file:
+                return cache_file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, fmt: str, data: bytes) -> None:
+        if self.directory is None:
+            return
+
+        path = self._path(key, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file and rename it, so that readers never see a partial file
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(descriptor, "wb") as cache_file:
+                cache_file.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def get(self, key: str, fmt: str) -> bytes | None:
+        """
+        Looks up a render in memory, then on disk.
+
+        Args:
+            key (str): The render key (see render_key).
+            fmt (str): The output format, used as the file extension on disk.
+
+        Returns:
+            bytes | None: The rendered output, or None if it is not cached.
+        """
+        with self._lock:
+            data = self._entries.get(key)
+
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+
+        data = self._read_disk(key, fmt)
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._store(key, data)
+
+        return data
+
+    def put(self, key: str, fmt: str, data: bytes) -> None:
+        """
+        Stores a render in memory and on disk.
+
+        Args:
+            key (str): The render key (see render_key).
+            fmt (str): The output format, used as the file extension on disk.
+            data (bytes): The rendered output.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._store(key, data)
+
+        self._write_disk(key, fmt, data)
+
+    def get_or_render(self, key: str, fmt: str, render) -> bytes:
+        """
+        Returns a cached render, rendering and caching it if it is not cached yet.
+
+        Args:
+            key (str): The render key (see render_key).
+            fmt (str): The output format, used as the file extension on disk.
+            render (callable): Renders the output when it is not cached.
+
+        Returns:
+            bytes: The rendered output.
+        """
+        data = self.get(key, fmt)
+
+        if data is None:
+            data = render()
+            self.put(key, fmt, data)
+
+        return data
+
+    def clear(self) -> None:
+        """
+        Removes every entry from the memory cache (files on disk are kept).
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters, used to size the cache.
+
+        Returns:
+            dict: The current size, limits and hit/miss/eviction counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+
+            return {
+                "size": len(self._entries),
+                "bytes": self._size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "disk": self.directory is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+# The cache shared by the whole process
+render_cache = RenderCache(
+    max_entries=int(os.getenv("qr_cache_max_entries", DEFAULT_MAX_ENTRIES)),
+    max_bytes=int(os.getenv("qr_cache_max_bytes", DEFAULT_MAX_BYTES)),
+    directory=os.getenv("qr_cache_dir") or None,
+)
+
+
+def render_qr(
+    payload: bytes | str,
+    ec_level: str = "M",
+    fmt: str = "svg",
+    size: int | None = None,
+    style: dict | None = None,
+) -> tuple[bytes, str]:
+    """
+    Renders a QR code, through the render cache.
+
+    Args:
+        payload (bytes | str): The data to encode. Strings are encoded as UTF-8.
+        ec_level (str): The error correction level ("L", "M", "Q" or "H").
+        fmt (str): The output format ("svg" or "png").
+        size (int | None): The width and height of PNG renders, in pixels (required for PNGs, ignored for
+            SVGs, which scale).
+        style (dict | None): The render style (see qr.render.normalise_style).
+
+    Raises:
+        ValueError: If an option is invalid, or the payload does not fit in a QR code.
+
+    Returns:
+        tuple[bytes, str]: The rendered output and its mimetype.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("The format must be svg or png.")
+    if fmt == "png" and size is None:
+        raise ValueError("PNG renders need a size.")
+    if fmt == "svg":
+        size = None
+
+    if isinstance(payload, str):
+        payload = payload.encode()
+
+    style = normalise_style(style)
+    check_logo(style, ec_level)
+    key = render_key(payload, ec_level, fmt, size, style)
+
+    def render() -> bytes:
+        return render_matrix(encode(payload, ec_level), fmt, size, style)
+
+    return render_cache.get_or_render(key, fmt, render), FORMATS[fmt]
@@ -0,0 +1,515 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the QR code encoder (ISO/IEC 18004, byte mode, versions 1 to 40). Reed-Solomon error
+correction is computed from precomputed Galois field tables, and the eight mask patterns are applied and
+scored together as NumPy arrays rather than module by module.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import functools
+
+# Third Party Modules
+import numpy as np
+
+# Constants
+MIN_VERSION = 1
+MAX_VERSION = 40
+
+# Error correction levels and the bits identifying them in the format information
+EC_LEVELS = {"L": 1, "M": 0, "Q": 3, "H": 2}
+_EC_INDEX = {"L": 0, "M": 1, "Q": 2, "H": 3}
+
+# Error correction codewords per block, per level (L, M, Q, H) and version (index 0 is unused)
+ECC_CODEWORDS_PER_BLOCK = (
+    (-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    (-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+)  # fmt: skip
+
+# Error correction blocks, per level (L, M, Q, H) and version (index 0 is unused)
+NUM_ERROR_CORRECTION_BLOCKS = (
+    (-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    (-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    (-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+)  # fmt: skip
+
+# Mask penalty weights
+PENALTY_N1 = 3
+PENALTY_N2 = 3
+PENALTY_N3 = 40
+PENALTY_N4 = 10
+
+# Finder-like sequences penalised by rule 3 (dark 1:1:3:1:1 with four light modules on one side), as
+# 11-bit integers with the first module in the most significant bit
+_FINDER_LIKE_WIDTH = 11
+_FINDER_LIKE = (0b10111010000, 0b00001011101)
+
+
+class DataTooLong(ValueError):
+    """
+    Raised when the payload does not fit in a version 40 symbol at the requested error correction level.
+    """
+
+
+# Galois field GF(2^8) tables, with the QR code primitive polynomial x^8 + x^4 + x^3 + x^2 + 1
+def _build_gf_tables() -> tuple[np.ndarray, np.ndarray]:
+    exp = np.zeros(512, dtype=np.uint8)
+    log = np.zeros(256, dtype=np.int32)
+
+    value = 1
+    for power in range(255):
+        exp[power] = value
+        log[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= 0x11D
+
+    exp[255:510] = exp[0:255]
+    return exp, log
+
+
+GF_EXP, GF_LOG = _build_gf_tables()
+
+
+def _build_gf_multiplication_table() -> np.ndarray:
+    # GF_MUL[a, b] = a * b in GF(2^8)
+    logs = GF_LOG[1:]
+    table = np.zeros((256, 256), dtype=np.uint8)
+    table[1:, 1:] = GF_EXP[logs[:, None] + logs[None, :]]
+    return table
+
+
+GF_MUL = _build_gf_multiplication_table()
+
+
+@functools.lru_cache(maxsize=None)
+def _rs_divisor_table(degree: int) -> np.ndarray:
+    """
+    Returns, for every possible factor, the generator polynomial of the given degree multiplied by it.
+    """
+    divisor = [0] * (degree - 1) + [1]
+    root = 1
+
+    for _ in range(degree):
+        for j in range(degree):
+            divisor[j] = int(GF_MUL[divisor[j], root])
+            if j + 1 < degree:
+                divisor[j] ^= divisor[j + 1]
+        root = int(GF_MUL[root, 0x02])
+
+    return GF_MUL[:, divisor]
+
+
+def rs_remainder(data: np.ndarray, degree: int) -> np.ndarray:
+    """
+    Computes the Reed-Solomon error correction codewords of a block.
+
+    Args:
+        data (np.ndarray): The data codewords of the block (uint8).
+        degree (int): The number of error correction codewords.
+
+    Returns:
+        np.ndarray: The error correction codewords (uint8).
+    """
+    table = _rs_divisor_table(degree)
+    remainder = np.zeros(degree, dtype=np.uint8)
+
+    for byte in data:
+        factor = byte ^ remainder[0]
+        remainder[:-1] = remainder[1:]
+        remainder[-1] = 0
+        remainder ^= table[factor]
+
+    return remainder
+
+
+def _num_raw_data_modules(version: int) -> int:
+    result = (16 * version + 128) * version + 64
+
+    if version >= 2:
+        num_align = version // 7 + 2
+        result -= (25 * num_align - 10) * num_align - 55
+        if version >= 7:
+            result -= 36
+
+    return result
+
+
+def num_data_codewords(version: int, ec_level: str) -> int:
+    """
+    Returns the number of data codewords a symbol can hold.
+
+    Args:
+        version (int): The symbol version (1 to 40).
+        ec_level (str): The error correction level ("L", "M", "Q" or "H").
+
+    Returns:
+        int: The number of 8-bit data codewords.
+    """
+    index = _EC_INDEX[ec_level]
+    return (
+        _num_raw_data_modules(version) // 8
+        - ECC_CODEWORDS_PER_BLOCK[index][version]
+        * NUM_ERROR_CORRECTION_BLOCKS[index][version]
+    )
+
+
+def _alignment_pattern_positions(version: int) -> list:
+    if version == 1:
+        return []
+
+    size = version * 4 + 17
+    num_align = version // 7 + 2
+    step = (version * 8 + num_align * 3 + 5) // (num_align * 4 - 4) * 2
+    positions = [size - 7 - i * step for i in range(num_align - 1)] + [6]
+    return list(reversed(positions))
+
+
+def _bch_format_bits(ec_level: str, mask: int) -> int:
+    data = EC_LEVELS[ec_level] << 3 | mask
+    remainder = data
+    for _ in range(10):
+        remainder = (remainder << 1) ^ ((remainder >> 9) * 0x537)
+    return (data << 10 | remainder) ^ 0x5412
+
+
+def _bch_version_bits(version: int) -> int:
+    remainder = version
+    for _ in range(12):
+        remainder = (remainder << 1) ^ ((remainder >> 11) * 0x1F25)
+    return version << 12 | remainder
+
+
+def _format_positions(size: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the (y, x) coordinates of both copies of the 15 format bits, and the bit index of each.
+    """
+    coordinates = []
+
+    # First copy, around the top left finder
+    for i in range(6):
+        coordinates.append((i, 8, i))
+    coordinates.append((7, 8, 6))
+    coordinates.append((8, 8, 7))
+    coordinates.append((8, 7, 8))
+    for i in range(9, 15):
+        coordinates.append((8, 14 - i, i))
+
+    # Second copy, split between the top right and bottom left finders
+    for i in range(8):
+        coordinates.append((8, size - 1 - i, i))
+    for i in range(8, 15):
+        coordinates.append((size - 15 + i, 8, i))
+
+    ys, xs, bits = zip(*coordinates)
+    return np.array(ys), np.array(xs), np.array(bits)
+
+
+@functools.lru_cache(maxsize=MAX_VERSION)
+def _template(version: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Builds the function patterns of a version, shared by every symbol of that version.
+
+    Returns:
+        tuple: The modules (with the format area left light), the function module mask, and the (y, x)
+            coordinates of the data modules in placement order.
+    """
+    size = version * 4 + 17
+    modules = np.zeros((size, size), dtype=bool)
+    function = np.zeros((size, size), dtype=bool)
+
+    def set_function_module(x, y, dark):
+        modules[y, x] = dark
+        function[y, x] = True
+
+    # Timing patterns
+    for i in range(size):
+        set_function_module(6, i, i % 2 == 0)
+        set_function_module(i, 6, i % 2 == 0)
+
+    # Finder patterns and their separators
+    for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+        for dy in range(-4, 5):
+            for dx in range(-4, 5):
+                x, y = cx + dx, cy + dy
+                if 0 <= x < size and 0 <= y < size:
+                    set_function_module(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+
+    # Alignment patterns, except where they would overlap the finders
+    positions = _alignment_pattern_positions(version)
+    last = len(positions) - 1
+    for i, cx in enumerate(positions):
+        for j, cy in enumerate(positions):
+            if (i, j) in ((0, 0), (0, last), (last, 0)):
+                continue
+            for dy in range(-2, 3):
+                for dx in range(-2, 3):
+                    set_function_module(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+
+    # Format information area (filled in per mask) and the always dark module
+    ys, xs, _ = _format_positions(size)
+    function[ys, xs] = True
+    set_function_module(8, size - 8, True)
+
+    # Version information
+    if version >= 7:
+        bits = _bch_version_bits(version)
+        for i in range(18):
+            a, b = size - 11 + i % 3, i // 3
+            dark = (bits >> i) & 1 == 1
+            set_function_module(a, b, dark)
+            set_function_module(b, a, dark)
+
+    # Data module placement order: two-module wide columns, zigzagging from the bottom right
+    data_ys, data_xs = [], []
+    right = size - 1
+    while right >= 1:
+        if right == 6:
+            right = 5
+        for vert in range(size):
+            for j in range(2):
+                x = right - j
+                upward = (right + 1) & 2 == 0
+                y = size - 1 - vert if upward else vert
+                if not function[y, x]:
+                    data_ys.append(y)
+                    data_xs.append(x)
+        right -= 2
+
+    modules.flags.writeable = False
+    function.flags.writeable = False
+    return modules, function, np.array(data_ys), np.array(data_xs)
+
+
+@functools.lru_cache(maxsize=MAX_VERSION)
+def _mask_patterns(size: int) -> np.ndarray:
+    """
+    Returns the eight mask patterns for a symbol size, as one (8, size, size) boolean array.
+    """
+    y, x = np.indices((size, size))
+    patterns = np.stack(
+        [
+            (x + y) % 2 == 0,
+            y % 2 == 0,
+            x % 3 == 0,
+            (x + y) % 3 == 0,
+            (x // 3 + y // 2) % 2 == 0,
+            x * y % 2 + x * y % 3 == 0,
+            (x * y % 2 + x * y % 3) % 2 == 0,
+            ((x + y) % 2 + x * y % 3) % 2 == 0,
+        ]
+    )
+    patterns.flags.writeable = False
+    return patterns
+
+
+def _encode_data(data: bytes, ec_level: str) -> tuple[int, np.ndarray]:
+    """
+    Picks the smallest version that fits the data, and builds its padded data codewords.
+    """
+    for version in range(MIN_VERSION, MAX_VERSION + 1):
+        count_bits = 8 if version <= 9 else 16
+        capacity = num_data_codewords(version, ec_level) * 8
+        if 4 + count_bits + len(data) * 8 <= capacity:
+            break
+    else:
+        raise DataTooLong(
+            f"{len(data)} bytes do not fit in a QR code at error correction level {ec_level}."
+        )
+
+    # Mode indicator (byte mode), character count, then the data itself
+    header = (0b0100 << count_bits | len(data)) << 4
+    header_bits = 4 + count_bits + 4
+    header_bytes = header.to_bytes(header_bits // 8 + 1, "big")
+
+    bits = np.unpackbits(np.frombuffer(header_bytes, dtype=np.uint8))
+    bits = bits[len(bits) - header_bits : len(bits) - 4]
+    bits = np.concatenate([bits, np.unpackbits(np.frombuffer(data, dtype=np.uint8))])
+
+    # Terminator, padding to a whole byte, then alternating pad bytes
+    terminator = min(4, capacity - len(bits))
+    bits = np.concatenate([bits, np.zeros(terminator, dtype=np.uint8)])
+    bits = np.concatenate([bits, np.zeros(-len(bits) % 8, dtype=np.uint8)])
+
+    codewords = np.packbits(bits)
+    padding = np.resize(
+        np.array([0xEC, 0x11], dtype=np.uint8), capacity // 8 - len(codewords)
+    )
+    return version, np.concatenate([codewords, padding])
+
+
+def _add_ecc_and_interleave(
+    data: np.ndarray, version: int, ec_level: str
+) -> np.ndarray:
+    index = _EC_INDEX[ec_level]
+    num_blocks = NUM_ERROR_CORRECTION_BLOCKS[index][version]
+    block_ecc_len = ECC_CODEWORDS_PER_BLOCK[index][version]
+    raw_codewords = _num_raw_data_modules(version) // 8
+    num_short_blocks = num_blocks - raw_codewords % num_blocks
+    short_block_len = raw_codewords // num_blocks
+
+    # Short blocks are padded with a placeholder byte so that all blocks can be interleaved as columns
+    blocks = np.zeros((num_blocks, short_block_len + 1), dtype=np.uint8)
+    placeholder = np.zeros((num_blocks, short_block_len + 1), dtype=bool)
+
+    offset = 0
+    for i in range(num_blocks):
+        length = short_block_len - block_ecc_len + (0 if i < num_short_blocks else 1)
+        block = data[offset : offset + length]
+        offset += length
+
+        ecc = rs_remainder(block, block_ecc_len)
+        if i < num_short_blocks:
+            blocks[i, :length] = block
+            placeholder[i, length] = True
+            blocks[i, length + 1 :] = ecc
+        else:
+            blocks[i, :length] = block
+            blocks[i, length:] = ecc
+
+    return blocks.T[~placeholder.T]
+
+
+def _penalty_runs(candidates: np.ndarray) -> np.ndarray:
+    """
+    Rule 1: runs of five or more same-coloured modules in a row or column, for every candidate.
+    """
+    count, size, _ = candidates.shape
+    penalties = np.zeros(count, dtype=np.int64)
+
+    for lines in (candidates, candidates.transpose(0, 2, 1)):
+        # Lines are separated by a sentinel value so that runs never continue onto the next line
+        values = np.concatenate(
+            [lines.astype(np.int8), np.full((count, size, 1), 2, dtype=np.int8)],
+            axis=2,
+        ).reshape(count, -1)
+
+        for k in range(count):
+            line = values[k]
+            starts = np.concatenate(([0], np.flatnonzero(line[1:] != line[:-1]) + 1))
+            lengths = np.diff(np.append(starts, len(line)))
+            lengths = lengths[line[starts] != 2]
+            long_runs = lengths[lengths >= 5]
+            penalties[k] += (long_runs - 5 + PENALTY_N1).sum()
+
+    return penalties
+
+
+def _penalty_blocks(candidates: np.ndarray) -> np.ndarray:
+    """
+    Rule 2: 2x2 blocks of same-coloured modules, for every candidate.
+    """
+    top_left = candidates[:, :-1, :-1]
+    same = (
+        (top_left == candidates[:, 1:, :-1])
+        & (top_left == candidates[:, :-1, 1:])
+        & (top_left == candidates[:, 1:, 1:])
+    )
+    return same.sum(axis=(1, 2)) * PENALTY_N2
+
+
+def _penalty_finder_like(candidates: np.ndarray) -> np.ndarray:
+    """
+    Rule 3: finder-like patterns in rows and columns, for every candidate. The symbol is surrounded by its
+    light quiet zone, so patterns touching the edge count too.
+    """
+    padded = np.pad(candidates, ((0, 0), (4, 4), (4, 4))).astype(np.int16)
+    penalties = np.zeros(len(candidates), dtype=np.int64)
+
+    for lines in (padded, padded.transpose(0, 2, 1)):
+        # Pack every 11-module window into an integer, so that each pattern is a single comparison
+        count = lines.shape[2] - _FINDER_LIKE_WIDTH + 1
+        windows = np.zeros(lines.shape[:2] + (count,), dtype=np.int16)
+        for k in range(_FINDER_LIKE_WIDTH):
+            windows = (windows << 1) | lines[:, :, k : k + count]
+
+        for pattern in _FINDER_LIKE:
+            penalties += (windows == pattern).sum(axis=(1, 2)) * PENALTY_N3
+
+    return penalties
+
+
+def _penalty_balance(candidates: np.ndarray) -> np.ndarray:
+    """
+    Rule 4: deviation of the proportion of dark modules from 50%, for every candidate.
+    """
+    total = candidates.shape[1] * candidates.shape[2]
+    dark = candidates.sum(axis=(1, 2))
+    k = (np.abs(dark * 20 - total * 10) + total - 1) // total - 1
+    return k * PENALTY_N4
+
+
+def mask_penalties(candidates: np.ndarray) -> np.ndarray:
+    """
+    Scores masked symbols with the four penalty rules.
+
+    Args:
+        candidates (np.ndarray): The (count, size, size) boolean modules of the masked symbols.
+
+    Returns:
+        np.ndarray: The penalty of every candidate, lower is better.
+    """
+    return (
+        _penalty_runs(candidates)
+        + _penalty_blocks(candidates)
+        + _penalty_finder_like(candidates)
+        + _penalty_balance(candidates)
+    )
+
+
+def encode(
+    data: bytes | str, ec_level: str = "M", mask: int | None = None
+) -> np.ndarray:
+    """
+    Encodes data into a QR code.
+
+    Args:
+        data (bytes | str): The payload. Strings are encoded as UTF-8.
+        ec_level (str): The error correction level ("L", "M", "Q" or "H").
+        mask (int | None): The mask pattern to use (0 to 7), or None to pick the one with the lowest penalty.
+
+    Raises:
+        DataTooLong: If the payload does not fit in a QR code.
+
+    Returns:
+        np.ndarray: The (size, size) boolean module matrix, True for dark modules, without a quiet zone.
+    """
+    if ec_level not in EC_LEVELS:
+        raise ValueError("The error correction level must be one of L, M, Q or H.")
+    if mask is not None and not 0 <= mask <= 7:
+        raise ValueError("The mask must be between 0 and 7.")
+
+    if isinstance(data, str):
+        data = data.encode()
+
+    version, codewords = _encode_data(data, ec_level)
+    codewords = _add_ecc_and_interleave(codewords, version, ec_level)
+
+    template, function, data_ys, data_xs = _template(version)
+    size = template.shape[0]
+
+    # Place the data bits; the remainder bits at the end stay light
+    modules = template.copy()
+    bits = np.unpackbits(codewords).astype(bool)
+    modules[data_ys[: len(bits)], data_xs[: len(bits)]] = bits
+
+    # Apply every candidate mask at once, to the data modules only
+    masks = range(8) if mask is None else (mask,)
+    patterns = _mask_patterns(size)[list(masks)] & ~function
+    candidates = modules[None, :, :] ^ patterns
+
+    format_ys, format_xs, format_bit_index = _format_positions(size)
+    for k, candidate_mask in enumerate(masks):
+        format_bits = _bch_format_bits(ec_level, candidate_mask)
+        candidates[k, format_ys, format_xs] = (format_bits >> format_bit_index) & 1 == 1
+
+    if len(candidates) == 1:
+        return candidates[0]
+
+    return candidates[int(np.argmin(mask_penalties(candidates)))]
@@ -0,0 +1,163 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the logos that can be embedded in the middle of a styled QR code. Only logos shipped in
+static/images can be used, so user input never reaches the image decoder. Decoded and scaled logos are
+cached, since the same few sizes are rendered over and over.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import base64
+import functools
+import os
+
+# Third Party Modules
+import numpy as np
+
+# QR Code Modules
+from qr.png import png_dimensions, read_png
+
+# Constants
+IMAGES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "static", "images"
+)
+
+# Logo name: (PNG used for PNG renders, SVG used for SVG renders)
+LOGOS = {
+    "betterqr": ("betterqr-banner-logo.png", "betterqr-banner-logo.svg"),
+}
+
+
+def _read(filename: str) -> bytes:
+    with open(os.path.join(IMAGES_DIR, filename), "rb") as file:
+        return file.read()
+
+
+@functools.lru_cache(maxsize=len(LOGOS))
+def logo_pixels(name: str) -> np.ndarray:
+    """
+    Decodes a logo.
+
+    Args:
+        name (str): The logo name (see LOGOS).
+
+    Returns:
+        np.ndarray: The (height, width, 4) RGBA logo.
+    """
+    pixels = read_png(_read(LOGOS[name][0]))
+    pixels.flags.writeable = False
+    return pixels
+
+
+@functools.lru_cache(maxsize=len(LOGOS))
+def logo_aspect(name: str) -> float:
+    """
+    Returns the aspect ratio of a logo.
+
+    Args:
+        name (str): The logo name (see LOGOS).
+
+    Returns:
+        float: The width of the logo divided by its height.
+    """
+    width, height = png_dimensions(_read(LOGOS[name][0]))
+    return width / height
+
+
+@functools.lru_cache(maxsize=len(LOGOS))
+def logo_data_uri(name: str) -> str:
+    """
+    Returns a logo as an SVG data URI, for embedding in SVG renders.
+
+    Args:
+        name (str): The logo name (see LOGOS).
+
+    Returns:
+        str: The data URI.
+    """
+    encoded = base64.b64encode(_read(LOGOS[name][1])).decode()
+    return f"data:image/svg+xml;base64,{encoded}"
+
+
+def _premultiplied(name: str, level: int) -> np.ndarray:
+    """
+    Returns a logo with its colours premultiplied by alpha, halved in size the given number of times.
+
+    Each level is the average of 2x2 blocks of the level above it, so that small logos are scaled from a
+    small image instead of from the full-size logo every time. The halved levels are cached; the full-size
+    level is large and only needed for the largest renders, so it is not.
+
+    Args:
+        name (str): The logo name (see LOGOS).
+        level (int): How many times the logo is halved.
+
+    Returns:
+        np.ndarray: The (height, width, 4) premultiplied RGBA logo, as floats between 0 and 1.
+    """
+    if level == 0:
+        pixels = logo_pixels(name).astype(np.float32) / 255
+        pixels[:, :, :3] *= pixels[:, :, 3:]
+        return pixels
+
+    return _halved(name, level)
+
+
+@functools.lru_cache(maxsize=len(LOGOS) * 8)
+def _halved(name: str, level: int) -> np.ndarray:
+    above = _premultiplied(name, level - 1)
+    height, width = above.shape[0] // 2 * 2, above.shape[1] // 2 * 2
+    pixels = (
+        above[:height, :width]
+        .reshape(height // 2, 2, width // 2, 2, 4)
+        .mean(axis=(1, 3))
+    )
+
+    pixels.flags.writeable = False
+    return pixels
+
+
+@functools.lru_cache(maxsize=64)
+def scaled_logo(name: str, width: int, height: int) -> np.ndarray:
+    """
+    Scales a logo down to the given size by averaging the pixels that fall in each output pixel.
+
+    Colours are averaged weighted by their alpha, so that transparent pixels do not darken the edges.
+
+    Args:
+        name (str): The logo name (see LOGOS).
+        width (int): The width of the scaled logo, in pixels.
+        height (int): The height of the scaled logo, in pixels.
+
+    Returns:
+        np.ndarray: The (height, width, 4) RGBA logo, as floats between 0 and 1.
+    """
+    # Start from the smallest level still at least twice the requested size, keeping the average smooth
+    source_width, source_height = png_dimensions(_read(LOGOS[name][0]))
+    level = 0
+    while (
+        source_width >> (level + 1) >= width * 2
+        and source_height >> (level + 1) >= height * 2
+    ):
+        level += 1
+    pixels = _premultiplied(name, level)
+    source_height, source_width, _ = pixels.shape
+
+    # Sum the pixels of each output pixel, then divide by their count and alpha
+    rows = np.arange(height) * source_height // height
+    columns = np.arange(width) * source_width // width
+
+    sums = np.add.reduceat(np.add.reduceat(pixels, rows, axis=0), columns, axis=1)
+    counts = (
+        np.diff(np.append(rows, source_height))[:, None, None]
+        * np.diff(np.append(columns, source_width))[None, :, None]
+    )
+    scaled = sums / counts
+
+    alpha = scaled[:, :, 3:]
+    np.divide(scaled[:, :, :3], alpha, out=scaled[:, :, :3], where=alpha > 0)
+
+    scaled.flags.writeable = False
+    return scaled
@@ -0,0 +1,246 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains a minimal PNG reader and writer built on zlib and NumPy, used by the QR renderer instead of
+an imaging library. The reader handles non-interlaced 8-bit images, which covers the logos in static/images.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import struct
+import zlib
+
+# Third Party Modules
+import numpy as np
+
+# Constants
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Channels per pixel of each 8-bit colour type: greyscale, RGB, palette, greyscale + alpha, RGBA
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+def write_png_palette(bits: np.ndarray, palette: bytes) -> bytes:
+    """
+    Writes a two-colour palette PNG with one bit per pixel.
+
+    Args:
+        bits (np.ndarray): The (height, width) boolean image, True for the second palette colour.
+        palette (bytes): The two RGB palette colours (6 bytes).
+
+    Returns:
+        bytes: The PNG image.
+    """
+    height, width = bits.shape
+
+    # Each row is preceded by filter type 0 (none)
+    rows = np.packbits(bits, axis=1)
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rows], axis=1)
+
+    return (
+        PNG_SIGNATURE
+        + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 3, 0, 0, 0))
+        + _chunk(b"PLTE", palette)
+        + _chunk(b"IDAT", zlib.compress(raw.tobytes(), 9))
+        + _chunk(b"IEND", b"")
+    )
+
+
+def write_png_rgb(width: int, height: int, strips) -> bytes:
+    """
+    Writes an 8-bit RGB PNG, compressing it strip by strip so that the raw image is never held all at once.
+
+    Args:
+        width (int): The width of the image, in pixels.
+        height (int): The height of the image, in pixels.
+        strips (iterable): (rows, width, 3) uint8 arrays, from top to bottom, adding up to the height.
+
+    Returns:
+        bytes: The PNG image.
+    """
+    compressor = zlib.compressobj(6)
+    compressed = []
+
+    for strip in strips:
+        # Filter type 1 (sub) stores the difference with the pixel to the left, which turns flat colour and
+        # smooth gradients into runs of zeros
+        filtered = strip.copy()
+        filtered[:, 1:] -= strip[:, :-1]
+
+        raw = np.empty((len(strip), width * 3 + 1), dtype=np.uint8)
+        raw[:, 0] = 1
+        raw[:, 1:] = filtered.reshape(len(strip), -1)
+        compressed.append(compressor.compress(raw.tobytes()))
+
+    compressed.append(compressor.flush())
+
+    return (
+        PNG_SIGNATURE
+        + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + _chunk(b"IDAT", b"".join(compressed))
+        + _chunk(b"IEND", b"")
+    )
+
+
+def _unfilter(filtered: np.ndarray, filter_types: np.ndarray) -> np.ndarray:
+    """
+    Reverses the PNG row filters of an image.
+
+    Sub, average and paeth predict each pixel from the one to its left, so a row cannot be decoded in one
+    vectorised step. Every pixel only depends on pixels to its left and above, though, so all the pixels on
+    an anti-diagonal can be decoded at once, one anti-diagonal after another. Rows are skewed (row y shifted
+    right by y) so that every anti-diagonal is contiguous, and the neighbours to the left and above of its
+    pixels are on the previous anti-diagonals.
+
+    Args:
+        filtered (np.ndarray): The (height, width, channels) filtered bytes.
+        filter_types (np.ndarray): The filter type of each row.
+
+    Returns:
+        np.ndarray: The (height, width, channels) decoded bytes.
+    """
+    height, width, channels = filtered.shape
+
+    # Skewed pixel (y, x) is at [x + y + 1, y + 1], so that anti-diagonals are contiguous; the zeros of row 0
+    # and of the anti-diagonals before each row starts stand in for the pixels outside the image
+    rows = np.arange(height)[:, None]
+    diagonals = np.arange(width)[None, :] + rows + 1
+    skewed = np.zeros((height + width + 1, height + 1, channels), dtype=np.int16)
+    source = np.zeros_like(skewed)
+    source[diagonals, rows + 1] = filtered
+
+    kinds = filter_types[:, None].astype(np.intp)
+    predictors = np.empty((5, height, channels), dtype=np.int16)
+    predictors[0] = 0
+
+    for diagonal in range(1, height + width):
+        first, last = max(1, diagonal - width + 1), min(height, diagonal) + 1
+
+        a = skewed[diagonal - 1, first:last]
+        b = skewed[diagonal - 1, first - 1 : last - 1]
+        c = skewed[diagonal - 2, first - 1 : last - 1]
+        count = last - first
+
+        predictors[1, :count] = a
+        predictors[2, :count] = b
+        np.add(a, b, out=predictors[3, :count])
+        predictors[3, :count] >>= 1
+
+        # Paeth predictor: whichever of a, b and c is closest to a + b - c
+        pa, pb, pc = np.abs(b - c), np.abs(a - c), np.abs(a + b - 2 * c)
+        predictors[4, :count] = np.where(
+            (pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c)
+        )
+
+        predicted = np.take_along_axis(
+            predictors[:, :count], kinds[None, first - 1 : last - 1], axis=0
+        )[0]
+        skewed[diagonal, first:last] = (source[diagonal, first:last] + predicted) & 0xFF
+
+    return skewed[diagonals, rows + 1].astype(np.uint8)
+
+
+def png_dimensions(data: bytes) -> tuple[int, int]:
+    """
+    Reads the size of a PNG image from its header, without decoding it.
+
+    Args:
+        data (bytes): The PNG file.
+
+    Raises:
+        ValueError: If the file is not a PNG.
+
+    Returns:
+        tuple[int, int]: The width and height of the image, in pixels.
+    """
+    if not data.startswith(PNG_SIGNATURE) or data[12:16] != b"IHDR":
+        raise ValueError("Not a PNG file.")
+
+    return struct.unpack(">II", data[16:24])
+
+
+def read_png(data: bytes) -> np.ndarray:
+    """
+    Decodes a PNG image.
+
+    Args:
+        data (bytes): The PNG file.
+
+    Raises:
+        ValueError: If the file is not a PNG, or uses a format that is not supported (bit depths other than 8,
+            or interlacing).
+
+    Returns:
+        np.ndarray: The (height, width, 4) RGBA image.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file.")
+
+    header = None
+    palette = None
+    transparency = None
+    idat = []
+
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        (length,) = struct.unpack(">I", data[offset : offset + 4])
+        kind = data[offset + 4 : offset + 8]
+        body = data[offset + 8 : offset + 8 + length]
+        offset += length + 12
+
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = np.frombuffer(body, dtype=np.uint8).reshape(-1, 3)
+        elif kind == b"tRNS":
+            transparency = np.frombuffer(body, dtype=np.uint8)
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"IEND":
+            break
+
+    if header is None:
+        raise ValueError("The PNG has no header.")
+
+    width, height, bit_depth, color_type, _, _, interlace = header
+
+    if bit_depth != 8 or color_type not in CHANNELS or interlace:
+        raise ValueError("Only non-interlaced 8-bit PNGs are supported.")
+
+    channels = CHANNELS[color_type]
+    raw = np.frombuffer(zlib.decompress(b"".join(idat)), dtype=np.uint8)
+    raw = raw.reshape(height, width * channels + 1)
+
+    pixels = _unfilter(raw[:, 1:].reshape(height, width, channels), raw[:, 0])
+
+    if color_type == 6:
+        return pixels
+    if color_type == 2:
+        alpha = np.full((height, width, 1), 255, dtype=np.uint8)
+        return np.concatenate([pixels, alpha], axis=2)
+    if color_type == 0:
+        return np.concatenate(
+            [np.repeat(pixels, 3, axis=2), np.full_like(pixels, 255)], axis=2
+        )
+    if color_type == 4:
+        return np.concatenate(
+            [np.repeat(pixels[:, :, :1], 3, axis=2), pixels[:, :, 1:]], axis=2
+        )
+
+    # Palette images, with optional per-entry transparency
+    alpha = np.full(len(palette), 255, dtype=np.uint8)
+    if transparency is not None:
+        alpha[: len(transparency)] = transparency
+    rgba = np.concatenate([palette, alpha[:, None]], axis=1)
+    return rgba[pixels[:, :, 0]]
@@ -0,0 +1,109 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file contains the QR rendering pool. Bulk generation renders in separate processes, so that a large batch
+uses every core without holding the GIL that the request threads need.
+
+This module is imported by the pool's worker processes, so it must stay free of app and database imports.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# QR Code Modules
+from qr.encoder import encode
+from qr.render import render_matrix
+
+# Constants
+QR_WORKERS = int(os.getenv("qr_workers", os.cpu_count() or 1))
+
+# The pool is created on first use, in the process that uses it
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Returns the rendering pool, creating it on first use.
+
+    Returns:
+        ProcessPoolExecutor: The pool shared by the whole process.
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Workers are spawned rather than forked, as forking a process with running request
+                # threads can copy locks in a held state
+                _executor = ProcessPoolExecutor(
+                    max_workers=QR_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+
+    return _executor
+
+
+def reset_executor(broken: ProcessPoolExecutor) -> None:
+    """
+    Drops a pool that has broken (e.g. a worker was killed), so that the next batch starts a new one.
+
+    Args:
+        broken (ProcessPoolExecutor): The pool that broke.
+
+    Returns:
+        None
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+
+
+def _reset_after_fork() -> None:
+    # The parent's pool (its workers and management thread) stays with the parent, a forked child starts
+    # its own on first use
+    global _executor, _executor_lock
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def render_chunk(
+    items: list, ec_level: str, fmt: str, size: int | None, style: dict
+) -> list:
+    """
+    Renders a chunk of a batch. Runs in a worker process.
+
+    Args:
+        items (list): The (index, payload) pairs to render.
+        ec_level (str): The error correction level.
+        fmt (str): The output format ("svg" or "png").
+        size (int | None): The size of PNG renders, in pixels.
+        style (dict): The complete render style.
+
+    Returns:
+        list: An (index, output, error) triple per item, with either the output or the error set.
+    """
+    results = []
+
+    for index, payload in items:
+        try:
+            output = render_matrix(encode(payload, ec_level), fmt, size, style)
+        except ValueError as e:
+            results.append((index, None, str(e)))
+        else:
+            results.append((index, output, None))
+
+    return results
@@ -0,0 +1,494 @@
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
+
+This file renders QR code module matrices (from qr/encoder.py) as SVG and PNG. Plain square codes are written
+as two-colour palette PNGs with one bit per pixel; styled codes (rounded or dotted modules, gradients and
+logos) are rasterised with NumPy, a strip of rows at a time, with anti-aliased shapes. SVG paths merge each
+horizontal run of dark modules into one shape instead of drawing every module.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import math
+import re
+
+# Third Party Modules
+import numpy as np
+
+# QR Code Modules
+from qr.logo import LOGOS, logo_aspect, logo_data_uri, scaled_logo
+from qr.png import write_png_palette, write_png_rgb
+
+# Constants
+FORMATS = {"svg": "image/svg+xml", "png": "image/png"}
+
+DEFAULT_STYLE = {
+    "dark": "#000000",
+    "light": "#ffffff",
+    "border": 4,
+    "shape": "square",
+    "gradient": "none",
+    "gradient_to": None,
+    "logo": None,
+    "logo_size": 0.2,
+}
+
+SHAPES = ("square", "rounded", "dots")
+GRADIENTS = ("none", "linear", "radial")
+
+# Covering the middle of the code with a logo destroys modules, which only the higher levels can recover
+LOGO_EC_LEVELS = ("Q", "H")
+
+# Logo width, as a fraction of the width of the code
+MIN_LOGO_SIZE = 0.1
+MAX_LOGO_SIZE = 0.3
+
+# The largest PNG rendered, in pixels per side
+MAX_PNG_SIZE = 4096
+
+# Styled PNGs are rasterised in strips of about this many pixels, bounding the memory used
+STRIP_PIXELS = 256 * 1024
+
+# Radius of the dots of the "dots" shape, in modules
+DOT_RADIUS = 0.45
+
+# Size of the finder patterns, which are always drawn square so that scanners find the code
+FINDER_SIZE = 7
+
+COLOR_PATTERN = re.compile(r"^#[0-9a-fA-F]{6}$")
+
+
+def normalise_style(style: dict | None) -> dict:
+    """
+    Fills in the defaults of a render style and validates it.
+
+    Args:
+        style (dict | None): The style, with any of "dark" and "light" (#rrggbb colours), "border" (the quiet
+            zone, in modules), "shape" ("square", "rounded" or "dots"), "gradient" ("none", "linear" or
+            "radial", from the dark colour to "gradient_to"), "logo" (see qr.logo.LOGOS) and "logo_size"
+            (the width of the logo, as a fraction of the width of the code).
+
+    Raises:
+        ValueError: If the style is invalid.
+
+    Returns:
+        dict: The complete style.
+    """
+    style = {**DEFAULT_STYLE, **(style or {})}
+
+    unknown = set(style) - set(DEFAULT_STYLE)
+    if unknown:
+        raise ValueError(f"Unknown style options: {', '.join(sorted(unknown))}.")
+
+    for key in ("dark", "light"):
+        if not isinstance(style[key], str) or not COLOR_PATTERN.match(style[key]):
+            raise ValueError(f"The {key} colour must be a #rrggbb colour.")
+        style[key] = style[key].lower()
+
+    if not isinstance(style["border"], int) or not 0 <= style["border"] <= 16:
+        raise ValueError("The border must be between 0 and 16 modules.")
+
+    if style["shape"] not in SHAPES:
+        raise ValueError(f"The shape must be one of {', '.join(SHAPES)}.")
+
+    if style["gradient"] not in GRADIENTS:
+        raise ValueError(f"The gradient must be one of {', '.join(GRADIENTS)}.")
+
+    if style["gradient"] == "none":
+        style["gradient_to"] = None
+    elif not isinstance(style["gradient_to"], str) or not COLOR_PATTERN.match(
+        style["gradient_to"]
+    ):
+        raise ValueError("The gradient_to colour must be a #rrggbb colour.")
+    else:
+        style["gradient_to"] = style["gradient_to"].lower()
+
+    if style["logo"] is not None and style["logo"] not in LOGOS:
+        raise ValueError(f"The logo must be one of {', '.join(LOGOS)}.")
+
+    logo_size = style["logo_size"]
+    if (
+        isinstance(logo_size, bool)
+        or not isinstance(logo_size, (int, float))
+        or not MIN_LOGO_SIZE <= logo_size <= MAX_LOGO_SIZE
+    ):
+        raise ValueError(
+            f"The logo size must be between {MIN_LOGO_SIZE} and {MAX_LOGO_SIZE}."
+        )
+    style["logo_size"] = float(logo_size)
+
+    return style
+
+
+def check_logo(style: dict, ec_level: str) -> None:
+    """
+    Checks that a code with the given style can still be scanned at an error correction level.
+
+    Args:
+        style (dict): The complete render style.
+        ec_level (str): The error correction level.
+
+    Raises:
+        ValueError: If the style has a logo and the level is too low to recover the modules it covers.
+
+    Returns:
+        None
+    """
+    if style["logo"] is not None and ec_level not in LOGO_EC_LEVELS:
+        raise ValueError(
+            f"Codes with a logo need error correction level {' or '.join(LOGO_EC_LEVELS)}."
+        )
+
+
+def _hex_to_rgb(color: str) -> bytes:
+    return bytes.fromhex(color[1:])
+
+
+def _is_plain(style: dict) -> bool:
+    return (
+        style["shape"] == "square"
+        and style["gradient"] == "none"
+        and style["logo"] is None
+    )
+
+
+def _logo_box(count: int, style: dict) -> tuple[int, int, int, int] | None:
+    """
+    Places the logo of a style in the middle of a code.
+
+    The box is sized in whole modules, with the same parity as the module count so that it is centred.
+
+    Args:
+        count (int): The number of modules per side, without the border.
+        style (dict): The complete render style.
+
+    Returns:
+        tuple[int, int, int, int] | None: The x, y, width and height of the box, in modules, or None if the
+            style has no logo.
+    """
+    if style["logo"] is None:
+        return None
+
+    def fit(length: float) -> int:
+        parity = count % 2
+        return max(1, round((length - parity) / 2) * 2 + parity)
+
+    width = fit(count * style["logo_size"])
+    height = fit(width / logo_aspect(style["logo"]))
+    return (count - width) // 2, (count - height) // 2, width, height
+
+
+def _finder_mask(count: int) -> np.ndarray:
+    mask = np.zeros((count, count), dtype=bool)
+    mask[:FINDER_SIZE, :FINDER_SIZE] = True
+    mask[:FINDER_SIZE, -FINDER_SIZE:] = True
+    mask[-FINDER_SIZE:, :FINDER_SIZE] = True
+    return mask
+
+
+def _prepare(matrix: np.ndarray, style: dict):
+    """
+    Clears the modules under the logo and pads the matrix and the finder mask with the border.
+
+    Returns:
+        tuple: The padded module matrix, the padded finder mask, and the logo box (see _logo_box).
+    """
+    count = matrix.shape[0]
+    border = style["border"]
+    box = _logo_box(count, style)
+
+    if box is not None:
+        x, y, width, height = box
+        matrix = matrix.copy()
+        matrix[y : y + height, x : x + width] = False
+
+    return np.pad(matrix, border), np.pad(_finder_mask(count), border), box
+
+
+def _runs(mask: np.ndarray) -> tuple[list, list, list]:
+    """
+    Finds the horizontal runs of True values in a boolean matrix.
+
+    Returns:
+        tuple[list, list, list]: The row, first column and length of every run, row by row.
+    """
+    edges = np.diff(np.pad(mask, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    return rows.tolist(), starts.tolist(), (ends - starts).tolist()
+
+
+def render_svg(matrix: np.ndarray, style: dict | None = None) -> bytes:
+    """
+    Renders a QR code as an SVG, scaled to fit its container.
+
+    Args:
+        matrix (np.ndarray): The boolean module matrix.
+        style (dict | None): The render style (see normalise_style).
+
+    Returns:
+        bytes: The SVG document.
+    """
+    style = normalise_style(style)
+    border = style["border"]
+    count = matrix.shape[0]
+    width = count + border * 2
+
+    modules, finders, box = _prepare(matrix, style)
+    shape = style["shape"]
+
+    # Finder patterns, and every module of square codes, are drawn as one rectangle per run
+    squares = modules if shape == "square" else modules & finders
+    path = [f"M{x} {y}h{n}v1h-{n}z" for y, x, n in zip(*_runs(squares))]
+
+    if shape == "rounded":
+        # One pill per run: half circles at both ends, joined by the straight part of the run
+        path.extend(
+            f"M{x}.5 {y}h{n - 1}a.5.5 0 0 1 0 1h{1 - n}a.5.5 0 0 1 0-1z"
+            for y, x, n in zip(*_runs(modules & ~finders))
+        )
+    elif shape == "dots":
+        ys, xs = np.nonzero(modules & ~finders)
+        path.extend(
+            f"M{x}.05 {y}.5a.45.45 0 1 0 .9 0a.45.45 0 1 0-.9 0z"
+            for y, x in zip(ys.tolist(), xs.tolist())
+        )
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {width}"'
+        + (' shape-rendering="crispEdges">' if shape == "square" else ">")
+    ]
+
+    fill = style["dark"]
+    if style["gradient"] == "linear":
+        end = border + count
+        parts.append(
+            f'<defs><linearGradient id="g" gradientUnits="userSpaceOnUse" x1="{border}" y1="{border}" '
+            f'x2="{end}" y2="{end}"><stop offset="0" stop-color="{style["dark"]}"/>'
+            f'<stop offset="1" stop-color="{style["gradient_to"]}"/></linearGradient></defs>'
+        )
+        fill = "url(#g)"
+    elif style["gradient"] == "radial":
+        parts.append(
+            f'<defs><radialGradient id="g" gradientUnits="userSpaceOnUse" cx="{width / 2:g}" '
+            f'cy="{width / 2:g}" r="{count / math.sqrt(2):.3f}"><stop offset="0" stop-color="{style["dark"]}"/>'
+            f'<stop offset="1" stop-color="{style["gradient_to"]}"/></radialGradient></defs>'
+        )
+        fill = "url(#g)"
+
+    parts.append(f'<rect width="{width}" height="{width}" fill="{style["light"]}"/>')
+    parts.append(f'<path fill="{fill}" d="{"".join(path)}"/>')
+
+    if box is not None:
+        x, y, box_width, box_height = box
+        parts.append(
+            f'<image href="{logo_data_uri(style["logo"])}" x="{x + border}" y="{y + border}" '
+            f'width="{box_width}" height="{box_height}" preserveAspectRatio="xMidYMid meet"/>'
+        )
+
+    parts.append("</svg>")
+    return "".join(parts).encode()
+
+
+def _coverage(distance: np.ndarray, pixel: float) -> np.ndarray:
+    """
+    Converts signed distances to the edge of a shape (negative inside) into anti-aliased pixel coverage.
+    """
+    return np.clip(0.5 - distance / pixel, 0, 1)
+
+
+def _styled_strips(
+    modules: np.ndarray,
+    finders: np.ndarray,
+    size: int,
+    style: dict,
+    box: tuple | None,
+):
+    """
+    Rasterises a styled QR code, a strip of rows at a time.
+
+    Every pixel is sampled at its centre: the module it falls in and its position inside that module decide
+    how much of it the module's shape covers, and the gradient decides the colour of the dark modules.
+
+    Yields:
+        np.ndarray: (rows, size, 3) uint8 strips of the image, from top to bottom.
+    """
+    width = modules.shape[0]
+    border = style["border"]
+    count = width - border * 2
+    pixel = width / size
+
+    # Module coordinates of the pixel centres, shared by rows and columns
+    position = ((np.arange(size) + 0.5) * pixel).astype(np.float32)
+    index = np.minimum(position.astype(np.intp), width - 1)
+    offset = position - index
+
+    # Module rows scaled horizontally to pixel columns, so that a strip only has to pick its rows
+    shaped = modules & ~finders
+    dark_columns = modules[:, index]
+    shaped_columns = shaped[:, index]
+
+    # Runs of rounded modules are joined to their dark neighbours on either side, and only the ends of runs
+    # (the left half of their first module and the right half of their last) are rounded
+    joined_left = shaped & np.pad(shaped, ((0, 0), (1, 0)))[:, :-1]
+    joined_right = shaped & np.pad(shaped, ((0, 0), (0, 1)))[:, 1:]
+    rounded_columns = shaped_columns & np.where(
+        offset < 0.5, ~joined_left[:, index], ~joined_right[:, index]
+    )
+
+    light = np.frombuffer(_hex_to_rgb(style["light"]), dtype=np.uint8).astype(
+        np.float32
+    )
+    dark = np.frombuffer(_hex_to_rgb(style["dark"]), dtype=np.uint8).astype(np.float32)
+    if style["gradient"] != "none":
+        gradient_to = np.frombuffer(
+            _hex_to_rgb(style["gradient_to"]), dtype=np.uint8
+        ).astype(np.float32)
+
+    # Pixel rectangle of the logo, fitted inside its box keeping its aspect ratio
+    logo = None
+    if box is not None:
+        x, y, box_width, box_height = box
+        left = round((x + border) / pixel)
+        top = round((y + border) / pixel)
+        right = round((x + border + box_width) / pixel)
+        bottom = round((y + border + box_height) / pixel)
+
+        aspect = logo_aspect(style["logo"])
+        logo_width = min(right - left, round((bottom - top) * aspect))
+        logo_height = min(bottom - top, round((right - left) / aspect))
+
+        if logo_width > 0 and logo_height > 0:
+            left += (right - left - logo_width) // 2
+            top += (bottom - top - logo_height) // 2
+            logo = (
+                left,
+                top,
+                scaled_logo(style["logo"], logo_width, logo_height),
+            )
+
+    shades = (
+        light + (dark - light) * (np.arange(256, dtype=np.float32)[:, None] / 255) + 0.5
+    ).astype(np.uint8)
+
+    step = max(1, STRIP_PIXELS // size)
+
+    for first in range(0, size, step):
+        rows = slice(first, min(size, first + step))
+        ys = index[rows]
+
+        coverage = dark_columns[ys].astype(np.float32)
+
+        if style["shape"] != "square":
+            # Distance of every pixel centre from the centre of its module
+            circle = np.hypot(offset[rows, None] - 0.5, offset[None, :] - 0.5)
+
+            if style["shape"] == "dots":
+                np.copyto(
+                    coverage,
+                    _coverage(circle - DOT_RADIUS, pixel),
+                    where=shaped_columns[ys],
+                )
+            else:
+                np.copyto(
+                    coverage, _coverage(circle - 0.5, pixel), where=rounded_columns[ys]
+                )
+
+        if style["gradient"] == "none":
+            # A single dark colour: look the colour of every coverage level up in a table
+            levels = (coverage * 255 + 0.5).astype(np.uint8)
+            strip = shades[levels]
+        else:
+            # Gradient position of every pixel, matching the SVG gradients
+            py = position[rows, None] - border
+            px = position[None, :] - border
+            if style["gradient"] == "linear":
+                t = np.clip((px + py) / (2 * count), 0, 1)
+            else:
+                t = np.clip(
+                    np.hypot(px - count / 2, py - count / 2) / (count / math.sqrt(2)),
+                    0,
+                    1,
+                )
+            foreground = dark + (gradient_to - dark) * t[:, :, None]
+            strip = light + (foreground - light) * coverage[:, :, None]
+            strip = (strip + 0.5).astype(np.uint8)
+
+        if logo is not None:
+            left, top, pixels = logo
+            start, end = max(first, top), min(rows.stop, top + len(pixels))
+            if start < end:
+                part = pixels[start - top : end - top]
+                region = strip[start - first : end - first, left : left + part.shape[1]]
+                alpha = part[:, :, 3:]
+                region[:] = region * (1 - alpha) + part[:, :, :3] * 255 * alpha + 0.5
+
+        yield strip
+
+
+def render_png(matrix: np.ndarray, size: int, style: dict | None = None) -> bytes:
+    """
+    Renders a QR code as a PNG of the given size.
+
+    Args:
+        matrix (np.ndarray): The boolean module matrix.
+        size (int): The width and height of the image, in pixels. Square modules are scaled by nearest
+            neighbour, so sizes that are a multiple of the module count (including the border) give the
+            sharpest result.
+        style (dict | None): The render style (see normalise_style).
+
+    Raises:
+        ValueError: If the size is out of range.
+
+    Returns:
+        bytes: The PNG image.
+    """
+    style = normalise_style(style)
+    border = style["border"]
+    width = matrix.shape[0] + border * 2
+
+    if not width <= size <= MAX_PNG_SIZE:
+        raise ValueError(f"The size must be between {width} and {MAX_PNG_SIZE} pixels.")
+
+    if not _is_plain(style):
+        modules, finders, box = _prepare(matrix, style)
+        return write_png_rgb(
+            size, size, _styled_strips(modules, finders, size, style, box)
+        )
+
+    # Scale the bordered matrix to the requested size, mapping each pixel to the module it falls in
+    modules = np.pad(matrix, border)
+    index = np.arange(size) * width // size
+    pixels = modules[index[:, None], index[None, :]]
+
+    # Palette index 1 (dark) or 0 (light)
+    palette = _hex_to_rgb(style["light"]) + _hex_to_rgb(style["dark"])
+    return write_png_palette(pixels, palette)
+
+
+def render_matrix(
+    matrix: np.ndarray, fmt: str, size: int | None, style: dict | None = None
+) -> bytes:
+    """
+    Renders a QR code in the given format.
+
+    Args:
+        matrix (np.ndarray): The boolean module matrix.
+        fmt (str): The output format ("svg" or "png").
+        size (int | None): The width and height of PNG renders, in pixels (ignored for SVGs).
+        style (dict | None): The render style (see normalise_style).
+
+    Raises:
+        ValueError: If the format, size or style is invalid.
+
+    Returns:
+        bytes: The rendered output.
+    """
+    if fmt == "png":
+        return render_png(matrix, size, style)
+    if fmt == "svg":
+        return render_svg(matrix, style)
+
+    raise ValueError("The format must be svg or png.")
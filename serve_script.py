@@ -1,4 +1,291 @@
-from waitress import serve
-from app import app
+"""
+(c) 2024 Zachariah Michael Lagden (All Rights Reserved)
+You may not use, copy, distribute, modify, or sell this code without the express permission of the author.
 
-serve(app, host="0.0.0.0", port=55444)
+This is the production server. With waitress_workers above 1 it runs a pre-forking master: the app is
+imported (and its templates compiled) once, then that many worker processes are forked, each serving the
+shared listening socket with its own waitress thread pool. Workers share the preloaded app's memory pages
+until they write to them, and password hashing, rendering and minification spread over several GILs.
+
+Signals sent to the master:
+    SIGTERM, SIGINT: stop accepting connections, let every worker finish the requests it has in flight (up
+        to waitress_graceful_timeout seconds), then exit.
+    SIGHUP: replace the workers one at a time with fresh ones forked from the master, each old worker
+        draining as above. Code changes need a restart of the master, which holds the preloaded app.
+"""
+
+# Import the required modules
+
+# Python Standard Library
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+# Third Party Modules
+from waitress import create_server, serve
+
+# Constants
+HOST = os.getenv("waitress_host", "0.0.0.0")
+PORT = int(os.getenv("waitress_port", 55444))
+
+# Worker processes, and request threads per worker (the admission control caps are fractions of the latter)
+WORKERS = int(os.getenv("waitress_workers", 1))
+THREADS = int(os.getenv("waitress_threads", 16))
+
+# How long a stopping worker waits for its requests in flight before it exits anyway
+GRACEFUL_TIMEOUT = float(os.getenv("waitress_graceful_timeout", 30))
+
+# Pending connections queued by the kernel on the shared socket
+BACKLOG = int(os.getenv("waitress_backlog", 1024))
+
+# Workers that exit sooner than this after starting are restarted after a pause, not straight away
+MIN_WORKER_LIFETIME = 1.0
+
+
+def _preload(app) -> None:
+    """
+    Does the per-process work of the app once in the master, so that forked workers start warm and share it.
+    """
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    # Objects that exist before the fork are never collected in the workers; without this, the first
+    # collection in each worker writes to (and so copies) every page holding them
+    gc.collect()
+    gc.freeze()
+
+
+def _run_worker(app, sock: socket.socket) -> None:
+    """
+    Serves requests on the shared socket until told to stop, then drains the connections in flight.
+
+    Runs in a forked worker process, and never returns.
+    """
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Started here rather than in the master, which serves no requests and must fork without threads running
+    from app import start_background_services
+
+    start_background_services()
+
+    server = create_server(app, sockets=[sock], threads=THREADS, backlog=BACKLOG)
+    adj = server.adj
+
+    # The loop is run here, one poll at a time, so that a stop request is noticed within one poll timeout
+    while not stopping:
+        server.asyncore.loop(
+            timeout=adj.asyncore_loop_timeout,
+            map=server._map,
+            use_poll=adj.asyncore_use_poll,
+            count=1,
+        )
+
+    # Stop accepting (other workers keep serving the socket) and close connections as they become idle
+    server.accepting = False
+    server.del_channel()
+    server.socket.close()
+
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT
+    while server.active_channels and time.monotonic() < deadline:
+        for channel in list(server.active_channels.values()):
+            if not channel.requests:
+                channel.will_close = True
+
+        server.asyncore.loop(
+            timeout=adj.asyncore_loop_timeout,
+            map=server._map,
+            use_poll=adj.asyncore_use_poll,
+            count=1,
+        )
+
+    server.task_dispatcher.shutdown(timeout=max(0.0, deadline - time.monotonic()))
+
+    # Exit through sys.exit so that the exit handlers (scan counter, logging) flush what they buffered
+    sys.exit(0)
+
+
+class Master:
+    """
+    Forks the workers, replaces the ones that exit, and relays stop and reload signals to them.
+    """
+
+    def __init__(self, app, sock: socket.socket, workers: int) -> None:
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+
+        # Worker pid: time it was started
+        self.children = {}
+
+        # Workers told to stop by a reload, which must not be replaced when they exit
+        self.retired = set()
+
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self) -> int:
+        pid = os.fork()
+
+        if pid == 0:
+            # Never returns: the worker exits once it has drained, or with the exception that stopped it
+            _run_worker(self.app, self.sock)
+
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def _signal(self, pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self) -> list[tuple[int, float]]:
+        """
+        Collects the workers that have exited.
+
+        Returns:
+            list[tuple[int, float]]: The pid and lifetime of every worker that exited.
+        """
+        exited = []
+
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+
+            started_at = self.children.pop(pid, None)
+            if started_at is not None:
+                exited.append((pid, time.monotonic() - started_at))
+
+        return exited
+
+    def _wait_for(self, pids: set, timeout: float) -> list[tuple[int, float]]:
+        """
+        Waits for some workers to exit, collecting every worker that exits meanwhile.
+
+        Returns:
+            list[tuple[int, float]]: The pid and lifetime of every worker that exited, waited for or not.
+        """
+        exited = []
+
+        deadline = time.monotonic() + timeout
+        while pids & self.children.keys() and time.monotonic() < deadline:
+            exited.extend(self._reap())
+            time.sleep(0.1)
+
+        return exited
+
+    def reload(self) -> list[tuple[int, float]]:
+        """
+        Replaces every worker, one at a time, so that there is always a full set serving.
+
+        Returns:
+            list[tuple[int, float]]: The pid and lifetime of every worker that exited meanwhile, including
+                the retired ones and any that crashed.
+        """
+        exited = []
+
+        for pid in list(self.children):
+            if self.stopping:
+                break
+
+            # Crashed since the reload started, and replaced by the main loop
+            if pid not in self.children:
+                continue
+
+            self.spawn()
+            self.retired.add(pid)
+            self._signal(pid, signal.SIGTERM)
+            exited.extend(self._wait_for({pid}, GRACEFUL_TIMEOUT + 5))
+
+        return exited
+
+    def stop(self) -> None:
+        """
+        Drains and stops every worker, killing those that have not exited in time.
+        """
+        pids = set(self.children)
+        for pid in pids:
+            self._signal(pid, signal.SIGTERM)
+
+        self._wait_for(pids, GRACEFUL_TIMEOUT + 5)
+
+        for pid in pids & self.children.keys():
+            self._signal(pid, signal.SIGKILL)
+        self._wait_for(pids, 5)
+
+    def run(self) -> None:
+        def request_stop(signum, frame):
+            self.stopping = True
+
+        def request_reload(signum, frame):
+            self.reloading = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+
+        for _ in range(self.workers):
+            self.spawn()
+
+        while not self.stopping:
+            exited = []
+
+            if self.reloading:
+                self.reloading = False
+                exited = self.reload()
+
+            for pid, lifetime in exited + self._reap():
+                if self.stopping:
+                    break
+
+                # Replaced by the reload already (possibly after the reload gave up waiting for it)
+                if pid in self.retired:
+                    self.retired.discard(pid)
+                    continue
+
+                # A worker that crashes on startup would otherwise be restarted in a tight loop
+                if lifetime < MIN_WORKER_LIFETIME:
+                    time.sleep(MIN_WORKER_LIFETIME)
+                self.spawn()
+
+            time.sleep(0.2)
+
+        self.stop()
+
+
+# The app is only imported when run as a script, as worker processes (e.g. the password pool) re-import
+# this module
+if __name__ == "__main__":
+    from app import app, start_background_services
+
+    if WORKERS <= 1 or not hasattr(os, "fork"):
+        # Stop serving on SIGTERM as on SIGINT, so that the exit handlers flush what they buffered rather
+        # than the process being killed outright
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        start_background_services()
+        serve(app, host=HOST, port=PORT, threads=THREADS, backlog=BACKLOG)
+        sys.exit(0)
+
+    _preload(app)
+
+    # The master binds the socket once, and every worker accepts connections from it
+    listener = socket.create_server((HOST, PORT), backlog=BACKLOG)
+    listener.setblocking(False)
+
+    Master(app, listener, WORKERS).run()